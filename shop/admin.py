@@ -1,44 +1,142 @@
 from django.contrib import admin
 
-from .models import (Cart, CartItem, Customer, Order, OrderItem, Payment,
-                     Product)
+from .forms import ProductForm
+from .jobs import TASKS
+from .models import (Cart, CartItem, Customer, Job, Order, OrderItem, Payment,
+                     PaymentRequest, Product, StockReservation)
+from .pagination import EstimatedCountPaginator
+from .search import search_filter
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables that grow with every order: estimated
+    counts, no second ``COUNT(*)`` for the unfiltered total, and foreign
+    keys picked by id or autocomplete instead of a <select> of every row.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    # A number typed in the search box is looked up in this id column
+    id_search_field = None
+
+    def get_search_fields(self, request):
+        if self.id_search_field and not self.search_fields:
+            return (self.id_search_field,)
+        return super().get_search_fields(request)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if self.id_search_field and term.isdigit():
+            # Jedno trafienie w indeks zamiast LIKE po rzutowanym id
+            return queryset.filter(**{self.id_search_field: int(term)}), False
+        if term and not self.search_fields:
+            return queryset.none(), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+class TaskFilter(admin.SimpleListFilter):
+    # Lista zadań z rejestru, bez SELECT DISTINCT po całej tabeli
+    title = "task"
+    parameter_name = "task"
+
+    def lookups(self, request, model_admin):
+        return [(name, name) for name in sorted(TASKS)]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(task=self.value())
+        return queryset
 
 
 class ProductAdmin(admin.ModelAdmin):
+    form = ProductForm
     list_display = ("name", "description", "price", "stock")
     search_fields = ("name", "description")
 
+    def get_search_results(self, request, queryset, search_term):
+        # Indeks pełnotekstowy zamiast icontains po całej tabeli
+        if not search_term:
+            return queryset, False
+        return queryset.filter(search_filter(search_term, queryset.db)), False
 
-class CustomerAdmin(admin.ModelAdmin):
-    list_display = ("first_name", "email")
-    search_fields = ("first_name", "email")
+    def save_model(self, request, obj, form, change):
+        if change:
+            form.save()
+        else:
+            super().save_model(request, obj, form, change)
 
 
-class OrderAdmin(admin.ModelAdmin):
-    list_display = ("customer", "created_at")
-    list_filter = ("customer", "created_at")
-    search_fields = ("customer__name",)
+class CustomerAdmin(LargeTableAdmin):
+    list_display = ("first_name", "last_name", "email")
+    # Dokładny e-mail korzysta z indeksu na UPPER(email); wyszukiwania po
+    # nazwisku nie ma, bo UPPER(last_name) LIKE 'x%' nie trafia w żaden indeks
+    search_fields = ("=email",)
+    raw_id_fields = ("user",)
 
 
-class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ("order", "product", "quantity")
-    list_filter = ("order",)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ("id", "customer", "created_at", "total", "paid")
+    list_select_related = ("customer",)
+    list_filter = ("paid",)
+    date_hierarchy = "created_at"
+    id_search_field = "pk"
+    search_fields = ("=customer__email",)
+    autocomplete_fields = ("customer",)
 
 
-class PaymentAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ("order", "product", "quantity", "line_total")
+    list_select_related = ("order", "product")
+    id_search_field = "order_id"
+    raw_id_fields = ("order",)
+    autocomplete_fields = ("product",)
+
+
+class PaymentAdmin(LargeTableAdmin):
     list_display = ("order", "amount", "paid_at")
-    list_filter = ("paid_at",)
-    search_fields = ("paid_at__id",)
+    list_select_related = ("order",)
+    date_hierarchy = "paid_at"
+    id_search_field = "order_id"
+    raw_id_fields = ("order",)
+
+
+class PaymentRequestAdmin(LargeTableAdmin):
+    list_display = ("idempotency_key", "order", "amount", "status", "attempts")
+    list_select_related = ("order",)
+    list_filter = ("status",)
+    id_search_field = "order_id"
+    search_fields = ("=idempotency_key",)
+    raw_id_fields = ("order",)
 
 
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(LargeTableAdmin):
     list_display = ("user", "created_at")
-    search_fields = ("user__username",)
+    list_select_related = ("user",)
+    search_fields = ("=user__username",)
+    raw_id_fields = ("user",)
 
 
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(LargeTableAdmin):
     list_display = ("cart", "product", "quantity")
-    list_filter = ("cart", "product")
+    list_select_related = ("cart__user", "product")
+    search_fields = ("=cart__user__username",)
+    raw_id_fields = ("cart",)
+    autocomplete_fields = ("product",)
+
+
+class StockReservationAdmin(LargeTableAdmin):
+    list_display = ("order", "product", "quantity", "status", "expires_at")
+    list_select_related = ("order", "product")
+    list_filter = ("status",)
+    id_search_field = "order_id"
+    raw_id_fields = ("order", "product")
+
+
+class JobAdmin(LargeTableAdmin):
+    list_display = ("task", "status", "attempts", "available_at", "created_at")
+    list_filter = ("status", TaskFilter)
 
 
 admin.site.register(Product, ProductAdmin)
@@ -46,5 +144,8 @@ admin.site.register(Customer, CustomerAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
 admin.site.register(Payment, PaymentAdmin)
+admin.site.register(PaymentRequest, PaymentRequestAdmin)
 admin.site.register(Cart, CartAdmin)
 admin.site.register(CartItem, CartItemAdmin)
+admin.site.register(StockReservation, StockReservationAdmin)
+admin.site.register(Job, JobAdmin)
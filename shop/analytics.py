@@ -0,0 +1,196 @@
+"""
+Daily sales rollups.
+
+``ProductDailySales`` and ``CustomerDailySales`` hold per-day totals for
+orders placed that day, so reports read a few rows per day instead of
+scanning order history. They are kept current incrementally:
+``record_order`` runs when an order is placed and ``record_payment`` when
+it is paid, both inside the caller's transaction. ``rebuild`` recomputes a
+date range from the orders themselves, for backfills and repairs.
+"""
+from decimal import Decimal
+from itertools import islice
+
+from django.db import connections, router, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .exports import date_range
+from .models import CustomerDailySales, OrderItem, ProductDailySales
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def units(**filters):
+    return Coalesce(Sum("quantity", filter=Q(**filters) or None), 0)
+
+
+def revenue(**filters):
+    return Coalesce(
+        Sum("line_total", filter=Q(**filters) or None, output_field=MONEY),
+        Value(Decimal("0.00")),
+        output_field=MONEY,
+    )
+
+
+def _increment(model, keys, rows):
+    """
+    Add ``rows`` (dicts of key and counter values, all with the same
+    fields) to ``model`` in one INSERT ... ON CONFLICT DO UPDATE.
+    """
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in rows[0]]
+    counters = [qn(f.column) for f in fields if f.name not in keys]
+    sql = "INSERT INTO {} ({}) VALUES {} ON CONFLICT ({}) DO UPDATE SET {}".format(
+        table,
+        ", ".join(qn(f.column) for f in fields),
+        ", ".join(["({})".format(", ".join(["%s"] * len(fields)))] * len(rows)),
+        ", ".join(qn(model._meta.get_field(name).column) for name in keys),
+        ", ".join(f"{c} = {table}.{c} + excluded.{c}" for c in counters),
+    )
+    params = [
+        f.get_db_prep_save(row[f.name], connection) for row in rows for f in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _record(order, paid_only):
+    day = timezone.localdate(order.created_at)
+    lines = list(
+        OrderItem.objects.filter(order=order)
+        .values("product_id")
+        .annotate(units=units(), revenue=revenue())
+        .order_by("product_id")
+    )
+    if not lines:
+        return
+    paid = paid_only or order.paid
+    zero = Decimal("0.00")
+    products = [
+        {
+            "date": day,
+            "product": line["product_id"],
+            "units": 0 if paid_only else line["units"],
+            "revenue": zero if paid_only else line["revenue"],
+            "paid_units": line["units"] if paid else 0,
+            "paid_revenue": line["revenue"] if paid else zero,
+        }
+        for line in lines
+    ]
+    total_units = sum(line["units"] for line in lines)
+    total = sum(line["revenue"] for line in lines)
+    customer = {
+        "date": day,
+        "customer": order.customer_id,
+        "orders": 0 if paid_only else 1,
+        "units": 0 if paid_only else total_units,
+        "revenue": zero if paid_only else total,
+        "paid_orders": 1 if paid else 0,
+        "paid_revenue": total if paid else zero,
+    }
+    _increment(ProductDailySales, ["date", "product"], products)
+    _increment(CustomerDailySales, ["date", "customer"], [customer])
+
+
+def record_order(order):
+    """Count a newly placed order, and its payment too if it is already paid."""
+    _record(order, paid_only=False)
+
+
+def record_payment(order):
+    """Move a placed order's totals into the paid columns."""
+    _record(order, paid_only=True)
+
+
+def _batched_create(model, rows, batch_size):
+    rows = iter(rows)
+    created = 0
+    while True:
+        batch = [model(**row) for row in islice(rows, batch_size)]
+        if not batch:
+            return created
+        model.objects.bulk_create(batch)
+        created += len(batch)
+
+
+def rebuild(start=None, end=None, batch_size=1000):
+    """
+    Recompute the rollups for orders placed from ``start`` to ``end``
+    (whole days, both optional) and return ``(product_rows, customer_rows)``.
+    """
+    items = OrderItem.objects.annotate(date=TruncDate("order__created_at"))
+    rollups = [ProductDailySales.objects.all(), CustomerDailySales.objects.all()]
+    start_at, end_at = date_range(start, end)
+    if start:
+        items = items.filter(order__created_at__gte=start_at)
+        rollups = [rows.filter(date__gte=start) for rows in rollups]
+    if end:
+        items = items.filter(order__created_at__lt=end_at)
+        rollups = [rows.filter(date__lte=end) for rows in rollups]
+
+    products = (
+        items.values("date", "product_id")
+        .annotate(
+            units=units(),
+            revenue=revenue(),
+            paid_units=units(order__paid=True),
+            paid_revenue=revenue(order__paid=True),
+        )
+        .order_by()
+    )
+    customers = (
+        items.values("date", customer_id=F("order__customer_id"))
+        .annotate(
+            orders=Count("order_id", distinct=True),
+            units=units(),
+            revenue=revenue(),
+            paid_orders=Count("order_id", distinct=True, filter=Q(order__paid=True)),
+            paid_revenue=revenue(order__paid=True),
+        )
+        .order_by()
+    )
+    with transaction.atomic():
+        for rows in rollups:
+            rows.delete()
+        return (
+            _batched_create(ProductDailySales, products.iterator(), batch_size),
+            _batched_create(CustomerDailySales, customers.iterator(), batch_size),
+        )
+
+
+def sales_report(start, end, limit=10):
+    """Daily totals and the top products and customers, from rollups only."""
+    products = ProductDailySales.objects.filter(date__gte=start, date__lte=end)
+    customers = CustomerDailySales.objects.filter(date__gte=start, date__lte=end)
+    sums = {
+        "units": Sum("units"),
+        "revenue": Sum("revenue"),
+        "paid_revenue": Sum("paid_revenue"),
+    }
+    days = list(products.values("date").annotate(**sums).order_by("date"))
+    return {
+        "days": days,
+        "totals": {name: sum(day[name] for day in days) for name in sums},
+        "products": list(
+            products.values("product_id", "product__name")
+            .annotate(**sums)
+            .order_by("-revenue", "product_id")[:limit]
+        ),
+        "customers": list(
+            customers.values(
+                "customer_id", "customer__first_name", "customer__last_name"
+            )
+            .annotate(
+                orders=Sum("orders"),
+                revenue=Sum("revenue"),
+                paid_revenue=Sum("paid_revenue"),
+            )
+            .order_by("-revenue", "customer_id")[:limit]
+        ),
+    }
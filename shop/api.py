@@ -0,0 +1,105 @@
+from django.utils.cache import get_conditional_response, set_response_etag
+from rest_framework import generics, permissions, viewsets
+from rest_framework.pagination import CursorPagination
+
+from .forms import ProductFilterForm
+from .models import Cart, Order, Product
+from .query_budget import query_budget
+from .serializers import CartSerializer, OrderSerializer, ProductSerializer
+
+
+class ProductCursorPagination(CursorPagination):
+    ordering = ("name", "id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+class OrderCursorPagination(ProductCursorPagination):
+    ordering = "-id"
+
+
+class ConditionalGetMixin:
+    """
+    Send an ETag with every successful GET and answer 304 when it matches
+    the client's ``If-None-Match``, so clients only download what changed.
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ("GET", "HEAD") and response.status_code == 200:
+            response.render()
+            set_response_etag(response)
+            return get_conditional_response(
+                request, etag=response["ETag"], response=response
+            )
+        return response
+
+
+class FieldSelectionMixin:
+    """``?fields=a,b`` limits the top-level fields of the response."""
+
+    def selected_fields(self):
+        fields = self.request.query_params.get("fields", "")
+        return [field for field in fields.split(",") if field]
+
+    def wants(self, field):
+        fields = self.selected_fields()
+        return not fields or field in fields
+
+    def get_serializer(self, *args, **kwargs):
+        if self.selected_fields():
+            kwargs["fields"] = self.selected_fields()
+        return super().get_serializer(*args, **kwargs)
+
+
+@query_budget(3)
+class ProductViewSet(
+    ConditionalGetMixin, FieldSelectionMixin, viewsets.ReadOnlyModelViewSet
+):
+    serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+    permission_classes = [permissions.AllowAny]
+
+    def get_queryset(self):
+        products = Product.objects.all()
+        if self.action == "list":
+            products = ProductFilterForm(self.request.query_params).filter_queryset(
+                products
+            )
+        model_fields = {field.name for field in Product._meta.concrete_fields}
+        selected = set(self.selected_fields()) & model_fields
+        if selected:
+            # Keep the ordering columns so cursor pagination still works
+            products = products.only("id", "name", *selected)
+        return products
+
+
+@query_budget(4)
+class OrderViewSet(
+    ConditionalGetMixin, FieldSelectionMixin, viewsets.ReadOnlyModelViewSet
+):
+    serializer_class = OrderSerializer
+    pagination_class = OrderCursorPagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        orders = Order.objects.filter(customer__user=self.request.user)
+        if self.wants("items"):
+            orders = orders.with_items()
+        return orders
+
+
+@query_budget(7)
+class CartView(ConditionalGetMixin, FieldSelectionMixin, generics.RetrieveAPIView):
+    serializer_class = CartSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_object(self):
+        carts = Cart.objects.with_totals()
+        if self.wants("items"):
+            carts = carts.with_items()
+        try:
+            return carts.get(user=self.request.user)
+        except Cart.DoesNotExist:
+            return Cart.objects.create(user=self.request.user)
@@ -6,4 +6,9 @@ class ShopConfig(AppConfig):
     name = "shop"
 
     def ready(self):
+        import shop.metrics
+        import shop.notifications
+        import shop.query_budget
+        import shop.recommendations
+        import shop.routers
         import shop.signals
\ No newline at end of file
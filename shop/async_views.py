@@ -0,0 +1,89 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from . import cart
+from .models import Product
+from .query_budget import query_budget
+
+
+async def _authenticated_user(request):
+    user = await sync_to_async(get_user)(request)
+    return user if user.is_authenticated else None
+
+
+def _quantity(request, default=1):
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            data = {}
+    else:
+        data = request.POST
+    try:
+        return int(data.get("quantity", default))
+    except (TypeError, ValueError):
+        return None
+
+
+async def _cart_response(request, methods, operation=None, *args):
+    if request.method not in methods:
+        return HttpResponseNotAllowed(methods)
+    user = await _authenticated_user(request)
+    if user is None:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    try:
+        # Jedno przejście do wątku ORM na całe żądanie
+        data = await sync_to_async(cart.apply)(operation, user, *args)
+    except Product.DoesNotExist:
+        return JsonResponse({"error": "Product not found."}, status=404)
+    return JsonResponse(data)
+
+
+@query_budget(3)
+async def cart_summary(request):
+    return await _cart_response(request, ["GET"])
+
+
+@query_budget(8)
+async def cart_add(request, product_id):
+    quantity = _quantity(request)
+    if quantity is None or quantity <= 0:
+        return JsonResponse({"error": "Quantity must be greater than 0."}, status=400)
+    return await _cart_response(request, ["POST"], cart.add_item, product_id, quantity)
+
+
+def _items(request):
+    try:
+        items = json.loads(request.body or b"{}").get("items")
+        return {int(pk): int(quantity) for pk, quantity in items.items()}
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+@query_budget(8)
+async def cart_add_many(request):
+    items = _items(request)
+    if not items or any(quantity <= 0 for quantity in items.values()):
+        return JsonResponse(
+            {"error": 'Send {"items": {"<product id>": <quantity>, ...}}.'},
+            status=400,
+        )
+    return await _cart_response(request, ["POST"], cart.add_items, items)
+
+
+@query_budget(9)
+async def cart_set_quantity(request, product_id):
+    quantity = _quantity(request, default=None)
+    if quantity is None or quantity < 0:
+        return JsonResponse({"error": "Quantity must be 0 or more."}, status=400)
+    return await _cart_response(
+        request, ["POST"], cart.set_quantity, product_id, quantity
+    )
+
+
+@query_budget(5)
+async def cart_remove(request, product_id):
+    return await _cart_response(request, ["POST"], cart.remove_item, product_id)
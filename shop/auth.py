@@ -0,0 +1,39 @@
+"""
+Customer profiles for logged-in users.
+
+A ``Customer`` is created the first time a user needs one (``get_customer``)
+rather than by a signal on every ``User`` save. ``CustomerBackend`` loads the
+profile together with the user on each request, so ``request.user.customer``
+costs no extra query.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from .models import Customer
+
+
+def get_customer(user):
+    """The user's ``Customer``, created on first use."""
+    try:
+        return user.customer
+    except Customer.DoesNotExist:
+        customer, created = Customer.objects.get_or_create(
+            user=user,
+            defaults={
+                "first_name": user.first_name,
+                "last_name": user.last_name,
+                "email": user.email,
+            },
+        )
+        user.customer = customer
+        return customer
+
+
+class CustomerBackend(ModelBackend):
+    def get_user(self, user_id):
+        users = get_user_model()._default_manager.select_related("customer")
+        try:
+            user = users.get(pk=user_id)
+        except users.model.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
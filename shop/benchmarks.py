@@ -0,0 +1,244 @@
+import asyncio
+import json
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import connections
+from django.test.utils import (setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies, default=0.0) * 1000,
+    }
+
+
+def format_summary(name, summary):
+    return (
+        f"{name:<32} {summary['requests']:>6} ok {summary['errors']:>4} err "
+        f"{summary['throughput']:>9.1f}/s  p50 {summary['p50_ms']:>8.2f}ms  "
+        f"p95 {summary['p95_ms']:>8.2f}ms  p99 {summary['p99_ms']:>8.2f}ms"
+    )
+
+
+def write_results(path, results):
+    with open(path, "w") as fh:
+        json.dump(results, fh, indent=2, default=str)
+
+
+@contextmanager
+def benchmark_databases():
+    """
+    Run a benchmark against throwaway test databases, never the real ones,
+    with DEBUG off. SQLite test databases are put in a file so worker
+    threads share them.
+    """
+    setup_test_environment(debug=False)
+    for alias in connections:
+        settings_dict = connections[alias].settings_dict
+        if settings_dict["ENGINE"].endswith("sqlite3"):
+            settings_dict.setdefault("TEST", {})
+            settings_dict["TEST"]["NAME"] = str(
+                settings.BASE_DIR / f"bench_{alias}.sqlite3"
+            )
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def database_url(settings_dict):
+    """
+    A ``DATABASE_URL`` for the database in ``settings_dict``, so a server
+    started in another process can use the benchmark database.
+    """
+    if settings_dict["ENGINE"].endswith("sqlite3"):
+        return f"sqlite:///{settings_dict['NAME']}"
+    user = quote(settings_dict["USER"] or "", safe="")
+    password = quote(settings_dict["PASSWORD"] or "", safe="")
+    host = settings_dict["HOST"] or "localhost"
+    port = settings_dict["PORT"] or 5432
+    return f"postgres://{user}:{password}@{host}:{port}/{settings_dict['NAME']}"
+
+
+def run_concurrently(func, jobs, workers):
+    """
+    Call ``func(job)`` for every job from ``workers`` threads and return
+    ``(latencies, errors, elapsed)``. Each thread keeps its own database
+    connection for the whole run and closes it at the end.
+    """
+    pending = queue.Queue()
+    for job in jobs:
+        pending.put(job)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            while True:
+                try:
+                    job = pending.get_nowait()
+                except queue.Empty:
+                    return
+                start = time.perf_counter()
+                try:
+                    func(job)
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+async def run_async_concurrently(func, jobs, concurrency):
+    """
+    Await ``func(job)`` for every job with at most ``concurrency`` in flight
+    and return ``(latencies, errors, elapsed)``.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+
+    async def run(job):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await func(job)
+            except Exception as e:
+                errors.append(e)
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(job) for job in jobs))
+    return latencies, errors, time.perf_counter() - start
+
+
+def seed_shop(products=1000, users=50, orders_per_user=5, lines_per_order=3, seed=0):
+    """
+    Fill the (benchmark) database with a reproducible synthetic shop:
+    products, users with customer profiles and an order history, most of
+    it paid.
+    Returns ``(product_ids, users)``.
+    """
+    from django.contrib.auth.models import User
+
+    from .analytics import rebuild
+    from .models import Customer, Order, OrderItem, Product
+
+    rng = random.Random(seed)
+    Product.objects.bulk_create(
+        Product(
+            sku=f"BENCH-{i:06d}",
+            name=f"Bench product {i}",
+            description=f"Synthetic product number {i}",
+            price=Decimal(rng.randrange(100, 100000)) / 100,
+            stock=10**6,
+        )
+        for i in range(products)
+    )
+    products = Product.objects.in_bulk()
+    product_ids = sorted(products)
+
+    # Profile klientów od razu, żeby pomiary nie liczyły ich leniwego tworzenia
+    usernames = [f"bench-{i}" for i in range(users)]
+    User.objects.bulk_create(User(username=username) for username in usernames)
+    users = list(User.objects.filter(username__in=usernames).order_by("pk"))
+    Customer.objects.bulk_create(
+        Customer(
+            user=user, first_name=user.username, email=f"{user.username}@example.com"
+        )
+        for user in users
+    )
+    customer_ids = list(
+        Customer.objects.filter(user__in=users)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+    Order.objects.bulk_create(
+        Order(customer_id=customer_id, paid=rng.random() < 0.8)
+        for customer_id in customer_ids
+        for _ in range(orders_per_user)
+    )
+    orders = Order.objects.filter(customer_id__in=customer_ids)
+    items = []
+    for order_id in orders.order_by("pk").values_list("pk", flat=True):
+        for product_id in rng.sample(product_ids, min(lines_per_order, len(products))):
+            product, quantity = products[product_id], rng.randint(1, 3)
+            items.append(
+                OrderItem(
+                    order_id=order_id,
+                    product=product,
+                    quantity=quantity,
+                    product_name=product.name,
+                    unit_price=product.price,
+                    line_total=product.price * quantity,
+                )
+            )
+    OrderItem.objects.bulk_create(items)
+    orders.update_totals()
+    rebuild()
+    return product_ids, users
+
+
+def load_results(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def compare_results(baseline, results, tolerance=0.2):
+    """
+    Yield ``(scenario, metric, before, after, regressed)`` for scenarios in
+    both runs. Latency and query counts regress when they grow by more than
+    ``tolerance``; throughput when it shrinks by more.
+    """
+    for name, summary in results.items():
+        before = baseline.get(name)
+        if name == "params" or not isinstance(before, dict):
+            continue
+        for metric in ("throughput", "p95_ms", "queries_avg"):
+            if metric not in summary or metric not in before:
+                continue
+            old, new = before[metric], summary[metric]
+            if metric == "throughput":
+                regressed = new < old * (1 - tolerance)
+            else:
+                regressed = new > old * (1 + tolerance) and new - old > 0.5
+            yield name, metric, old, new, regressed
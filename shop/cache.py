@@ -0,0 +1,120 @@
+"""
+Catalog cache.
+
+Product pages and product list pages are cached in the cache named by
+``settings.CATALOG_CACHE``; use a shared backend (Redis, Memcached or the
+database cache) when running more than one worker, so invalidation reaches
+all of them.
+
+Every list page key contains the catalog version, which is bumped whenever
+any product changes, so a single write invalidates every cached list page
+at once. Single products are cached under their own key and deleted when
+they change.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .models import Product
+from .routers import use_primary
+
+VERSION_KEY = "catalog:version"
+
+
+def catalog_cache():
+    return caches[getattr(settings, "CATALOG_CACHE", "default")]
+
+
+def catalog_timeout():
+    return getattr(settings, "CATALOG_CACHE_TIMEOUT", 300)
+
+
+def catalog_version(key=VERSION_KEY):
+    """Millisecond timestamp of the last catalog change (or of ``key``)."""
+    cache = catalog_cache()
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def product_key(pk):
+    return f"catalog:product:{pk}"
+
+
+def list_key(version, params):
+    digest = hashlib.md5(params.urlencode().encode()).hexdigest()
+    return f"catalog:list:{version}:{digest}"
+
+
+def _invalidate(product_ids):
+    cache = catalog_cache()
+    cache.delete_many([product_key(pk) for pk in product_ids])
+    version = cache.get(VERSION_KEY) or 0
+    cache.set(VERSION_KEY, max(int(time.time() * 1000), version + 1), None)
+
+
+def invalidate_products(product_ids):
+    # Invalidate now and again after commit, so a request that read the old
+    # rows while the transaction was open can't leave them in the cache.
+    product_ids = list(product_ids)
+    _invalidate(product_ids)
+    transaction.on_commit(lambda: _invalidate(product_ids))
+
+
+def get_product(pk):
+    cache = catalog_cache()
+    product = cache.get(product_key(pk))
+    if product is None:
+        # Do cache tylko z primary: replika może jeszcze nie mieć zmiany,
+        # po której wpis został unieważniony
+        with use_primary():
+            product = Product.objects.get(pk=pk)
+        cache.set(product_key(pk), product, catalog_timeout())
+    return product
+
+
+def get_list_page(paginator, cursor, version, params):
+    cache = catalog_cache()
+    key = list_key(version, params)
+    cached = cache.get(key)
+    if cached is None:
+        with use_primary():
+            page = paginator.get_page(cursor)
+        cache.set(key, page, catalog_timeout())
+        return page
+    return cached
+
+
+def is_cacheable(request):
+    return (
+        request.method in ("GET", "HEAD")
+        and not request.user.is_authenticated
+        and not len(get_messages(request))
+    )
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(":".join(map(str, parts)).encode()).hexdigest())
+
+
+def conditional_response(request, etag, last_modified):
+    """Return a 304 if the client's copy is still current, otherwise None."""
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified)
+    )
+
+
+def add_validators(response, etag, last_modified):
+    response.headers["ETag"] = etag
+    response.headers["Last-Modified"] = http_date(int(last_modified))
+    patch_cache_control(response, max_age=0, must_revalidate=True)
+    return response
@@ -0,0 +1,151 @@
+from django.db import connections, router
+from django.db.models import Count, Sum
+
+from .cache import get_product
+from .models import Cart, CartItem, Product, items_total
+
+SESSION_KEY = "cart"
+# Sesja może siedzieć w podpisanym ciasteczku (limit ok. 4 kB)
+MAX_SESSION_LINES = 50
+
+
+class CartFull(ValueError):
+    pass
+
+
+def get_cart(user):
+    cart, created = Cart.objects.get_or_create(user=user)
+    return cart
+
+
+# Jedno zapytanie: pozycje są dodawane albo ich ilość zwiększana, a produkty,
+# których nie ma w bazie, pomijane. Wymaga ograniczenia unique_cart_product.
+ADD_ITEMS_SQL = """
+    INSERT INTO {item} (cart_id, product_id, quantity)
+    SELECT c.id, p.id, added.column2
+    FROM (VALUES {values}) added
+    JOIN {product} p ON p.id = added.column1
+    JOIN {cart} c ON c.user_id = %s
+    WHERE true
+    ON CONFLICT (cart_id, product_id)
+    DO UPDATE SET quantity = {item}.quantity + excluded.quantity
+"""
+
+def _upsert_items(user, quantities):
+    using = router.db_for_write(CartItem)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    sql = ADD_ITEMS_SQL.format(
+        values=", ".join(["(%s, %s)"] * len(quantities)),
+        item=qn(CartItem._meta.db_table),
+        product=qn(Product._meta.db_table),
+        cart=qn(Cart._meta.db_table),
+    )
+    params = [value for row in quantities.items() for value in row]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*params, user.pk])
+        return cursor.rowcount
+
+
+def add_items(user, quantities):
+    """
+    Add ``{product_id: quantity}`` to the user's cart in one statement,
+    incrementing lines that are already there. Returns the number of lines
+    touched; unknown products are skipped.
+    """
+    merged = {}
+    for product_id, quantity in quantities.items():
+        merged[int(product_id)] = merged.get(int(product_id), 0) + quantity
+    merged = {pk: quantity for pk, quantity in sorted(merged.items()) if quantity > 0}
+    if not merged:
+        return 0
+    added = _upsert_items(user, merged)
+    if not added:
+        # Either the products are gone or the user has no cart yet
+        get_cart(user)
+        added = _upsert_items(user, merged)
+    return added
+
+
+def add_item(user, product_id, quantity=1):
+    if not add_items(user, {product_id: quantity}):
+        raise Product.DoesNotExist(product_id)
+
+
+def set_quantity(user, product_id, quantity):
+    if quantity <= 0:
+        return remove_item(user, product_id)
+    updated = CartItem.objects.filter(cart__user=user, product_id=product_id).update(
+        quantity=quantity
+    )
+    if not updated:
+        add_item(user, product_id, quantity)
+
+
+def remove_item(user, product_id):
+    CartItem.objects.filter(cart__user=user, product_id=product_id).delete()
+
+
+def summary(user):
+    totals = Cart.objects.filter(user=user).aggregate(
+        lines=Count("items"), quantity=Sum("items__quantity"), total=items_total()
+    )
+    return {
+        "lines": totals["lines"] or 0,
+        "quantity": totals["quantity"] or 0,
+        "total": f"{totals['total'] or 0:.2f}",
+    }
+
+
+def apply(operation, user, *args):
+    """Run a cart operation, if any, and return the new cart summary."""
+    if operation is not None:
+        operation(user, *args)
+    return summary(user)
+
+
+# Koszyk gościa: {"<product id>": quantity} w sesji, bez zapisów do bazy
+
+
+def session_items(session):
+    """The anonymous cart in ``session`` as ``{product_id: quantity}``."""
+    return {int(pk): quantity for pk, quantity in session.get(SESSION_KEY, {}).items()}
+
+
+def add_to_session(session, product_id, quantity=1):
+    """
+    Add a product to the anonymous cart. The product is checked against the
+    catalog cache, so this normally runs without touching the database.
+    """
+    get_product(product_id)
+    items = session.get(SESSION_KEY, {})
+    key = str(product_id)
+    if key not in items and len(items) >= MAX_SESSION_LINES:
+        raise CartFull(f"A cart can hold at most {MAX_SESSION_LINES} products.")
+    items[key] = items.get(key, 0) + quantity
+    session[SESSION_KEY] = items
+
+
+def session_cart_items(session):
+    """
+    The anonymous cart as unsaved ``CartItem`` objects with their products,
+    read in one query. Products gone from the catalog are left out.
+    """
+    quantities = session_items(session)
+    products = Product.objects.in_bulk(quantities)
+    return [
+        CartItem(product=products[pk], quantity=quantity)
+        for pk, quantity in quantities.items()
+        if pk in products
+    ]
+
+
+def merge_session_cart(session, user):
+    """
+    Move the anonymous cart in ``session`` into ``user``'s cart with one
+    upsert (``add_items``), adding to the quantities already there.
+    """
+    items = session_items(session)
+    if items:
+        add_items(user, items)
+    session.pop(SESSION_KEY, None)
@@ -0,0 +1,14 @@
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    def __init__(self):
+        super().__init__("Your cart is empty.")
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, products):
+        self.products = products
+        names = ", ".join(product.name for product in products)
+        super().__init__(f"Not enough stock for {names}.")
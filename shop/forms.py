@@ -1,7 +1,11 @@
 from django import forms
 from django.contrib.auth.models import User
 
-from .models import CartItem, Customer, Order, OrderItem, Payment, Product
+from .models import (CartItem, Customer, Order, Payment, PaymentRequest,
+                     Product)
+from .images import ImageError, check_image
+from .inventory import adjust_stock
+from .services import place_order
 
 
 class UserRegistrationForm(forms.ModelForm):
@@ -35,23 +39,8 @@ class OrderForm(forms.ModelForm):
         fields = ["customer", "paid"]
 
     def save_order(self, cart, customer):
-        # Tworzymy zamówienie (nie zapisujemy jeszcze w bazie)
-        order = self.save(commit=False)
-        order.customer = customer
-        order.save()  # Zapisujemy zamówienie
-
-        # Tworzymy pozycje w zamówieniu dla każdego przedmiotu w koszyku
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order, 
-                product=cart_item.product, 
-                quantity=cart_item.quantity
-            )
-        
-        # Opcjonalnie: Usuń elementy z koszyka po złożeniu zamówienia
-        cart.items.all().delete()
-
-        return order
+        # Zamówienie, pozycje i stany magazynowe w jednej transakcji
+        return place_order(cart, customer, order=self.save(commit=False))
 
 
 class OrderEditForm(forms.ModelForm):
@@ -80,6 +69,23 @@ class PaymentForm(forms.ModelForm):
         return amount
 
 
+class PaymentRequestForm(forms.ModelForm):
+    class Meta:
+        model = PaymentRequest
+        fields = ["amount", "idempotency_key"]
+        widgets = {"idempotency_key": forms.HiddenInput}
+
+    def clean_amount(self):
+        amount = self.cleaned_data["amount"]
+        if amount <= 0:
+            raise forms.ValidationError("Amount must be greater than 0")
+        return amount
+
+    def validate_unique(self):
+        # Powtórzony klucz zwraca istniejące żądanie (patrz submit_payment)
+        pass
+
+
 class DeliveryAddressForm(forms.ModelForm):
     class Meta:
         model = Customer
@@ -117,4 +123,87 @@ class CartItemForm(forms.ModelForm):
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
-        fields = ["name", "description", "price", "stock", "available"]
+        fields = ["sku", "name", "description", "price", "stock", "available", "image"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Formularz odsyła stan, który widział edytujący, i zapisujemy tylko
+        # różnicę, żeby nie nadpisać sprzedaży, które zaszły w międzyczasie.
+        if "stock" in self.fields:
+            self.fields["stock"].show_hidden_initial = True
+
+    def clean_image(self):
+        image = self.cleaned_data.get("image")
+        if image and image is not self.initial.get("image"):
+            try:
+                check_image(image.read())
+            except ImageError as e:
+                raise forms.ValidationError(str(e))
+            finally:
+                image.seek(0)
+        return image
+
+    def stock_delta(self):
+        field = self.fields["stock"]
+        try:
+            seen = field.to_python(self.data.get(self.add_initial_prefix("stock")))
+        except forms.ValidationError:
+            seen = None
+        if seen is None:
+            seen = self.initial.get("stock", self.instance.stock)
+        return self.cleaned_data["stock"] - seen
+
+    def save(self, commit=True):
+        product = super().save(commit=False)
+        if not commit or product._state.adding:
+            if commit:
+                product.save()
+            return product
+        product.save(update_fields=[f for f in self._meta.fields if f != "stock"])
+        adjust_stock(product.pk, self.stock_delta())
+        product.refresh_from_db(fields=["stock"])
+        return product
+
+
+class ProductFilterForm(forms.Form):
+    AVAILABILITY_CHOICES = [("1", "Available"), ("0", "Unavailable")]
+    SORT_CHOICES = [("name", "Name"), ("price", "Price")]
+
+    available = forms.ChoiceField(choices=AVAILABILITY_CHOICES, required=False)
+    min_price = forms.DecimalField(min_value=0, decimal_places=2, required=False)
+    max_price = forms.DecimalField(min_value=0, decimal_places=2, required=False)
+    sort = forms.ChoiceField(choices=SORT_CHOICES, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        min_price = cleaned_data.get("min_price")
+        max_price = cleaned_data.get("max_price")
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise forms.ValidationError("Minimum price cannot exceed maximum price.")
+        return cleaned_data
+
+    def filter_queryset(self, queryset):
+        data = self.cleaned_data if self.is_valid() else {}
+        queryset = queryset.filter(available=data.get("available", "1") != "0")
+        if data.get("min_price") is not None:
+            queryset = queryset.filter(price__gte=data["min_price"])
+        if data.get("max_price") is not None:
+            queryset = queryset.filter(price__lte=data["max_price"])
+        return queryset
+
+    def sort_field(self):
+        data = self.cleaned_data if self.is_valid() else {}
+        return data.get("sort") or "name"
+
+
+class DateRangeForm(forms.Form):
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get("start")
+        end = cleaned_data.get("end")
+        if start and end and start > end:
+            raise forms.ValidationError("Start date cannot be after end date.")
+        return cleaned_data
@@ -0,0 +1,202 @@
+"""
+Product image derivatives.
+
+An uploaded original is resized with OpenCV to each of ``SIZES`` (longest
+side in pixels, never upscaled) and re-encoded as WebP and JPEG. Every file
+is stored under a name taken from a hash of its bytes, so a URL always means
+the same content and can be cached for good; a new image gets new URLs.
+``Product.image_variants`` records the original they were made from and,
+per size and format, the stored name, width and height.
+
+Rendering is kept off the request path: saving a product with a new image
+queues the ``product_images`` job, and ``manage.py render_product_images``
+rebuilds the whole catalog across a process pool. OpenCV
+(opencv-contrib-python) is optional; without it originals are still stored
+and shown, but no derivatives are made.
+"""
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.db.models.functions import Now
+
+from .cache import invalidate_products
+from .jobs import enqueue, task
+from .models import Product
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = np = None
+
+logger = logging.getLogger(__name__)
+
+SIZES = {"thumb": 160, "card": 480, "detail": 1200}
+FORMATS = {"webp": ".webp", "jpeg": ".jpg"}
+DERIVED_DIR = "products/derived"
+
+
+class ImageError(ValueError):
+    pass
+
+
+def is_current(product):
+    return bool(product.image) and (
+        product.image_variants.get("source") == product.image.name
+    )
+
+
+def _encode_params(fmt):
+    if fmt == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, 80]
+    return [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+
+
+def _to_bgr(image):
+    if image.dtype == np.uint16:
+        image = (image >> 8).astype(np.uint8)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        # JPEG nie ma kanału alfa, więc przezroczystość kładziemy na białe tło
+        alpha = image[:, :, 3:].astype(np.float32) / 255
+        return (image[:, :, :3] * alpha + 255 * (1 - alpha)).astype(np.uint8)
+    return image
+
+
+def check_image(data):
+    """Raise ``ImageError`` if OpenCV is installed and can't decode ``data``."""
+    if cv2 is None:
+        return
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ImageError("Not a readable image.")
+
+
+def render(data):
+    """
+    Resize and encode the image in ``data`` (bytes). Returns
+    ``{size: {format: (encoded_bytes, width, height)}}``.
+    """
+    if cv2 is None:
+        raise ImageError("OpenCV is not installed.")
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ImageError("Not a readable image.")
+    image = _to_bgr(image)
+    height, width = image.shape[:2]
+    rendered = {}
+    for size, longest in SIZES.items():
+        scale = min(1.0, longest / max(width, height))
+        w, h = max(1, round(width * scale)), max(1, round(height * scale))
+        resized = image
+        if scale < 1:
+            resized = cv2.resize(image, (w, h), interpolation=cv2.INTER_AREA)
+        rendered[size] = {}
+        for fmt, ext in FORMATS.items():
+            ok, buffer = cv2.imencode(ext, resized, _encode_params(fmt))
+            if not ok:
+                raise ImageError(f"Could not encode {fmt}.")
+            rendered[size][fmt] = (buffer.tobytes(), w, h)
+    return rendered
+
+
+def store(source, rendered):
+    """Save rendered files under content-hashed names; return the variants."""
+    sizes = {}
+    for size, formats in rendered.items():
+        sizes[size] = {}
+        for fmt, (data, width, height) in formats.items():
+            digest = hashlib.sha256(data).hexdigest()[:20]
+            name = f"{DERIVED_DIR}/{digest[:2]}/{digest}-{size}{FORMATS[fmt]}"
+            # Ta sama treść ma tę samą nazwę, więc zapisujemy ją tylko raz
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(data))
+            sizes[size][fmt] = {"name": name, "width": width, "height": height}
+    return {"source": source, "sizes": sizes}
+
+
+def render_file(name):
+    with default_storage.open(name) as fh:
+        return store(name, render(fh.read()))
+
+
+def save_variants(product_id, variants):
+    # Tylko jeśli w międzyczasie nie wgrano innego obrazka
+    updated = Product.objects.filter(pk=product_id, image=variants["source"]).update(
+        image_variants=variants, updated_at=Now()
+    )
+    if updated:
+        invalidate_products([product_id])
+    return updated
+
+
+def queue_render(product):
+    """Queue the derivatives of a product that was just saved with a new image."""
+    name = product.image.name or ""
+    if name and name != getattr(product, "_saved_image", None):
+        if not is_current(product):
+            enqueue("product_images", {"product": product.pk})
+    product._saved_image = name
+
+
+@task("product_images")
+def render_product_images(payloads):
+    if cv2 is None:
+        logger.warning("OpenCV is not installed; product images are not resized.")
+        return
+    products = Product.objects.filter(
+        pk__in={payload["product"] for payload in payloads}
+    ).exclude(image="")
+    for product in products:
+        if is_current(product):
+            continue
+        try:
+            variants = render_file(product.image.name)
+        except ImageError as e:
+            # Zły plik nie naprawi się przy ponowieniu
+            logger.warning("Product %s image: %s", product.pk, e)
+            continue
+        save_variants(product.pk, variants)
+
+
+def _render_in_worker(job):
+    pk, name = job
+    try:
+        return pk, render_file(name), None
+    except Exception as e:
+        return pk, None, f"{type(e).__name__}: {e}"
+
+
+def render_catalog(products=None, force=False, workers=None, chunksize=4):
+    """
+    Render the derivatives of the products in ``products`` (default: all)
+    that are missing or stale, or of all of them with ``force``, in a pool
+    of ``workers`` processes. Yields ``(product_id, error)`` as each is done.
+    """
+    if cv2 is None:
+        raise ImageError("OpenCV is not installed.")
+    if products is None:
+        products = Product.objects.all()
+    rows = products.exclude(image="").values_list("pk", "image", "image_variants")
+    jobs = [
+        (pk, name)
+        for pk, name, variants in rows.iterator()
+        if force or variants.get("source") != name
+    ]
+    if not jobs:
+        return
+    # Procesy potomne nie mogą dzielić połączeń z bazą z rodzicem
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        for pk, variants, error in pool.map(
+            _render_in_worker, jobs, chunksize=chunksize
+        ):
+            if variants is not None:
+                save_variants(pk, variants)
+            yield pk, error
@@ -0,0 +1,184 @@
+"""
+Stock is only ever changed with atomic ``UPDATE ... SET stock = stock +/- n``
+statements, never by saving a loaded ``Product``.
+
+``Product.stock`` is what is still free to sell. Placing an order takes its
+quantities out of stock straight away and records them as ``held``
+reservations; paying for the order commits them, and reservations that are
+not paid for before they expire are released back into stock.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest, Now
+from django.utils import timezone
+
+from .cache import invalidate_products
+from .exceptions import OutOfStock
+from .models import Product, StockReservation
+from .notifications import queue_low_stock_alerts
+
+
+def reservation_ttl():
+    return timedelta(minutes=getattr(settings, "STOCK_RESERVATION_MINUTES", 15))
+
+
+def _per_product(quantities):
+    return Case(
+        *[When(pk=pk, then=Value(qty)) for pk, qty in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def _update_stock(products, stock, product_ids):
+    updated = products.update(stock=stock, updated_at=Now())
+    if updated:
+        invalidate_products(product_ids)
+    return updated
+
+
+def adjust_stock(product_id, delta):
+    """
+    Apply ``delta`` to a product's stock as a single atomic UPDATE. Stock
+    never drops below zero.
+    """
+    updated = _update_stock(
+        Product.objects.filter(pk=product_id),
+        Greatest(F("stock") + delta, 0),
+        [product_id],
+    )
+    if updated and delta < 0:
+        queue_low_stock_alerts({product_id: -delta})
+    return updated
+
+
+def take_stock(product_id, quantity):
+    taken = bool(
+        _update_stock(
+            Product.objects.filter(pk=product_id, stock__gte=quantity),
+            F("stock") - quantity,
+            [product_id],
+        )
+    )
+    if taken:
+        queue_low_stock_alerts({product_id: quantity})
+    return taken
+
+
+def restock(quantities):
+    if quantities:
+        _update_stock(
+            Product.objects.filter(pk__in=quantities),
+            F("stock") + _per_product(quantities),
+            quantities,
+        )
+
+
+def decrement_stock(quantities):
+    """
+    Take ``{product_id: quantity}`` out of stock in a single UPDATE.
+
+    Every row is guarded by ``stock >= quantity``; if any line is short the
+    UPDATE is undone and ``OutOfStock`` raised. Rows are locked in id order
+    first so concurrent checkouts can't deadlock on each other. Must be
+    called inside a transaction.
+    """
+    if not quantities:
+        return
+    if connections[router.db_for_write(Product)].features.has_select_for_update:
+        list(
+            Product.objects.select_for_update()
+            .filter(pk__in=quantities)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+    per_product = _per_product(quantities)
+    sid = transaction.savepoint()
+    updated = _update_stock(
+        Product.objects.filter(pk__in=quantities, stock__gte=per_product),
+        F("stock") - per_product,
+        quantities,
+    )
+    if updated == len(quantities):
+        transaction.savepoint_commit(sid)
+        queue_low_stock_alerts(quantities)
+        return
+    transaction.savepoint_rollback(sid)
+    short = Product.objects.filter(pk__in=quantities).exclude(stock__gte=per_product)
+    raise OutOfStock(list(short.order_by("pk")))
+
+
+def reserve(order, quantities, ttl=None):
+    """Take ``{product_id: quantity}`` out of stock and hold it for ``order``."""
+    expires_at = timezone.now() + (ttl or reservation_ttl())
+    with transaction.atomic():
+        decrement_stock(quantities)
+        StockReservation.objects.bulk_create(
+            StockReservation(
+                order=order, product_id=pk, quantity=qty, expires_at=expires_at
+            )
+            for pk, qty in sorted(quantities.items())
+        )
+
+
+def _quantities(reservations):
+    quantities = {}
+    for product_id, quantity in reservations.values_list("product_id", "quantity"):
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def commit_reservations(order):
+    """
+    Make ``order``'s reservations permanent. Reservations that already
+    expired are taken out of stock again, which raises ``OutOfStock`` if the
+    products have sold out in the meantime.
+    """
+    with transaction.atomic():
+        released = StockReservation.objects.select_for_update().filter(
+            order=order, status=StockReservation.RELEASED
+        )
+        decrement_stock(_quantities(released))
+        StockReservation.objects.filter(order=order).exclude(
+            status=StockReservation.COMMITTED
+        ).update(status=StockReservation.COMMITTED)
+
+
+def _release(reservations):
+    with transaction.atomic():
+        held = reservations.select_for_update(skip_locked=True).filter(
+            status=StockReservation.HELD
+        )
+        rows = list(held.values_list("pk", "product_id", "quantity"))
+        quantities = {}
+        for _, product_id, quantity in rows:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        StockReservation.objects.filter(pk__in=[row[0] for row in rows]).update(
+            status=StockReservation.RELEASED
+        )
+        restock(quantities)
+    return len(rows)
+
+
+def release_reservations(order):
+    return _release(StockReservation.objects.filter(order=order))
+
+
+def release_expired(now=None, batch_size=1000):
+    """Return stock held by unpaid reservations that expired before ``now``."""
+    now = now or timezone.now()
+    expired = StockReservation.objects.filter(
+        status=StockReservation.HELD, expires_at__lte=now
+    ).order_by("expires_at")
+    released = 0
+    while True:
+        batch = _release(
+            StockReservation.objects.filter(
+                pk__in=list(expired.values_list("pk", flat=True)[:batch_size])
+            )
+        )
+        released += batch
+        if batch < batch_size:
+            return released
@@ -0,0 +1,172 @@
+"""
+Background jobs.
+
+Work that should not hold up a response (e-mails, alerts) is queued with
+``enqueue`` as a ``Job`` row, usually inside the transaction that caused
+it, so a job exists exactly when its order or stock change was committed.
+``manage.py run_jobs`` runs them.
+
+Task functions are registered with ``@task("name")`` and always receive a
+list of payloads: a worker claims up to ``JOB_BATCH_SIZE`` due jobs at once
+and hands every task its share in one call, so e.g. a batch of e-mails goes
+out over one connection. If the call raises, all of its jobs are retried
+with exponential backoff (``JOB_RETRY_SECONDS``, doubling) until
+``JOB_MAX_ATTEMPTS``; tasks should therefore be safe to repeat. A task that
+finished some payloads before failing raises ``PartialFailure`` with the
+indexes of the rest, and only those jobs are retried.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connections
+from django.utils import timezone
+
+from . import queue
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+OUTCOME_RETRIES = 5
+
+
+class PartialFailure(Exception):
+    """Only the payloads at indexes ``failed`` need another attempt."""
+
+    def __init__(self, failed, error):
+        super().__init__(error)
+        self.failed = set(failed)
+
+
+def task(name):
+    def register(func):
+        TASKS[name] = func
+        return func
+
+    return register
+
+
+def setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue(name, payload=None, delay=None):
+    return enqueue_many(name, [payload or {}], delay)[0]
+
+
+def enqueue_many(name, payloads, delay=None):
+    if name not in TASKS:
+        raise KeyError(f"Unknown task {name!r}.")
+    available_at = timezone.now() + (delay or timedelta(0))
+    return Job.objects.bulk_create(
+        Job(task=name, payload=payload, available_at=available_at)
+        for payload in payloads
+    )
+
+
+def _save_outcome(update, *args, **kwargs):
+    # Zadanie już się wykonało, więc wynik zapisujemy mimo chwilowych blokad
+    for attempt in range(OUTCOME_RETRIES):
+        try:
+            return update(*args, **kwargs)
+        except OperationalError:
+            if attempt == OUTCOME_RETRIES - 1:
+                raise
+            time.sleep(0.05 * 2**attempt)
+
+
+def _run(name, jobs):
+    func = TASKS.get(name)
+    if func is None:
+        queue.finish(jobs, status=Job.FAILED, last_error=f"Unknown task {name!r}.")
+        return
+    try:
+        func([job.payload for job in jobs])
+    except PartialFailure as e:
+        failed = [job for i, job in enumerate(jobs) if i in e.failed]
+        done = [job for i, job in enumerate(jobs) if i not in e.failed]
+        logger.error("Task %s failed for %d job(s): %s", name, len(failed), e)
+        _save_outcome(queue.finish, done, status=Job.SUCCEEDED, last_error="")
+        _retry(failed, str(e))
+    except Exception as e:
+        logger.exception("Task %s failed for %d job(s)", name, len(jobs))
+        _retry(jobs, f"{type(e).__name__}: {e}")
+    else:
+        _save_outcome(queue.finish, jobs, status=Job.SUCCEEDED, last_error="")
+
+
+def _retry(jobs, error):
+    _save_outcome(
+        queue.retry_or_fail,
+        jobs,
+        error,
+        setting("JOB_MAX_ATTEMPTS", 5),
+        setting("JOB_RETRY_SECONDS", 30),
+    )
+
+
+def run_due(batch_size=None):
+    """Run one batch of due jobs and return how many were claimed."""
+    lease = timedelta(seconds=setting("JOB_LEASE_SECONDS", 300))
+    jobs = queue.claim(Job, batch_size or setting("JOB_BATCH_SIZE", 50), lease)
+    by_task = {}
+    for job in jobs:
+        by_task.setdefault(job.task, []).append(job)
+    for name, task_jobs in by_task.items():
+        _run(name, task_jobs)
+    return len(jobs)
+
+
+def work(batch_size=None, poll_interval=1.0, once=False, stop=None):
+    """
+    Run jobs until ``stop`` is set, waiting ``poll_interval`` seconds
+    whenever nothing is due. With ``once`` return as soon as nothing is due.
+    Returns the number of jobs claimed.
+    """
+    stop = stop or threading.Event()
+    total = 0
+    while not stop.is_set():
+        try:
+            claimed = run_due(batch_size)
+        except DatabaseError as e:
+            # Np. zablokowana baza SQLite przy kilku wątkach; spróbujemy znowu
+            logger.warning("Claiming jobs failed: %s", e)
+            stop.wait(poll_interval)
+            continue
+        total += claimed
+        if not claimed:
+            if once:
+                break
+            stop.wait(poll_interval)
+    return total
+
+
+def run_worker(concurrency=None, **options):
+    """
+    Run ``work`` in ``concurrency`` threads (``JOB_WORKER_CONCURRENCY``),
+    each with its own database connection, and return the jobs claimed.
+    """
+    concurrency = concurrency or setting("JOB_WORKER_CONCURRENCY", 1)
+    stop = options.setdefault("stop", threading.Event())
+    totals = []
+
+    def thread():
+        try:
+            totals.append(work(**options))
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=thread) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            t.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for t in threads:
+            t.join()
+    return sum(totals)
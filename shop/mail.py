@@ -0,0 +1,42 @@
+"""
+E-mail backend for SendGrid's v3 API. Select it with
+
+    EMAIL_BACKEND = "shop.mail.SendgridBackend"
+    SENDGRID_API_KEY = "..."
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends.base import BaseEmailBackend
+
+
+class SendgridBackend(BaseEmailBackend):
+    def __init__(self, fail_silently=False, api_key=None, **kwargs):
+        super().__init__(fail_silently=fail_silently, **kwargs)
+        try:
+            from sendgrid import SendGridAPIClient
+        except ImportError:
+            raise ImproperlyConfigured("SendgridBackend needs the sendgrid package.")
+        api_key = api_key or getattr(settings, "SENDGRID_API_KEY", "")
+        if not api_key:
+            raise ImproperlyConfigured("SENDGRID_API_KEY is not set.")
+        self.client = SendGridAPIClient(api_key)
+
+    def send_messages(self, email_messages):
+        from sendgrid.helpers.mail import Mail
+
+        sent = 0
+        for message in email_messages:
+            mail = Mail(
+                from_email=message.from_email,
+                to_emails=message.recipients(),
+                subject=message.subject,
+                plain_text_content=message.body,
+            )
+            try:
+                self.client.send(mail)
+            except Exception:
+                if not self.fail_silently:
+                    raise
+            else:
+                sent += 1
+        return sent
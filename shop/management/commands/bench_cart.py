@@ -0,0 +1,216 @@
+import http.client
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from shop.benchmarks import (benchmark_databases, database_url, format_summary,
+                             run_concurrently, summarize, write_results)
+from shop.models import Product
+
+SERVERS = {
+    "WSGI": ["gunicorn", "shop_project.wsgi"],
+    "ASGI": ["uvicorn", "shop_project.asgi:application"],
+}
+SCENARIOS = {
+    "WSGI": [("POST", "add_to_cart"), ("GET", "cart_detail")],
+    "ASGI": [("POST", "cart_add"), ("GET", "cart_summary")],
+}
+
+
+class Command(BaseCommand):
+    """
+    Load test of the cart: the synchronous views served by gunicorn from
+    ``shop_project.wsgi`` against the async cart API served by uvicorn from
+    ``shop_project.asgi``. Both servers run the same number of worker
+    processes against the same throwaway database and get the same load:
+    ``--concurrency`` keep-alive HTTP connections sending ``--requests``
+    requests from ``--users`` logged-in users.
+    """
+
+    help = (
+        "Serve shop_project.wsgi with gunicorn and shop_project.asgi with "
+        "uvicorn, send both the same concurrent cart traffic and report "
+        "requests/s and p99 latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument(
+            "--workers", type=int, default=2, help="Server processes per server."
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=4,
+            help="Threads per gunicorn worker; uvicorn workers are one event loop.",
+        )
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--json", help="Write results to this file.")
+
+    def handle(self, *args, **options):
+        for module in ("gunicorn", "uvicorn"):
+            if importlib.util.find_spec(module) is None:
+                raise CommandError(f"{module} is not installed.")
+
+        results = {}
+        with benchmark_databases():
+            products = [
+                Product.objects.create(
+                    name=f"Bench {i}", description="", price=5, stock=10**6
+                )
+                for i in range(10)
+            ]
+            csrf_token = get_random_string(32)
+            cookies = [
+                self.login(user, csrf_token)
+                for user in (
+                    User.objects.create_user(
+                        username=f"bench-{i}", password="bench-pass-1"
+                    )
+                    for i in range(options["users"])
+                )
+            ]
+            jobs = [
+                (i % len(cookies), products[i % len(products)].pk)
+                for i in range(options["requests"])
+            ]
+            headers = {"X-CSRFToken": csrf_token}
+            env = {
+                **os.environ,
+                "DATABASE_URL": database_url(connections["default"].settings_dict),
+                "DATABASE_REPLICA_URLS": "",
+                "QUERY_BUDGET_STRICT": "False",
+            }
+            # Serwery piszą do tej samej bazy; zamykamy nasze połączenie
+            connections.close_all()
+            for server, command in SERVERS.items():
+                with self.serve(self.command(command, options), env, options["port"]):
+                    for method, url_name in SCENARIOS[server]:
+                        name = f"{server} {url_name}"
+                        summary = self.load(
+                            options["port"],
+                            cookies,
+                            headers,
+                            jobs,
+                            method,
+                            url_name,
+                            options["concurrency"],
+                        )
+                        results[name] = summary
+                        self.stdout.write(format_summary(name, summary))
+        if options["json"]:
+            results["params"] = {
+                name: options[name]
+                for name in ("users", "requests", "concurrency", "workers", "threads")
+            }
+            write_results(options["json"], results)
+
+    def login(self, user, csrf_token):
+        client = Client()
+        client.force_login(user)
+        session = client.cookies[settings.SESSION_COOKIE_NAME].value
+        return (
+            f"{settings.SESSION_COOKIE_NAME}={session}; "
+            f"{settings.CSRF_COOKIE_NAME}={csrf_token}"
+        )
+
+    def command(self, command, options):
+        server, app = command
+        address = ["--bind", f"127.0.0.1:{options['port']}"]
+        if server == "uvicorn":
+            address = ["--host", "127.0.0.1", "--port", str(options["port"])]
+            extra = ["--lifespan", "off", "--no-access-log"]
+        else:
+            extra = ["--threads", str(options["threads"])]
+        return [
+            sys.executable,
+            "-m",
+            server,
+            app,
+            *address,
+            "--workers",
+            str(options["workers"]),
+            "--log-level",
+            "warning",
+            *extra,
+        ]
+
+    @contextmanager
+    def serve(self, command, env, port):
+        process = subprocess.Popen(
+            command, env=env, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL
+        )
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                if process.poll() is not None:
+                    raise CommandError(
+                        f"{command[2]} exited with {process.returncode}."
+                    )
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise CommandError(f"{command[2]} did not start.")
+                    time.sleep(0.2)
+            yield
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    def url(self, url_name, product_id):
+        if url_name in ("add_to_cart", "cart_add"):
+            return reverse(url_name, args=[product_id])
+        return reverse(url_name)
+
+    def load(self, port, cookies, headers, jobs, method, url_name, concurrency):
+        local = threading.local()
+        opened = []
+
+        def request(job):
+            user_index, product_id = job
+            if not hasattr(local, "connection"):
+                local.connection = http.client.HTTPConnection(
+                    "127.0.0.1", port, timeout=60
+                )
+                opened.append(local.connection)
+            body = None
+            request_headers = {**headers, "Cookie": cookies[user_index]}
+            if method == "POST":
+                body = b'{"quantity": 1}'
+                request_headers["Content-Type"] = "application/json"
+            try:
+                local.connection.request(
+                    method, self.url(url_name, product_id), body, request_headers
+                )
+                response = local.connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                local.connection.close()
+                del local.connection
+                raise
+            if response.status >= 400:
+                raise RuntimeError(response.status)
+
+        # Rozgrzewka: workery importują aplikację i łączą się z bazą
+        run_concurrently(request, jobs[: concurrency * 2], concurrency)
+        latencies, errors, elapsed = run_concurrently(request, jobs, concurrency)
+        for connection in opened:
+            connection.close()
+        return summarize(latencies, elapsed, len(errors))
@@ -0,0 +1,62 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from shop.benchmarks import (benchmark_databases, format_summary,
+                             run_concurrently, summarize, write_results)
+from shop.models import Cart, CartItem, Customer, OrderItem, Product
+from shop.services import place_order
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent checkouts for carts of different sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lines", type=int, nargs="+", default=[1, 10, 100])
+        parser.add_argument("--checkouts", type=int, default=50)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--json", help="Write results to this file.")
+
+    def handle(self, *args, **options):
+        results = {}
+        with benchmark_databases():
+            for lines in options["lines"]:
+                name = f"checkout[{lines} lines]"
+                results[name] = self.run_scenario(
+                    lines, options["checkouts"], options["concurrency"]
+                )
+                self.stdout.write(format_summary(name, results[name]))
+        if options["json"]:
+            write_results(options["json"], results)
+
+    def run_scenario(self, lines, checkouts, concurrency):
+        OrderItem.objects.all().delete()
+        Product.objects.all().delete()
+        Product.objects.bulk_create(
+            Product(name=f"Bench {i}", description="", price=10, stock=10**6)
+            for i in range(lines)
+        )
+        products = list(Product.objects.values_list("pk", flat=True))
+        stock_before = Product.objects.aggregate(total=Sum("stock"))["total"]
+
+        carts = []
+        for i in range(checkouts):
+            user = User.objects.create(username=f"bench-{lines}-{i}")
+            customer, _ = Customer.objects.get_or_create(user=user)
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.bulk_create(
+                CartItem(cart=cart, product_id=pk, quantity=1) for pk in products
+            )
+            carts.append((cart, customer))
+
+        latencies, errors, elapsed = run_concurrently(
+            lambda job: place_order(*job), carts, concurrency
+        )
+
+        stock_after = Product.objects.aggregate(total=Sum("stock"))["total"]
+        summary = summarize(latencies, elapsed, len(errors))
+        summary["units_sold"] = stock_before - stock_after
+        summary["units_ordered"] = OrderItem.objects.aggregate(
+            total=Sum("quantity")
+        )["total"]
+        return summary
@@ -0,0 +1,105 @@
+import threading
+
+from decouple import config
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.db.utils import ConnectionHandler
+
+from shop.benchmarks import (format_summary, run_concurrently, summarize,
+                             write_results)
+from shop.postgresql.base import POOLS, close_pools
+from shop_project.database import database_config
+
+MODES = {
+    "connect per request": {"conn_max_age": 0},
+    "persistent": {"conn_max_age": 600},
+    "pool": {"conn_max_age": 0, "pool_size": None},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the cost of database connections per request against a "
+        "PostgreSQL server: a new connection for every request, persistent "
+        "connections (CONN_MAX_AGE) and the in-process pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            default=config("BENCH_DATABASE_URL", default=""),
+            help="postgres:// URL; defaults to $BENCH_DATABASE_URL.",
+        )
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--queries", type=int, default=3, help="Queries per request."
+        )
+        parser.add_argument(
+            "--pool-size",
+            type=int,
+            help="Pool connections; defaults to --concurrency.",
+        )
+        parser.add_argument("--json", help="Write results to this file.")
+
+    def handle(self, *args, **options):
+        if not options["url"].startswith(("postgres://", "postgresql://")):
+            raise CommandError("Pass a PostgreSQL --url (or BENCH_DATABASE_URL).")
+        results = {}
+        for mode, params in MODES.items():
+            if "pool_size" in params:
+                params = {
+                    **params,
+                    "pool_size": options["pool_size"] or options["concurrency"],
+                }
+            results[mode] = self.run(mode, params, options)
+            self.stdout.write(format_summary(mode, results[mode]))
+            self.stdout.write(f"{'':<32} {results[mode]['connections']} connection(s)")
+        if options["json"]:
+            write_results(options["json"], results)
+
+    def run(self, mode, params, options):
+        """
+        Run ``--requests`` simulated requests from ``--concurrency`` threads.
+        Each one does what Django does around a view: check the connection
+        when the request starts, run the queries, and close or keep the
+        connection when it ends.
+        """
+        alias = "default"
+        handler = ConnectionHandler(
+            {alias: database_config(options["url"], statement_timeout_ms=0, **params)}
+        )
+        opened = []
+        lock = threading.Lock()
+
+        def count(sender, connection, **kwargs):
+            with lock:
+                opened.append(connection)
+
+        def request(_):
+            db = handler[alias]
+            db.close_if_unusable_or_obsolete()
+            for _ in range(options["queries"]):
+                with db.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            db.close_if_unusable_or_obsolete()
+
+        connection_created.connect(count)
+        try:
+            latencies, errors, elapsed = run_concurrently(
+                request, range(options["requests"]), options["concurrency"]
+            )
+        finally:
+            connection_created.disconnect(count)
+        if errors:
+            self.stderr.write(f"{mode}: {errors[0]!r}")
+        summary = summarize(latencies, elapsed, len(errors))
+        summary["connections"] = (
+            sum(pool.opened for pool in POOLS.values()) if POOLS else len(opened)
+        )
+        # Wątki już się skończyły, ale ich trwałe połączenia są nadal otwarte
+        for db in set(opened):
+            if db.connection is not None and db.pool is None:
+                db.connection.close()
+        close_pools()
+        return summary
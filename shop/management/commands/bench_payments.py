@@ -0,0 +1,113 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+
+from shop.benchmarks import (benchmark_databases, format_summary,
+                             run_concurrently, seed_shop, summarize,
+                             write_results)
+from shop.models import Order, OrderItem, Payment, PaymentRequest
+from shop.payments import run_worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark payment submission under a burst of concurrent requests, "
+        "with repeated submits of the same payment, then the time the queue "
+        "workers take to settle them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=200)
+        parser.add_argument(
+            "--repeats",
+            type=int,
+            default=2,
+            help="How many times each payment is submitted with the same key.",
+        )
+        parser.add_argument("--lines", type=int, default=3)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", help="Write results to this file.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        results = {}
+        with benchmark_databases():
+            orders = self.create_orders(rng, options)
+            jobs = [
+                (order_id, str(total))
+                for order_id, total in orders
+                for _ in range(options["repeats"])
+            ]
+            rng.shuffle(jobs)
+
+            latencies, errors, elapsed = run_concurrently(
+                self.submit, jobs, options["concurrency"]
+            )
+            results["submit"] = summarize(latencies, elapsed, len(errors))
+            results["submit"]["queued"] = PaymentRequest.objects.count()
+            self.stdout.write(format_summary("submit", results["submit"]))
+
+            settled = []
+            _, errors, elapsed = run_concurrently(
+                lambda _: settled.append(
+                    run_worker(batch_size=options["batch_size"], once=True)
+                ),
+                range(options["workers"]),
+                options["workers"],
+            )
+            results["settle"] = {
+                "requests": sum(settled),
+                "errors": len(errors),
+                "elapsed_s": elapsed,
+                "throughput": sum(settled) / elapsed if elapsed else 0.0,
+                "payments": Payment.objects.count(),
+                "failed": PaymentRequest.objects.filter(
+                    status=PaymentRequest.FAILED
+                ).count(),
+            }
+            self.stdout.write(
+                "settle: {requests} request(s) in {elapsed_s:.2f}s "
+                "({throughput:.1f}/s), {payments} payment(s), "
+                "{failed} failed".format(**results["settle"])
+            )
+        if options["json"]:
+            write_results(options["json"], results)
+
+    def create_orders(self, rng, options):
+        product_ids, users = seed_shop(
+            products=max(options["lines"], 100), users=10, orders_per_user=0
+        )
+        customers = [user.customer.pk for user in users]
+        Order.objects.bulk_create(
+            Order(customer_id=rng.choice(customers), paid=False)
+            for _ in range(options["orders"])
+        )
+        orders = Order.objects.order_by("pk")
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order_id=order_id,
+                product_id=product_id,
+                quantity=1,
+                unit_price=10,
+                line_total=10,
+            )
+            for order_id in orders.values_list("pk", flat=True)
+            for product_id in rng.sample(product_ids, options["lines"])
+        )
+        orders.update_totals()
+        return list(orders.values_list("pk", "total"))
+
+    def submit(self, job):
+        order_id, amount = job
+        response = Client().post(
+            reverse("process_payment", args=[order_id]),
+            {"amount": amount, "idempotency_key": f"bench-{order_id}"},
+            HTTP_ACCEPT="application/json",
+        )
+        if response.status_code != 202:
+            raise RuntimeError(f"Order {order_id}: {response.status_code}")
@@ -0,0 +1,134 @@
+import random
+import resource
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from shop.benchmarks import (benchmark_databases, format_summary, seed_shop,
+                             summarize, write_results)
+from shop.models import Order, OrderItem
+from shop.recommendations import build, recommended_for, recommended_for_cart
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark building the recommendation table from a synthetic order "
+        "history (1M orders by default) and looking recommendations up."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=1_000_000)
+        parser.add_argument("--products", type=int, default=10_000)
+        parser.add_argument(
+            "--lines", type=int, default=3, help="Average products per order."
+        )
+        parser.add_argument(
+            "--group-size",
+            type=int,
+            default=20,
+            help="Products in a group that tend to be bought together.",
+        )
+        parser.add_argument("--top-k", type=int, default=10)
+        parser.add_argument("--lookups", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=20_000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", help="Write results to this file.")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        results = {"params": {k: options[k] for k in ("orders", "products", "lines")}}
+        with benchmark_databases():
+            start = time.perf_counter()
+            product_ids = self.seed(rng, options)
+            self.stdout.write(
+                f"seeded {options['orders']} orders in "
+                f"{time.perf_counter() - start:.1f}s"
+            )
+
+            rss_before = peak_rss_mb()
+            start = time.perf_counter()
+            result = build(k=options["top_k"])
+            results["build"] = {
+                "elapsed_s": time.perf_counter() - start,
+                "orders": result.orders,
+                "pairs": result.pairs,
+                "rows": result.rows,
+                "peak_rss_mb": peak_rss_mb(),
+                "peak_rss_growth_mb": peak_rss_mb() - rss_before,
+            }
+            self.stdout.write(
+                "build: {orders} orders, {pairs} pairs, {rows} rows in "
+                "{elapsed_s:.2f}s, peak RSS {peak_rss_mb:.0f}MB "
+                "(+{peak_rss_growth_mb:.0f}MB)".format(**results["build"])
+            )
+
+            picks = random.Random(options["seed"])
+            # Bez cache, żeby mierzyć samo zapytanie do indeksu
+            with override_settings(CATALOG_CACHE_TIMEOUT=0):
+                for name, lookup in [
+                    ("product", lambda: recommended_for(picks.choice(product_ids))),
+                    (
+                        "cart[3 products]",
+                        lambda: recommended_for_cart(picks.sample(product_ids, 3)),
+                    ),
+                ]:
+                    latencies = []
+                    start = time.perf_counter()
+                    for _ in range(options["lookups"]):
+                        lookup_start = time.perf_counter()
+                        lookup()
+                        latencies.append(time.perf_counter() - lookup_start)
+                    name = f"lookup {name}"
+                    results[name] = summarize(latencies, time.perf_counter() - start)
+                    self.stdout.write(format_summary(name, results[name]))
+        if options["json"]:
+            write_results(options["json"], results)
+
+    def seed(self, rng, options):
+        """
+        Orders whose products mostly come from one group of related
+        products, with popular groups bought more often.
+        """
+        product_ids, users = seed_shop(
+            products=options["products"], users=10, orders_per_user=0
+        )
+        product_ids = np.array(product_ids)
+        customers = [user.customer.pk for user in users]
+        group_size = options["group_size"]
+        groups = max(1, len(product_ids) // group_size)
+        popularity = 1 / np.arange(1, groups + 1)
+        popularity /= popularity.sum()
+
+        batch_size = options["batch_size"]
+        next_id = 1
+        for offset in range(0, options["orders"], batch_size):
+            count = min(batch_size, options["orders"] - offset)
+            order_ids = np.arange(next_id, next_id + count)
+            next_id += count
+            Order.objects.bulk_create(
+                Order(id=order_id, customer_id=customers[order_id % len(customers)])
+                for order_id in order_ids.tolist()
+            )
+            sizes = np.maximum(1, rng.poisson(options["lines"], count))
+            orders = np.repeat(order_ids, sizes)
+            group = np.repeat(rng.choice(groups, count, p=popularity), sizes)
+            related = group * group_size + rng.integers(0, group_size, len(orders))
+            anything = rng.integers(0, len(product_ids), len(orders))
+            lines = np.where(rng.random(len(orders)) < 0.8, related, anything)
+            lines = product_ids[np.minimum(lines, len(product_ids) - 1)]
+            OrderItem.objects.bulk_create(
+                OrderItem(
+                    order_id=order_id,
+                    product_id=product_id,
+                    unit_price=10,
+                    line_total=10,
+                )
+                for order_id, product_id in zip(orders.tolist(), lines.tolist())
+            )
+        return product_ids.tolist()
@@ -0,0 +1,69 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.benchmarks import (benchmark_databases, format_summary, summarize,
+                             write_results)
+from shop.models import Product
+from shop.search import search_products
+
+WORDS = (
+    "red blue green black white steel wooden glass ceramic cotton leather "
+    "lamp chair table kettle mug teapot shirt jacket shoe bag bottle desk "
+    "phone cable charger speaker pillow blanket towel knife pan pot plate "
+    "small large compact portable classic modern vintage premium eco smart"
+).split()
+
+
+def random_text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+class Command(BaseCommand):
+    help = "Benchmark full-text product search latency at several catalog sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+        )
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", help="Write results to this file.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        queries = [
+            random_text(rng, rng.randint(1, 3)) for _ in range(options["queries"])
+        ]
+        results = {}
+        with benchmark_databases():
+            for size in sorted(options["sizes"]):
+                self.seed(rng, size, options["batch_size"])
+                latencies = []
+                start = time.perf_counter()
+                for query in queries:
+                    query_start = time.perf_counter()
+                    search_products(query)
+                    latencies.append(time.perf_counter() - query_start)
+                name = f"search[{size} products]"
+                results[name] = summarize(latencies, time.perf_counter() - start)
+                self.stdout.write(format_summary(name, results[name]))
+        if options["json"]:
+            write_results(options["json"], results)
+
+    def seed(self, rng, size, batch_size):
+        existing = Product.objects.count()
+        while existing < size:
+            batch = min(batch_size, size - existing)
+            Product.objects.bulk_create(
+                Product(
+                    name=random_text(rng, 3),
+                    description=random_text(rng, 20),
+                    price=rng.randint(1, 500),
+                    stock=rng.randint(0, 100),
+                )
+                for _ in range(batch)
+            )
+            existing += batch
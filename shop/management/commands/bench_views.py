@@ -0,0 +1,180 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from shop.benchmarks import (benchmark_databases, compare_results,
+                             format_summary, load_results, run_concurrently,
+                             seed_shop, summarize, write_results)
+from shop.cart import add_items
+from shop.models import Order
+from shop.query_budget import QueryCounter
+
+SCENARIOS = [
+    "product_list",
+    "product_list_user",
+    "add_to_cart",
+    "checkout",
+    "order_list",
+    "process_payment",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with a synthetic shop and measure "
+        "throughput, latency percentiles and queries per request of the main "
+        "views."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1000)
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--orders-per-user", type=int, default=5)
+        parser.add_argument("--cart-lines", type=int, default=5)
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS
+        )
+        parser.add_argument("--json", help="Write results to this file.")
+        parser.add_argument(
+            "--baseline", help="Compare with the JSON results of an earlier run."
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Relative change that counts as a regression.",
+        )
+
+    def handle(self, *args, **options):
+        if "process_payment" in options["scenarios"]:
+            # Płatności potrzebują zamówień złożonych w scenariuszu checkout
+            if "checkout" not in options["scenarios"]:
+                raise CommandError("process_payment needs the checkout scenario.")
+        self.rng = random.Random(options["seed"])
+        results = {"params": {k: options[k] for k in self.param_names()}}
+        with benchmark_databases():
+            self.products, users = seed_shop(
+                products=options["products"],
+                users=options["users"],
+                orders_per_user=options["orders_per_user"],
+                seed=options["seed"],
+            )
+            self.clients = []
+            for user in users:
+                client = Client()
+                client.force_login(user)
+                self.clients.append((user, client))
+            for name in SCENARIOS:
+                if name in options["scenarios"]:
+                    jobs = getattr(self, f"jobs_{name}")(options)
+                    results[name] = self.run(jobs, options["concurrency"])
+                    self.stdout.write(format_summary(name, results[name]))
+        if options["json"]:
+            write_results(options["json"], results)
+        if options["baseline"]:
+            self.compare(load_results(options["baseline"]), results, options)
+
+    def compare(self, baseline, results, options):
+        regressions = 0
+        for name, metric, old, new, regressed in compare_results(
+            baseline, results, options["tolerance"]
+        ):
+            regressions += regressed
+            flag = "  REGRESSION" if regressed else ""
+            self.stdout.write(f"{name:<20} {metric:<12} {old:>10.2f} -> {new:>10.2f}{flag}")
+        if regressions:
+            raise CommandError(f"{regressions} metric(s) regressed.")
+
+    def param_names(self):
+        return [
+            "products",
+            "users",
+            "orders_per_user",
+            "cart_lines",
+            "requests",
+            "concurrency",
+            "seed",
+        ]
+
+    def run(self, jobs, concurrency):
+        queries = []
+
+        def request(job):
+            client, method, url, data = job
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                response = getattr(client, method)(url, data)
+            queries.append(counter.count)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{url}: {response.status_code}")
+
+        latencies, errors, elapsed = run_concurrently(request, jobs, concurrency)
+        summary = summarize(latencies, elapsed, len(errors))
+        summary["queries_avg"] = sum(queries) / len(queries) if queries else 0
+        summary["queries_max"] = max(queries, default=0)
+        return summary
+
+    def random_client(self):
+        return self.rng.choice(self.clients)[1]
+
+    def jobs_product_list(self, options):
+        # Anonimowi użytkownicy trafiają w cache katalogu
+        client = Client()
+        url = reverse("product_list")
+        return [(client, "get", url, None) for _ in range(options["requests"])]
+
+    def jobs_product_list_user(self, options):
+        url = reverse("product_list")
+        return [
+            (self.random_client(), "get", url, None)
+            for _ in range(options["requests"])
+        ]
+
+    def jobs_add_to_cart(self, options):
+        return [
+            (
+                self.random_client(),
+                "get",
+                reverse("add_to_cart", args=[self.rng.choice(self.products)]),
+                None,
+            )
+            for _ in range(options["requests"])
+        ]
+
+    def jobs_checkout(self, options):
+        # Każde zamówienie potrzebuje pełnego koszyka; wypełniamy je przed pomiarem
+        jobs = []
+        clients = self.clients[: options["requests"]]
+        for user, client in clients:
+            lines = self.rng.sample(self.products, options["cart_lines"])
+            add_items(user, {product_id: 1 for product_id in lines})
+            jobs.append((client, "post", reverse("checkout"), None))
+        return jobs
+
+    def jobs_order_list(self, options):
+        url = reverse("order_list")
+        return [
+            (self.random_client(), "get", url, None)
+            for _ in range(options["requests"])
+        ]
+
+    def jobs_process_payment(self, options):
+        clients = dict((user.pk, client) for user, client in self.clients)
+        orders = Order.objects.filter(paid=False, payment=None)
+        return [
+            (
+                clients[customer_user_id],
+                "post",
+                reverse("process_payment", args=[order_id]),
+                {"amount": str(total), "idempotency_key": f"bench-{order_id}"},
+            )
+            for order_id, customer_user_id, total in orders.values_list(
+                "pk", "customer__user_id", "total"
+            )[: options["requests"]]
+        ]
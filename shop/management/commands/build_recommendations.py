@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.recommendations import build
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the "customers also bought" table from the whole order '
+        "history. Run it periodically, e.g. nightly from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--top-k",
+            type=int,
+            help="Neighbours kept per product; defaults to RECOMMENDATIONS_TOP_K.",
+        )
+        parser.add_argument(
+            "--min-orders",
+            type=int,
+            default=1,
+            help="Ignore pairs bought together in fewer orders than this.",
+        )
+        parser.add_argument(
+            "--max-lines",
+            type=int,
+            default=50,
+            help="Skip orders with more distinct products than this.",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            result = build(
+                k=options["top_k"],
+                max_lines=options["max_lines"],
+                min_orders=options["min_orders"],
+            )
+        except ImportError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"{result.orders} order(s), {result.products} product(s), "
+            f"{result.pairs} pair(s): stored {result.rows} recommendation(s) "
+            f"in {time.perf_counter() - start:.2f}s."
+        )
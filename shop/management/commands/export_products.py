@@ -0,0 +1,37 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.transfer import FORMATS, export_products, guess_format
+
+
+class Command(BaseCommand):
+    help = "Write every product to a CSV or JSON Lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to write, or - for stdout.")
+        parser.add_argument("--format", choices=FORMATS)
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or guess_format(path)
+        start = time.perf_counter()
+        try:
+            if path == "-":
+                count = export_products(
+                    sys.stdout, fmt, chunk_size=options["chunk_size"]
+                )
+            else:
+                with open(path, "w", newline="", encoding="utf-8") as fh:
+                    count = export_products(fh, fmt, chunk_size=options["chunk_size"])
+        except OSError as e:
+            raise CommandError(e)
+        elapsed = time.perf_counter() - start
+        rate = count / elapsed if elapsed else 0.0
+        # Przy eksporcie na stdout raport idzie na stderr
+        report = self.stderr if path == "-" else self.stdout
+        report.write(
+            f"Exported {count} product(s) in {elapsed:.1f}s ({rate:.0f} rows/s)."
+        )
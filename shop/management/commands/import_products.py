@@ -0,0 +1,51 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.transfer import (FORMATS, ImportFormatError, guess_format,
+                           import_products, read_rows)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products from a CSV or JSON Lines file, matching "
+        "rows on SKU. Only the columns present in the file are updated; "
+        "stock sets new products only, a restock column adds deliveries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read, or - for stdin.")
+        parser.add_argument("--format", choices=FORMATS)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--max-errors",
+            type=int,
+            default=20,
+            help="How many invalid rows to print.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or guess_format(path)
+        start = time.perf_counter()
+        try:
+            if path == "-":
+                result = import_products(
+                    read_rows(sys.stdin, fmt), options["batch_size"]
+                )
+            else:
+                with open(path, newline="", encoding="utf-8") as fh:
+                    result = import_products(read_rows(fh, fmt), options["batch_size"])
+        except (OSError, ImportFormatError) as e:
+            raise CommandError(e)
+        elapsed = time.perf_counter() - start
+
+        for line, message in result.errors[: options["max_errors"]]:
+            self.stderr.write(f"Line {line}: {message}")
+        rate = result.rows / elapsed if elapsed else 0.0
+        self.stdout.write(
+            f"{result.rows} row(s) in {elapsed:.1f}s ({rate:.0f} rows/s): "
+            f"{result.created} created, {result.updated} updated, "
+            f"{len(result.errors)} invalid."
+        )
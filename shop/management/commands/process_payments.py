@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from shop.payments import run_worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Settle queued payments. Runs until interrupted; start several to "
+        "settle in parallel."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when no payment is due.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when no payment is due."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            processed = run_worker(
+                batch_size=options["batch_size"],
+                poll_interval=options["poll_interval"],
+                once=options["once"],
+            )
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(f"Processed {processed} payment request(s).")
@@ -0,0 +1,24 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.analytics import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollups from orders, e.g. after a backfill."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument("--end", type=date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options["start"] and options["end"] and options["start"] > options["end"]:
+            raise CommandError("--start cannot be after --end.")
+        products, customers = rebuild(
+            options["start"], options["end"], options["batch_size"]
+        )
+        self.stdout.write(
+            f"Rebuilt {products} product and {customers} customer rollup row(s)."
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.images import ImageError, render_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the resized WebP/JPEG versions of product images across a "
+        "pool of processes. Only missing or outdated ones unless --force."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, help="Processes to use; defaults to one per CPU."
+        )
+        parser.add_argument(
+            "--force", action="store_true", help="Render every product again."
+        )
+
+    def handle(self, *args, **options):
+        rendered = failed = 0
+        try:
+            for product_id, error in render_catalog(
+                force=options["force"], workers=options["workers"]
+            ):
+                if error:
+                    failed += 1
+                    self.stderr.write(f"Product {product_id}: {error}")
+                else:
+                    rendered += 1
+        except ImageError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Rendered {rendered} product(s), {failed} failed.")
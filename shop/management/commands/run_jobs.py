@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from shop.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (e-mails, stock alerts) until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Worker threads; defaults to settings.JOB_WORKER_CONCURRENCY.",
+        )
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when no job is due.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when no job is due."
+        )
+
+    def handle(self, *args, **options):
+        processed = run_worker(
+            concurrency=options["concurrency"],
+            batch_size=options["batch_size"],
+            poll_interval=options["poll_interval"],
+            once=options["once"],
+        )
+        self.stdout.write(f"Processed {processed} job(s).")
@@ -0,0 +1,254 @@
+"""
+Per-request performance metrics.
+
+``PerformanceMiddleware`` instruments a sample of requests, set by
+``settings.PERF_METRICS_SAMPLE_RATE`` (0.0 to 1.0). For each one it records
+total latency, the number of SQL queries and the time spent in them, the
+slowest query and template render time. Render time needs the
+``TimedDjangoTemplates`` backend. Sampled responses get a ``Server-Timing``
+header, and the numbers are aggregated per URL name in ``registry``. Staff
+can read them from the ``metrics`` view.
+
+The registry lives in process memory, so each worker reports its own
+traffic. The middleware runs natively under both WSGI and ASGI; queries are
+timed through a context variable, so those an async view runs with
+``sync_to_async`` count too.
+"""
+import asyncio
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_current = ContextVar("perf_timings", default=None)
+
+
+class RequestTimings:
+    """SQL and template timings for one request; also an execute wrapper."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.templates = 0.0
+        self.slowest_query = ("", 0.0)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.sql += duration
+            if duration > self.slowest_query[1]:
+                self.slowest_query = (sql, duration)
+
+
+def _timed_execute(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    # Na stałe na każdym połączeniu; działa tylko w czasie mierzonego żądania
+    if _timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_timed_execute)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.templates += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing every top-level render."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+class Histogram:
+    def __init__(self, bounds=BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def add(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def percentile(self, pct):
+        """
+        Upper bound of the bucket holding the ``pct`` percentile, or None when
+        it is past the last bound (JSON has no infinity).
+        """
+        total = sum(self.counts)
+        if not total:
+            return 0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= total * pct / 100:
+                return self.bounds[i] if i < len(self.bounds) else None
+
+    def as_dict(self):
+        labels = [f"le_{bound}" for bound in self.bounds] + ["inf"]
+        return dict(zip(labels, self.counts))
+
+
+class ViewStats:
+    def __init__(self):
+        self.count = 0
+        self.latency = Histogram()
+        self.max_ms = 0.0
+        self.total_ms = 0.0
+        self.queries = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.slowest_query = ("", 0.0)
+
+    def add(self, latency_ms, timings):
+        self.count += 1
+        self.latency.add(latency_ms)
+        self.max_ms = max(self.max_ms, latency_ms)
+        self.total_ms += latency_ms
+        self.queries += timings.queries
+        self.sql_ms += timings.sql * 1000
+        self.template_ms += timings.templates * 1000
+        sql, duration = timings.slowest_query
+        if duration * 1000 > self.slowest_query[1]:
+            self.slowest_query = (sql, duration * 1000)
+
+    def as_dict(self):
+        count = self.count or 1
+        return {
+            "requests": self.count,
+            "latency_ms": {
+                "avg": self.total_ms / count,
+                "p50": self.latency.percentile(50),
+                "p95": self.latency.percentile(95),
+                "p99": self.latency.percentile(99),
+                "max": self.max_ms,
+                "histogram": self.latency.as_dict(),
+            },
+            "sql_queries_avg": self.queries / count,
+            "sql_ms_avg": self.sql_ms / count,
+            "template_ms_avg": self.template_ms / count,
+            "slowest_query": {
+                "sql": self.slowest_query[0],
+                "ms": self.slowest_query[1],
+            },
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, name, latency_ms, timings):
+        with self._lock:
+            self._views.setdefault(name, ViewStats()).add(latency_ms, timings)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: stats.as_dict() for name, stats in sorted(self._views.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = MetricsRegistry()
+
+
+def sample_rate():
+    return getattr(settings, "PERF_METRICS_SAMPLE_RATE", 1.0)
+
+
+def sampled():
+    rate = sample_rate()
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+def server_timing(latency_ms, timings):
+    return ", ".join(
+        [
+            f"total;dur={latency_ms:.1f}",
+            f'sql;dur={timings.sql * 1000:.1f};desc="{timings.queries} queries"',
+            f"sql-max;dur={timings.slowest_query[1] * 1000:.1f}",
+            f"tpl;dur={timings.templates * 1000:.1f}",
+        ]
+    )
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Pod ASGI zostajemy w pętli zdarzeń (jak MiddlewareMixin)
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not sampled():
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, start, timings)
+
+    async def __acall__(self, request):
+        if not sampled():
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, start, timings)
+
+    def record(self, request, response, start, timings):
+        latency_ms = (time.perf_counter() - start) * 1000
+        match = request.resolver_match
+        registry.record(
+            match.view_name if match else "<unresolved>", latency_ms, timings
+        )
+        if getattr(settings, "PERF_SERVER_TIMING", True):
+            response["Server-Timing"] = server_timing(latency_ms, timings)
+        return response
@@ -0,0 +1,92 @@
+# Generated by Django 4.0.3 on 2026-10-18 06:40
+
+from django.db import migrations
+
+# Kopia SQL z shop/search.py z chwili tej migracji: późniejsze zmiany
+# w search.py nie mogą zmieniać tego, co robi migracja.
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_insert
+    AFTER INSERT ON shop_product BEGIN
+        INSERT INTO shop_product_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_delete
+    AFTER DELETE ON shop_product BEGIN
+        INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_update
+    AFTER UPDATE OF name, description ON shop_product BEGIN
+        INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO shop_product_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+CREATE_INDEX = {
+    "sqlite": [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5(
+            name, description,
+            content='shop_product', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        *SQLITE_TRIGGERS,
+        "INSERT INTO shop_product_fts(shop_product_fts) VALUES ('rebuild')",
+    ],
+    "postgresql": [
+        """
+        ALTER TABLE shop_product ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+        ) STORED
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS shop_product_search_idx
+        ON shop_product USING GIN (search_vector)
+        """,
+    ],
+}
+
+DROP_INDEX = {
+    "sqlite": [
+        "DROP TRIGGER IF EXISTS shop_product_fts_update",
+        "DROP TRIGGER IF EXISTS shop_product_fts_delete",
+        "DROP TRIGGER IF EXISTS shop_product_fts_insert",
+        "DROP TABLE IF EXISTS shop_product_fts",
+    ],
+    "postgresql": [
+        "DROP INDEX IF EXISTS shop_product_search_idx",
+        "ALTER TABLE shop_product DROP COLUMN IF EXISTS search_vector",
+    ],
+}
+
+
+def create_search_index(apps, schema_editor):
+    for sql in CREATE_INDEX.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    for sql in DROP_INDEX.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
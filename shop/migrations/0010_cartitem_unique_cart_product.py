@@ -0,0 +1,34 @@
+# Generated by Django 4.0.3 on 2026-10-18 05:53
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_items(apps, schema_editor):
+    # Scal powtórzone pozycje koszyka w jedną, sumując ilości
+    CartItem = apps.get_model("shop", "CartItem")
+    items = CartItem.objects.using(schema_editor.connection.alias)
+    duplicates = (
+        items.values("cart_id", "product_id")
+        .annotate(lines=Count("id"), keep=Min("id"), quantity=Sum("quantity"))
+        .filter(lines__gt=1)
+    )
+    for row in duplicates:
+        group = items.filter(cart_id=row["cart_id"], product_id=row["product_id"])
+        group.exclude(pk=row["keep"]).delete()
+        group.filter(pk=row["keep"]).update(quantity=row["quantity"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_product_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
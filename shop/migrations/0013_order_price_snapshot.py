@@ -0,0 +1,79 @@
+# Generated by Django 4.0.3 on 2026-10-18 07:10
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill(apps, schema_editor):
+    # Pozycje dostają bieżącą cenę i nazwę produktu (starszej nie znamy),
+    # zamówienia sumę swoich pozycji
+    using = schema_editor.connection.alias
+    Product = apps.get_model("shop", "Product")
+    Order = apps.get_model("shop", "Order")
+    OrderItem = apps.get_model("shop", "OrderItem")
+
+    product = Product.objects.using(using).filter(pk=OuterRef("product_id"))
+    items = OrderItem.objects.using(using)
+    items.update(
+        unit_price=Subquery(product.values("price")),
+        product_name=Subquery(product.values("name")),
+    )
+    items.update(line_total=F("unit_price") * F("quantity"))
+
+    lines = (
+        OrderItem.objects.using(using)
+        .filter(order=OuterRef("pk"))
+        .order_by()
+        .values("order")
+    )
+    Order.objects.using(using).update(
+        total=Coalesce(
+            Subquery(lines.annotate(sum=Sum("line_total")).values("sum")),
+            Value(Decimal("0.00")),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+        item_count=Coalesce(
+            Subquery(lines.annotate(sum=Sum("quantity")).values("sum")), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_daily_sales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,39 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import (DecimalField, F, OuterRef, Prefetch, Subquery, Sum,
+                              Value)
+from django.db.models.functions import Coalesce, Upper
 from django.contrib.auth.models import User
+from django.core.validators import FileExtensionValidator
+from django.utils import timezone
+
+
+IMAGE_EXTENSIONS = ["jpg", "jpeg", "png", "webp"]
+
+
+def items_total(prefix="items"):
+    # SUM(quantity * product.price) over the related items, 0 for no items
+    return Coalesce(
+        Sum(
+            F(f"{prefix}__quantity") * F(f"{prefix}__product__price"),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+        Value(Decimal("0.00")),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+class TotalsQuerySet(models.QuerySet):
+    def with_totals(self):
+        return self.annotate(total=items_total())
+
+    def with_items(self):
+        # Pozycje razem z produktami w jednym dodatkowym zapytaniu
+        item_model = self.model._meta.get_field("items").related_model
+        return self.prefetch_related(
+            Prefetch("items", queryset=item_model.objects.select_related("product"))
+        )
 
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="customer", null=False, blank=True)
@@ -8,26 +42,83 @@ class Customer(models.Model):
     email = models.EmailField()
     address = models.TextField()
 
+    class Meta:
+        indexes = [
+            # Wyszukiwanie klienta po e-mailu w panelu admina (iexact)
+            models.Index(Upper("email"), name="customer_email_upper_idx"),
+        ]
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
 
 class Product(models.Model):
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=100)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField()
     available = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Bez Pillow nie ma ImageField; wersje obrazka tworzy shop.images.
+    # Pliki idą z naszej domeny, więc tylko obrazki (żadnego HTML czy SVG)
+    image = models.FileField(
+        upload_to="products/originals/",
+        blank=True,
+        validators=[FileExtensionValidator(IMAGE_EXTENSIONS)],
+    )
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["available", "name", "id"], name="product_avail_name_idx"
+            ),
+            models.Index(
+                fields=["available", "price", "id"], name="product_avail_price_idx"
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # Obrazek zapisany w bazie; zapis bez nowego pliku nic nie przelicza
+        if "image" in field_names:
+            product._saved_image = values[field_names.index("image")]
+        return product
+
     def update_stock(self, quantity):
-        if self.stock >= quantity:
-            self.stock -= quantity
-            self.save()
-            return True
-        return False
+        from .inventory import take_stock
+
+        # Atomowa zmiana stanu, bez nadpisywania pozostałych kolumn
+        taken = take_stock(self.pk, quantity)
+        self.refresh_from_db(fields=["stock", "updated_at"])
+        return taken
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        # Pozycje mają własną kopię nazwy i ceny produktu, więc bez JOIN-a
+        return self.prefetch_related("items")
+
+    def update_totals(self):
+        """Recompute the cached ``total`` and ``item_count`` from the items."""
+        items = (
+            OrderItem.objects.filter(order=OuterRef("pk")).order_by().values("order")
+        )
+        return self.update(
+            total=Coalesce(
+                Subquery(items.annotate(sum=Sum("line_total")).values("sum")),
+                Value(Decimal("0.00")),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+            item_count=Coalesce(
+                Subquery(items.annotate(sum=Sum("quantity")).values("sum")), 0
+            ),
+        )
 
 
 class Order(models.Model):
@@ -36,17 +127,26 @@ class Order(models.Model):
     customer = models.ForeignKey(
         Customer, related_name="orders", on_delete=models.CASCADE, null=False, default=1
     )
+    # Kopia sumy pozycji, aktualizowana przy każdym zapisie pozycji
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="order_created_idx"),
+        ]
 
     def _str_(self):
         return f"Order {self.id}"
 
     def mark_as_paid(self):
         self.paid = True
-        self.save()
+        self.save(update_fields=["paid"])
 
     def get_total_price(self):
-        total = sum(item.get_total_price() for item in self.items.all())
-        return total
+        return self.total
 
 
 class OrderItem(models.Model):
@@ -55,9 +155,25 @@ class OrderItem(models.Model):
         Product, related_name="order_items", on_delete=models.CASCADE
     )
     quantity = models.PositiveIntegerField(default=1)
+    # Nazwa i cena produktu z chwili złożenia zamówienia
+    product_name = models.CharField(max_length=100, blank=True)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    line_total = models.DecimalField(max_digits=12, decimal_places=2)
+
+    def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.unit_price = self.product.price
+        self.unit_price = self._meta.get_field("unit_price").to_python(self.unit_price)
+        if not self.product_name:
+            self.product_name = self.product.name
+        self.line_total = self.unit_price * self.quantity
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "line_total"}
+        super().save(*args, **kwargs)
 
     def get_total_price(self):
-        return self.product.price * self.quantity
+        return self.line_total
 
 
 class Payment(models.Model):
@@ -67,20 +183,74 @@ class Payment(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     paid_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["paid_at"], name="payment_paid_at_idx"),
+        ]
+
     def __str__(self):
         return f"Payment for Order {self.order.id}"
 
     def process_payment(self):
+        from .analytics import record_payment
+        from .inventory import commit_reservations
+
         if self.amount >= self.order.get_total_price():
-            self.order.mark_as_paid()
-            # Zmniejszenie stanu magazynowego dla każdego produktu w zamówieniu
-            for order_item in self.order.items.all():
-                order_item.product.update_stock(order_item.quantity)
-            self.save()
+            with transaction.atomic():
+                # Stan magazynowy został zarezerwowany przy składaniu zamówienia
+                commit_reservations(self.order)
+                if not self.order.paid:
+                    record_payment(self.order)
+                self.order.mark_as_paid()
+                self.save()
             return True
         return False
 
 
+class PaymentRequest(models.Model):
+    """
+    A queued payment, settled by ``manage.py process_payments``. The client's
+    idempotency key makes repeated submits return the same request.
+    """
+
+    PENDING = "pending"
+    PROCESSING = "processing"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (PROCESSING, "Processing"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    order = models.ForeignKey(
+        Order, related_name="payment_requests", on_delete=models.CASCADE
+    )
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Kiedy żądanie może zostać pobrane: ponowienie albo koniec dzierżawy workera
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "available_at"], name="payment_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"Payment request {self.idempotency_key} for Order {self.order_id}"
+
+    @property
+    def settled(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+
 
 
 
@@ -89,12 +259,17 @@ class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TotalsQuerySet.as_manager()
+
     def __str__(self):
         return f"Cart of {self.user.username}"
 
     def get_total(self):
-        total = sum(item.get_total_price() for item in self.items.all())
-        return total
+        if hasattr(self, "total"):
+            return self.total
+        return Cart.objects.with_totals().values_list("total", flat=True).get(
+            pk=self.pk
+        )
 
 
 class CartItem(models.Model):
@@ -102,8 +277,153 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["cart", "product"], name="unique_cart_product"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
 
     def get_total_price(self):
         return self.product.price * self.quantity
+
+
+class StockReservation(models.Model):
+    HELD = "held"
+    COMMITTED = "committed"
+    RELEASED = "released"
+    STATUS_CHOICES = [
+        (HELD, "Held"),
+        (COMMITTED, "Committed"),
+        (RELEASED, "Released"),
+    ]
+
+    product = models.ForeignKey(
+        Product, related_name="reservations", on_delete=models.CASCADE
+    )
+    order = models.ForeignKey(
+        Order, related_name="reservations", on_delete=models.CASCADE
+    )
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=HELD)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "expires_at"], name="reservation_expiry_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for Order {self.order_id} ({self.status})"
+
+
+class Job(models.Model):
+    """A background task queued by ``shop.jobs.enqueue``."""
+
+    PENDING = "pending"
+    PROCESSING = "processing"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (PROCESSING, "Processing"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "available_at"], name="job_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.task} ({self.status})"
+
+
+class ProductRecommendation(models.Model):
+    """
+    One of a product's top "customers also bought" neighbours, rebuilt in
+    batch by ``shop.recommendations.build``.
+    """
+
+    product = models.ForeignKey(
+        Product, related_name="recommendations", on_delete=models.CASCADE
+    )
+    recommended = models.ForeignKey(
+        Product, related_name="recommended_by", on_delete=models.CASCADE
+    )
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    orders = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            # Indeks (product, rank) obsługuje odczyt rekomendacji
+            models.UniqueConstraint(
+                fields=["product", "rank"], name="unique_recommendation_rank"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} (#{self.rank})"
+
+
+class ProductDailySales(models.Model):
+    """Units and revenue per product for orders placed on ``date``."""
+
+    date = models.DateField()
+    product = models.ForeignKey(
+        Product, related_name="daily_sales", on_delete=models.CASCADE
+    )
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_units = models.PositiveIntegerField(default=0)
+    paid_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "product"], name="unique_product_sales_day"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} on {self.date}: {self.units} units"
+
+
+class CustomerDailySales(models.Model):
+    """Orders and revenue per customer for orders placed on ``date``."""
+
+    date = models.DateField()
+    customer = models.ForeignKey(
+        Customer, related_name="daily_sales", on_delete=models.CASCADE
+    )
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_orders = models.PositiveIntegerField(default=0)
+    paid_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "customer"], name="unique_customer_sales_day"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} on {self.date}: {self.orders} orders"
@@ -0,0 +1,94 @@
+"""
+Order confirmations and low-stock alerts, sent from background jobs.
+
+Mail goes through Django's ``EMAIL_BACKEND``: the console or file backend
+locally, ``django_ses.SESBackend`` or ``shop.mail.SendgridBackend`` in
+production, and the in-memory outbox in tests.
+"""
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+
+from .jobs import PartialFailure, enqueue, task
+from .models import Order, Product
+
+
+def low_stock_threshold():
+    return getattr(settings, "LOW_STOCK_THRESHOLD", 5)
+
+
+def queue_order_confirmation(order):
+    enqueue("order_confirmation", {"order": order.pk})
+
+
+def queue_low_stock_alerts(quantities):
+    """
+    Queue an alert for the products that taking ``{product_id: quantity}``
+    out of stock has just brought down to the threshold. Products that were
+    already low don't alert again on every sale.
+    """
+    threshold = low_stock_threshold()
+    low = Product.objects.filter(pk__in=quantities, stock__lte=threshold)
+    crossed = sorted(
+        pk
+        for pk, stock in low.values_list("pk", "stock")
+        if stock + quantities[pk] > threshold
+    )
+    if crossed:
+        enqueue("low_stock_alert", {"products": crossed})
+
+
+@task("order_confirmation")
+def send_order_confirmations(payloads):
+    orders = (
+        Order.objects.filter(pk__in=[payload["order"] for payload in payloads])
+        .select_related("customer__user")
+        .with_items()
+    )
+    messages = {}
+    for order in orders:
+        recipient = order.customer.email or order.customer.user.email
+        if not recipient:
+            continue
+        messages[order.pk] = EmailMessage(
+            f"Your order #{order.pk}",
+            render_to_string("shop/emails/order_confirmation.txt", {"order": order}),
+            to=[recipient],
+        )
+    # Jedno połączenie z dostawcą dla całej partii, ale wiadomości wysyłane
+    # po jednej: po błędzie ponawiamy tylko te, które nie wyszły
+    sent, failed, error = set(), set(), None
+    with get_connection() as connection:
+        for i, payload in enumerate(payloads):
+            message = messages.get(payload["order"])
+            if message is None or payload["order"] in sent:
+                continue
+            try:
+                if not connection.send_messages([message]):
+                    raise ConnectionError(f"Order #{payload['order']} was not sent.")
+            except Exception as e:
+                failed.add(i)
+                error = error or e
+            else:
+                sent.add(payload["order"])
+    if failed:
+        raise PartialFailure(failed, f"{type(error).__name__}: {error}")
+
+
+@task("low_stock_alert")
+def send_low_stock_alerts(payloads):
+    recipients = getattr(settings, "STOCK_ALERT_EMAILS", None) or [
+        email for _, email in settings.ADMINS
+    ]
+    if not recipients:
+        return
+    product_ids = {pk for payload in payloads for pk in payload["products"]}
+    products = Product.objects.filter(pk__in=product_ids).order_by("name")
+    EmailMessage(
+        "Low stock",
+        render_to_string(
+            "shop/emails/low_stock_alert.txt",
+            {"products": products, "threshold": low_stock_threshold()},
+        ),
+        to=recipients,
+    ).send()
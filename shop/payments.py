@@ -0,0 +1,119 @@
+"""
+Idempotent, queued payments.
+
+The payment view only records a ``PaymentRequest`` under the client's
+idempotency key and answers straight away; submitting the same key again
+returns the existing request instead of paying twice. Requests are settled
+in the background by ``manage.py process_payments``, which claims them
+from the table like any other queue (see ``shop.queue``). A claim not
+finished within ``PAYMENT_LEASE_SECONDS`` (a crashed worker) is taken again.
+
+Database errors are retried with exponential backoff, up to
+``PAYMENT_MAX_ATTEMPTS`` attempts. An insufficient amount, an order that is
+already paid or sold-out stock fail the request at once.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from . import queue
+from .exceptions import OutOfStock
+from .models import Order, Payment, PaymentRequest
+
+
+class IdempotencyConflict(ValueError):
+    pass
+
+
+class PaymentDeclined(Exception):
+    pass
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def max_attempts():
+    return getattr(settings, "PAYMENT_MAX_ATTEMPTS", 5)
+
+
+def lease():
+    return timedelta(seconds=getattr(settings, "PAYMENT_LEASE_SECONDS", 60))
+
+
+def submit_payment(order, amount, key):
+    """
+    Queue a payment of ``amount`` for ``order`` under ``key`` and return
+    ``(payment_request, created)``. Reusing a key for a different order or
+    amount raises ``IdempotencyConflict``.
+    """
+    payment_request, created = PaymentRequest.objects.get_or_create(
+        idempotency_key=key, defaults={"order": order, "amount": amount}
+    )
+    if not created and (
+        payment_request.order_id != order.pk or payment_request.amount != amount
+    ):
+        raise IdempotencyConflict(
+            "This idempotency key was already used for a different payment."
+        )
+    return payment_request, created
+
+
+def claim(limit=50):
+    return queue.claim(PaymentRequest, limit, lease())
+
+
+def settle(payment_request):
+    """Try to pay a claimed request once and return its new status."""
+    try:
+        with transaction.atomic():
+            order = Order.objects.select_for_update().get(pk=payment_request.order_id)
+            if not queue.finish(
+                [payment_request], status=PaymentRequest.SUCCEEDED, last_error=""
+            ):
+                raise LeaseLost()
+            if Payment.objects.filter(order=order).exists():
+                raise PaymentDeclined("This order has already been paid.")
+            payment = Payment(order=order, amount=payment_request.amount)
+            if not payment.process_payment():
+                raise PaymentDeclined("Insufficient amount to pay.")
+        return PaymentRequest.SUCCEEDED
+    except LeaseLost:
+        return PaymentRequest.PROCESSING
+    except (PaymentDeclined, OutOfStock) as e:
+        queue.finish([payment_request], status=PaymentRequest.FAILED, last_error=str(e))
+        return PaymentRequest.FAILED
+    except DatabaseError as e:
+        failed = queue.retry_or_fail(
+            [payment_request],
+            f"{type(e).__name__}: {e}",
+            max_attempts(),
+            getattr(settings, "PAYMENT_RETRY_SECONDS", 5),
+        )
+        return PaymentRequest.FAILED if failed else PaymentRequest.PENDING
+
+
+def process_due(batch_size=50):
+    """Settle one batch of due requests and return how many were claimed."""
+    claimed = claim(batch_size)
+    for payment_request in claimed:
+        settle(payment_request)
+    return len(claimed)
+
+
+def run_worker(batch_size=50, poll_interval=1.0, once=False):
+    """
+    Settle requests until stopped, sleeping ``poll_interval`` seconds
+    whenever nothing is due. With ``once`` return as soon as nothing is due.
+    Returns the number of requests claimed.
+    """
+    total = 0
+    while True:
+        claimed = process_due(batch_size)
+        total += claimed
+        if not claimed:
+            if once:
+                return total
+            time.sleep(poll_interval)
@@ -0,0 +1,175 @@
+"""
+PostgreSQL backend with connection health checks and an optional
+in-process connection pool. Use it as the ``ENGINE`` of a ``DATABASES``
+entry (``shop_project.database.database_config`` does) with these extra
+keys:
+
+``CONN_HEALTH_CHECKS``
+    Check a reused connection with a ``SELECT 1`` before its first query in
+    a request, and reconnect if the server has dropped it (restart,
+    failover, idle timeout) instead of failing the request.
+
+``POOL``
+    ``{"MAX_SIZE": 10, "TIMEOUT": 10}``: keep up to ``MAX_SIZE`` connections
+    per process, shared by its threads. Closing a connection, which Django
+    does at the end of every request when ``CONN_MAX_AGE`` is 0, returns it
+    to the pool instead of disconnecting. A thread waits up to ``TIMEOUT``
+    seconds for a free connection, then gets ``PoolTimeout``.
+"""
+import os
+import threading
+
+from django.db import DatabaseError
+from django.db.backends.postgresql import base as postgresql
+from psycopg2 import extensions, extras
+
+POOLS = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(DatabaseError):
+    pass
+
+
+def ping(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        return True
+    except postgresql.Database.Error:
+        return False
+
+
+class ConnectionPool:
+    def __init__(self, conn_params, max_size=10, timeout=10):
+        self.conn_params = conn_params
+        self.max_size = max_size
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def get(self, check=False):
+        """Take an idle connection, or open one if fewer than max are out."""
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(
+                f"No free database connection within {self.timeout} seconds."
+            )
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    break
+                if not check or ping(connection):
+                    return connection
+                connection.close()
+            connection = postgresql.Database.connect(**self.conn_params)
+            with self.lock:
+                self.opened += 1
+            return connection
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, connection, discard=False):
+        try:
+            status = extensions.TRANSACTION_STATUS_UNKNOWN
+            if not connection.closed:
+                status = connection.info.transaction_status
+            if not discard and status != extensions.TRANSACTION_STATUS_UNKNOWN:
+                try:
+                    if status != extensions.TRANSACTION_STATUS_IDLE:
+                        connection.rollback()
+                except postgresql.Database.Error:
+                    pass
+                else:
+                    with self.lock:
+                        self.idle.append(connection)
+                    return
+            connection.close()
+        finally:
+            self.slots.release()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+def get_pool(conn_params, options):
+    # Osobna pula na proces (po forku) i na parametry połączenia
+    key = (os.getpid(), tuple(sorted((k, str(v)) for k, v in conn_params.items())))
+    with _pools_lock:
+        pool = POOLS.get(key)
+        if pool is None:
+            pool = POOLS[key] = ConnectionPool(
+                conn_params,
+                max_size=options.get("MAX_SIZE", 10),
+                timeout=options.get("TIMEOUT", 10),
+            )
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(POOLS.values())
+        POOLS.clear()
+    for pool in pools:
+        pool.close()
+
+
+class DatabaseWrapper(postgresql.DatabaseWrapper):
+    pool = None
+    health_check_done = False
+    broken = False
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict.get("POOL")
+        if not options:
+            self.pool = None
+            return super().get_new_connection(conn_params)
+        self.pool = get_pool(conn_params, options)
+        connection = self.pool.get(check=self.settings_dict.get("CONN_HEALTH_CHECKS"))
+        # To samo co w postgresql.DatabaseWrapper.get_new_connection
+        try:
+            self.isolation_level = self.settings_dict["OPTIONS"]["isolation_level"]
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def connect(self):
+        super().connect()
+        # Świeże połączenie nie wymaga sprawdzania
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        # Django woła to na początku i na końcu każdego żądania
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
+
+    def ensure_connection(self):
+        if (
+            self.connection is not None
+            and self.settings_dict.get("CONN_HEALTH_CHECKS")
+            and not self.health_check_done
+            and not self.in_atomic_block
+        ):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.broken = True
+                self.close()
+        super().ensure_connection()
+
+    def _close(self):
+        broken, self.broken = self.broken, False
+        if self.pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            self.pool.put(self.connection, discard=broken or self.errors_occurred)
@@ -0,0 +1,121 @@
+"""
+Per-view SQL query budgets.
+
+Decorate a view with ``@query_budget(n)`` (outermost, above ``login_required``
+and friends) to declare how many queries one request to it may run,
+including the session and user lookups done by middleware.
+``QueryBudgetMiddleware`` counts the queries and, when
+``settings.QUERY_BUDGET_STRICT`` is on, raises ``QueryBudgetExceeded`` so
+a test exercising the view fails; otherwise it logs a warning. Strict mode
+is off by default and always on under ``BudgetTestRunner``. Queries that an
+async view runs with ``sync_to_async`` are counted too.
+"""
+import asyncio
+import logging
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.test.runner import DiscoverRunner
+
+logger = logging.getLogger(__name__)
+
+_counter = ContextVar("query_budget_counter", default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class BudgetTestRunner(DiscoverRunner):
+    """Run the tests with ``QUERY_BUDGET_STRICT`` on."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUERY_BUDGET_STRICT = True
+
+
+def query_budget(max_queries):
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+
+    return decorator
+
+
+def get_query_budget(view):
+    budget = getattr(view, "query_budget", None)
+    if budget is None:
+        # Class-based views (including DRF) keep the class on the function
+        budget = getattr(getattr(view, "cls", None), "query_budget", None)
+    if budget is None:
+        budget = getattr(getattr(view, "view_class", None), "query_budget", None)
+    return budget
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _counted_execute(execute, sql, params, many, context):
+    counter = _counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def count_queries(sender, connection, **kwargs):
+    # Licznik siedzi w kontekście żądania, więc widzi też zapytania z wątków
+    # sync_to_async, które mają własne połączenia
+    if _counted_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_counted_execute)
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        token = _counter.set(counter)
+        try:
+            response = self.get_response(request)
+        finally:
+            _counter.reset(token)
+        return self.check(request, response, counter)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        token = _counter.set(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _counter.reset(token)
+        return self.check(request, response, counter)
+
+    def check(self, request, response, counter):
+        match = request.resolver_match
+        budget = get_query_budget(match.func) if match else None
+        if budget is not None and counter.count > budget:
+            message = (
+                f"{match.view_name} ran {counter.count} queries, "
+                f"over its budget of {budget}"
+            )
+            if getattr(settings, "QUERY_BUDGET_STRICT", False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,75 @@
+"""
+Database-backed work queues.
+
+A queue is a model with ``status``, ``attempts``, ``available_at``,
+``claimed_by`` and ``updated_at`` columns and the model's ``PENDING``,
+``PROCESSING``, ``SUCCEEDED`` and ``FAILED`` statuses (``PaymentRequest``,
+``Job``). Workers claim due rows with a conditional ``UPDATE``; only one
+worker's ``UPDATE`` can match a given row, so claims never overlap and no
+broker is needed. A claimed row is leased until ``available_at``; if the
+worker dies it becomes due again and another worker takes it.
+"""
+from datetime import timedelta
+from uuid import uuid4
+
+from django.db.models import F
+from django.utils import timezone
+
+
+def backoff(attempts, base_seconds):
+    """Delay before retry number ``attempts``: base, 2 * base, 4 * base..."""
+    return timedelta(seconds=base_seconds * 2 ** (attempts - 1))
+
+
+def claim(model, limit, lease):
+    """Lease up to ``limit`` due rows of ``model`` to a new worker token."""
+    token = uuid4().hex
+    now = timezone.now()
+    due = model.objects.filter(
+        status__in=[model.PENDING, model.PROCESSING], available_at__lte=now
+    )
+    ids = list(due.order_by("available_at").values_list("pk", flat=True)[:limit])
+    if not ids:
+        return []
+    due.filter(pk__in=ids).update(
+        status=model.PROCESSING,
+        claimed_by=token,
+        available_at=now + lease,
+        attempts=F("attempts") + 1,
+        updated_at=now,
+    )
+    return list(
+        model.objects.filter(claimed_by=token, status=model.PROCESSING).order_by("pk")
+    )
+
+
+def finish(rows, **fields):
+    """
+    Update claimed ``rows`` and release them. Rows whose lease was taken
+    over by another worker are left alone; returns how many were updated.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    model = type(rows[0])
+    return model.objects.filter(
+        pk__in=[row.pk for row in rows], claimed_by=rows[0].claimed_by
+    ).update(claimed_by="", updated_at=timezone.now(), **fields)
+
+
+def retry_or_fail(rows, error, max_attempts, base_seconds):
+    """
+    Put ``rows`` back with backoff, or fail those out of attempts; returns
+    how many failed.
+    """
+    failed = 0
+    now = timezone.now()
+    for row in rows:
+        if row.attempts >= max_attempts:
+            status, available_at = row.FAILED, now
+            failed += 1
+        else:
+            status = row.PENDING
+            available_at = now + backoff(row.attempts, base_seconds)
+        finish([row], status=status, available_at=available_at, last_error=error)
+    return failed
@@ -0,0 +1,201 @@
+"""
+"Customers also bought" recommendations.
+
+``build`` reads the order history once and counts, with NumPy, how many
+orders contain each pair of products: a sparse product-by-product
+co-occurrence matrix held as sorted ``(row * n + column)`` keys and their
+counts. Pairs are scored by cosine similarity,
+``together / sqrt(orders_a * orders_b)``, so best-sellers don't top every
+list, and the best ``RECOMMENDATIONS_TOP_K`` neighbours of each product
+replace the contents of ``ProductRecommendation`` in one transaction.
+Run it periodically (``manage.py build_recommendations`` from cron, or the
+``build_recommendations`` job).
+
+Serving is a single lookup on the ``(product, rank)`` index, cached in the
+catalog cache until the next build.
+"""
+import time
+from dataclasses import dataclass
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+
+from .cache import catalog_cache, catalog_timeout, catalog_version
+from .jobs import task
+from .models import OrderItem, Product, ProductRecommendation
+from .routers import use_primary
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+VERSION_KEY = "recommendations:version"
+
+
+@dataclass
+class BuildResult:
+    orders: int = 0
+    products: int = 0
+    pairs: int = 0
+    rows: int = 0
+
+
+def top_k():
+    return getattr(settings, "RECOMMENDATIONS_TOP_K", 10)
+
+
+def version():
+    """Millisecond timestamp of the last build."""
+    return catalog_version(VERSION_KEY)
+
+
+def _bump_version():
+    cache = catalog_cache()
+    current = cache.get(VERSION_KEY) or 0
+    cache.set(VERSION_KEY, max(int(time.time() * 1000), current + 1), None)
+
+
+def _order_lines(chunk_size):
+    rows = OrderItem.objects.order_by().values_list("order_id", "product_id")
+    data = np.fromiter(
+        chain.from_iterable(rows.iterator(chunk_size=chunk_size)), dtype=np.int64
+    )
+    return data[0::2], data[1::2]
+
+
+def cooccurrence(orders, products, max_lines=50):
+    """
+    Count the orders that contain each pair of products. ``orders`` and
+    ``products`` are parallel arrays of order lines. Returns
+    ``(product_ids, freq, a, b, counts)``: the product ids behind the matrix
+    indices, the number of orders per product and the non-zero cells
+    (both ``(a, b)`` and ``(b, a)``). Orders with more than ``max_lines``
+    products are skipped; they are rare, say little and cost quadratically.
+    """
+    product_ids, index = np.unique(products, return_inverse=True)
+    n = max(len(product_ids), 1)
+    # Jedna pozycja na (zamówienie, produkt), posortowane po zamówieniu
+    lines = np.unique(orders * n + index)
+    orders, index = lines // n, lines % n
+    freq = np.bincount(index, minlength=len(product_ids))
+
+    if len(orders):
+        starts = np.flatnonzero(np.r_[True, orders[1:] != orders[:-1]])
+        sizes = np.diff(np.r_[starts, len(orders)])
+        keep = np.repeat(sizes <= max_lines, sizes)
+        orders, index = orders[keep], index[keep]
+        longest = int(sizes[sizes <= max_lines].max(initial=0))
+    else:
+        longest = 0
+
+    # Pary w obrębie zamówienia: pozycje oddalone o d w posortowanej tablicy
+    keys = []
+    for d in range(1, longest):
+        same = orders[:-d] == orders[d:]
+        a, b = index[:-d][same], index[d:][same]
+        keys += [a * n + b, b * n + a]
+    if not keys:
+        empty = np.array([], dtype=np.int64)
+        return product_ids, freq, empty, empty, empty
+    keys, counts = np.unique(np.concatenate(keys), return_counts=True)
+    return product_ids, freq, keys // n, keys % n, counts
+
+
+def top_neighbours(freq, a, b, counts, k, min_orders=1):
+    """Keep the ``k`` best-scored neighbours of every product."""
+    keep = counts >= min_orders
+    a, b, counts = a[keep], b[keep], counts[keep]
+    score = counts / np.sqrt(freq[a].astype(np.float64) * freq[b])
+    order = np.lexsort((b, -counts, -score, a))
+    a, b, score, counts = a[order], b[order], score[order], counts[order]
+    if len(a):
+        starts = np.flatnonzero(np.r_[True, a[1:] != a[:-1]])
+        rank = np.arange(len(a)) - np.repeat(starts, np.diff(np.r_[starts, len(a)]))
+    else:
+        rank = np.array([], dtype=np.int64)
+    best = rank < k
+    return a[best], b[best], rank[best], score[best], counts[best]
+
+
+def build(k=None, max_lines=50, min_orders=1, batch_size=5000, chunk_size=20000):
+    """Rebuild ``ProductRecommendation`` from the whole order history."""
+    if np is None:
+        raise ImportError("Building recommendations needs NumPy.")
+    k = k or top_k()
+    orders, products = _order_lines(chunk_size)
+    product_ids, freq, a, b, counts = cooccurrence(orders, products, max_lines)
+    result = BuildResult(
+        orders=len(np.unique(orders)), products=len(product_ids), pairs=len(counts)
+    )
+    a, b, rank, score, counts = top_neighbours(freq, a, b, counts, k, min_orders)
+    result.rows = len(a)
+
+    rows = zip(
+        product_ids[a].tolist(),
+        product_ids[b].tolist(),
+        rank.tolist(),
+        score.tolist(),
+        counts.tolist(),
+    )
+    with transaction.atomic():
+        ProductRecommendation.objects.all().delete()
+        while batch := [
+            ProductRecommendation(
+                product_id=product,
+                recommended_id=recommended,
+                rank=position,
+                score=value,
+                orders=together,
+            )
+            for product, recommended, position, value, together in islice(
+                rows, batch_size
+            )
+        ]:
+            ProductRecommendation.objects.bulk_create(batch)
+    # Teraz i po commicie, jak w shop.cache.invalidate_products
+    _bump_version()
+    transaction.on_commit(_bump_version)
+    return result
+
+
+@task("build_recommendations")
+def build_recommendations(payloads):
+    build()
+
+
+def recommended_for(product_id, limit=4):
+    """The top ``limit`` available products bought with ``product_id``."""
+    cache = catalog_cache()
+    # Wersja katalogu w kluczu: zmiana ceny czy dostępności sąsiada też się liczy
+    key = f"recommendations:{version()}:{catalog_version()}:{product_id}:{limit}"
+    products = cache.get(key)
+    if products is None:
+        with use_primary():
+            products = list(
+                Product.objects.filter(
+                    recommended_by__product_id=product_id, available=True
+                ).order_by("recommended_by__rank")[:limit]
+            )
+        cache.set(key, products, catalog_timeout())
+    return products
+
+
+def recommended_for_cart(product_ids, limit=4):
+    """
+    Products most bought together with the ones in a cart, scored by the sum
+    of their scores against each cart product, in one query.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return []
+    return list(
+        Product.objects.filter(
+            recommended_by__product_id__in=product_ids, available=True
+        )
+        .exclude(pk__in=product_ids)
+        .annotate(recommendation_score=Sum("recommended_by__score"))
+        .order_by("-recommendation_score", "pk")[:limit]
+    )
@@ -0,0 +1,155 @@
+"""
+Read replicas.
+
+Aliases listed in ``settings.REPLICA_DATABASES`` hold copies of
+``default`` (the primary). ``ReplicaRoutingMiddleware`` lets a GET, HEAD
+or OPTIONS request read from one of them, picked once per request.
+Everything else uses the primary: writes, ``select_for_update``, reads
+inside a transaction on the primary, reads outside requests (workers,
+management commands; wrap those in ``use_replicas()`` to opt in) and every
+read made after the request wrote something.
+
+A request wrote when it ran an INSERT, UPDATE or DELETE; merely resolving
+the write database (``get_or_create`` does, before its read) doesn't
+count. Such a request also sets a cookie, so the same client's requests in
+the next ``REPLICA_PIN_SECONDS`` read from the primary too: the order
+page after checkout never lags behind the checkout. Rows that go into the
+catalog cache are read from the primary (``shop.cache``), so a lagging
+replica can't refill a just-invalidated entry with the old row.
+"""
+import asyncio
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+PIN_COOKIE = "db_primary_until"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+_routing = ContextVar("replica_routing", default=None)
+
+
+class Routing:
+    def __init__(self, replica=None):
+        self.replica = replica
+        self.wrote = False
+
+
+def replicas():
+    return list(getattr(settings, "REPLICA_DATABASES", []))
+
+
+def pin_seconds():
+    return getattr(settings, "REPLICA_PIN_SECONDS", 10)
+
+
+@contextmanager
+def _routed(replica):
+    token = _routing.set(Routing(replica))
+    try:
+        yield _routing.get()
+    finally:
+        _routing.reset(token)
+
+
+def use_replicas():
+    """Send reads in this block to a replica, until something is written."""
+    aliases = replicas()
+    return _routed(random.choice(aliases) if aliases else None)
+
+
+def use_primary():
+    return _routed(None)
+
+
+def _note_writes(execute, sql, params, many, context):
+    routing = _routing.get()
+    if routing is not None and sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+        # Od teraz czytamy własne zapisy
+        routing.wrote = True
+        routing.replica = None
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def watch_writes(sender, connection, **kwargs):
+    if _note_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_note_writes)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None or routing.replica is None:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Repliki dostają schemat przez replikację
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replicas():
+            return self.get_response(request)
+        with self.routed(request) as routing:
+            response = self.get_response(request)
+        return self.pin(response, routing)
+
+    async def __acall__(self, request):
+        if not replicas():
+            return await self.get_response(request)
+        with self.routed(request) as routing:
+            response = await self.get_response(request)
+        return self.pin(response, routing)
+
+    def routed(self, request):
+        try:
+            pinned = float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        if pinned or request.method not in SAFE_METHODS:
+            return use_primary()
+        return use_replicas()
+
+    def pin(self, response, routing):
+        if routing.wrote:
+            seconds = pin_seconds()
+            response.set_cookie(
+                PIN_COOKIE,
+                f"{time.time() + seconds:.3f}",
+                max_age=seconds,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
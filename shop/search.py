@@ -0,0 +1,148 @@
+"""
+Full-text product search over ``Product.name`` and ``Product.description``.
+
+On SQLite the index is an FTS5 table kept in sync by triggers; on
+PostgreSQL it is a generated ``tsvector`` column with a GIN index. Both are
+maintained by the database itself, so every write path (forms, admin,
+bulk imports, raw updates) keeps the index current. Other databases fall
+back to ``icontains`` filtering.
+"""
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_insert
+    AFTER INSERT ON shop_product BEGIN
+        INSERT INTO shop_product_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_delete
+    AFTER DELETE ON shop_product BEGIN
+        INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shop_product_fts_update
+    AFTER UPDATE OF name, description ON shop_product BEGIN
+        INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO shop_product_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+SQLITE_SEARCH = """
+    SELECT f.rowid
+    FROM shop_product_fts f JOIN shop_product p ON p.id = f.rowid
+    WHERE shop_product_fts MATCH %s AND (p.available OR %s)
+    ORDER BY bm25(shop_product_fts, 10.0, 1.0), f.rowid
+    LIMIT %s OFFSET %s
+"""
+
+POSTGRESQL_SEARCH = """
+    SELECT p.id
+    FROM shop_product p, websearch_to_tsquery('simple', %s) q
+    WHERE p.search_vector @@ q AND (p.available OR %s)
+    ORDER BY ts_rank_cd(p.search_vector, q) DESC, p.id
+    LIMIT %s OFFSET %s
+"""
+
+SQLITE_MATCHES = "SELECT rowid FROM shop_product_fts WHERE shop_product_fts MATCH %s"
+
+POSTGRESQL_MATCHES = """
+    SELECT id FROM shop_product
+    WHERE search_vector @@ websearch_to_tsquery('simple', %s)
+"""
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def ensure_triggers(using):
+    # SQLite drops triggers when a migration rebuilds shop_product, so they
+    # are put back after every migrate run.
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+            ["shop_product_fts"],
+        )
+        if cursor.fetchone():
+            for sql in SQLITE_TRIGGERS:
+                cursor.execute(sql)
+
+
+def fts5_query(query):
+    # Quote every word so user input can't use FTS5 syntax; the last word is
+    # matched as a prefix to support search-as-you-type.
+    words = WORD_RE.findall(query)
+    if not words:
+        return ""
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+def search_ids(query, limit, offset=0, include_unavailable=False):
+    """Ids of products matching ``query``, best match first."""
+    using = router.db_for_read(Product)
+    connection = connections[using]
+    if connection.vendor == "sqlite":
+        sql, query = SQLITE_SEARCH, fts5_query(query)
+    elif connection.vendor == "postgresql":
+        sql = POSTGRESQL_SEARCH
+    else:
+        products = Product.objects.using(using).filter(name__icontains=query)
+        if not include_unavailable:
+            products = products.filter(available=True)
+        return list(
+            products.order_by("name", "id").values_list("id", flat=True)[
+                offset : offset + limit
+            ]
+        )
+    if not query.strip():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [query, include_unavailable, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_filter(query, using="default"):
+    """
+    A ``Q`` for every product matching ``query``, as a subquery rather than a
+    list of ids, so a filtered queryset (the admin changelist) can be counted
+    and paginated as usual. Results are not ranked.
+    """
+    vendor = connections[using].vendor
+    if vendor == "sqlite":
+        query = fts5_query(query)
+        sql = SQLITE_MATCHES
+    elif vendor == "postgresql":
+        sql = POSTGRESQL_MATCHES
+    else:
+        return Q(name__icontains=query)
+    if not query.strip():
+        return Q(pk__in=[])
+    return Q(pk__in=RawSQL(sql, [query]))
+
+
+def search_products(query, page=1, per_page=20):
+    """
+    Return ``(products, has_next)`` for a 1-based results ``page``, with the
+    products in rank order.
+    """
+    offset = (page - 1) * per_page
+    ids = search_ids(query, per_page + 1, offset)
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    products = Product.objects.in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products], has_next
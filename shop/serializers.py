@@ -0,0 +1,87 @@
+from rest_framework import serializers
+
+from .models import Cart, CartItem, Order, OrderItem, Product
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """Takes an optional ``fields`` argument limiting the output fields."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class ProductSerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = Product
+        fields = [
+            "id",
+            "name",
+            "description",
+            "price",
+            "stock",
+            "available",
+            "updated_at",
+        ]
+
+
+class LineSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source="product.name", read_only=True)
+    unit_price = serializers.DecimalField(
+        source="product.price", max_digits=10, decimal_places=2, read_only=True
+    )
+    line_total = serializers.DecimalField(
+        source="get_total_price", max_digits=12, decimal_places=2, read_only=True
+    )
+
+
+class CartItemSerializer(LineSerializer):
+    class Meta:
+        model = CartItem
+        fields = [
+            "id",
+            "product",
+            "product_name",
+            "quantity",
+            "unit_price",
+            "line_total",
+        ]
+
+
+class CartSerializer(DynamicFieldsModelSerializer):
+    items = CartItemSerializer(many=True, read_only=True)
+    total = serializers.DecimalField(
+        source="get_total", max_digits=12, decimal_places=2, read_only=True
+    )
+
+    class Meta:
+        model = Cart
+        fields = ["id", "created_at", "items", "total"]
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    # Zapisana nazwa i cena, nie bieżące dane produktu
+    class Meta:
+        model = OrderItem
+        fields = [
+            "id",
+            "product",
+            "product_name",
+            "quantity",
+            "unit_price",
+            "line_total",
+        ]
+
+
+class OrderSerializer(DynamicFieldsModelSerializer):
+    items = OrderItemSerializer(many=True, read_only=True)
+    total = serializers.DecimalField(
+        source="get_total_price", max_digits=12, decimal_places=2, read_only=True
+    )
+
+    class Meta:
+        model = Order
+        fields = ["id", "created_at", "paid", "items", "total"]
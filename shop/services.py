@@ -0,0 +1,57 @@
+from django.db import transaction
+
+from .analytics import record_order
+from .exceptions import CheckoutError, EmptyCart, OutOfStock
+from .inventory import commit_reservations, reserve
+from .models import CartItem, Order, OrderItem, Product
+from .notifications import queue_order_confirmation
+
+
+def place_order(cart, customer, order=None):
+    """
+    Turn ``cart`` into an order in one transaction: a single bulk insert of
+    order items, a single guarded stock UPDATE that reserves the stock,
+    queueing the confirmation e-mail and clearing the cart. Any short line
+    rolls the whole order back.
+    """
+    with transaction.atomic():
+        # Writing first takes the write lock up front, so on SQLite concurrent
+        # checkouts queue up instead of failing on a read -> write upgrade.
+        if order is None:
+            order = Order(customer=customer, paid=False)
+        order.customer = customer
+        order.save()
+
+        quantities = {}
+        for product_id, quantity in CartItem.objects.filter(cart=cart).values_list(
+            "product_id", "quantity"
+        ):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        if not quantities:
+            raise EmptyCart()
+
+        # Cena i nazwa z chwili zamówienia; zmiana ceny nie zmienia historii
+        products = Product.objects.in_bulk(quantities)
+        items = [
+            OrderItem(
+                order=order,
+                product_id=product_id,
+                quantity=quantity,
+                product_name=products[product_id].name,
+                unit_price=products[product_id].price,
+                line_total=products[product_id].price * quantity,
+            )
+            for product_id, quantity in sorted(quantities.items())
+        ]
+        OrderItem.objects.bulk_create(items)
+        order.total = sum(item.line_total for item in items)
+        order.item_count = sum(quantities.values())
+        order.save(update_fields=["total", "item_count"])
+        reserve(order, quantities)
+        if order.paid:
+            commit_reservations(order)
+        record_order(order)
+        # Potwierdzenie wysyła worker, dopiero gdy zamówienie jest zapisane
+        queue_order_confirmation(order)
+        CartItem.objects.filter(cart=cart).delete()
+    return order
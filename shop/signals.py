@@ -1,13 +1,30 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
-from django.contrib.auth.models import User
-from .models import Customer
+from .cache import invalidate_products
+from .images import queue_render
+from .models import Order, OrderItem, Product
+from .search import ensure_triggers
 
-@receiver(post_save, sender=User)
-def create_customer_for_user(sender, instance, created, **kwargs):
-    if created:
-        Customer.objects.create(user=instance)
 
-@receiver(post_save, sender=User)
-def save_customer_for_user(sender, instance, **kwargs):
-    instance.customer.save()
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_cache(sender, instance, **kwargs):
+    invalidate_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def render_product_images(sender, instance, **kwargs):
+    # Miniatury powstają w tle (zadanie product_images)
+    queue_render(instance)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals(sender, instance, **kwargs):
+    Order.objects.filter(pk=instance.order_id).update_totals()
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    if sender.name == "shop":
+        ensure_triggers(using)
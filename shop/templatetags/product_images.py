@@ -0,0 +1,27 @@
+from django import template
+from django.core.files.storage import default_storage
+
+register = template.Library()
+
+
+@register.inclusion_tag("shop/includes/product_image.html")
+def product_image(product, size="card", css=""):
+    """
+    A <picture> with the WebP and JPEG ``size`` derivatives of the product's
+    image, or the original while they are not made yet.
+    """
+    context = {"product": product, "css": css, "webp": None, "jpeg": None}
+    if not product.image:
+        return context
+    variants = product.image_variants
+    formats = variants.get("sizes", {}).get(size)
+    if variants.get("source") != product.image.name or not formats:
+        context["jpeg"] = {"url": product.image.url}
+        return context
+    for fmt in ("webp", "jpeg"):
+        if fmt in formats:
+            context[fmt] = {
+                **formats[fmt],
+                "url": default_storage.url(formats[fmt]["name"]),
+            }
+    return context
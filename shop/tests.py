@@ -1,8 +1,68 @@
-from django.test import SimpleTestCase, TestCase
-from django.urls import resolve, reverse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import logging
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipIf, skipUnless
 
-from . import views
-from .models import Order, OrderItem, Product
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import (IntegrityError, OperationalError, connection,
+                       connections, router, transaction)
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, resolve, reverse
+from django.utils import timezone
+from psycopg2.extensions import (TRANSACTION_STATUS_IDLE,
+                                 TRANSACTION_STATUS_INERROR)
+
+from shop_project.database import database_config
+
+from . import urls, views
+from .auth import get_customer
+from .benchmarks import compare_results, run_concurrently, seed_shop
+from .cache import catalog_cache, get_product
+from .cart import (SESSION_KEY, CartFull, add_item, add_items, add_to_session,
+                   session_items)
+from .exports import order_rows
+from .forms import ProductForm
+from .images import cv2, render, render_catalog, store
+from .inventory import commit_reservations, release_expired, reserve
+from .metrics import BUCKETS_MS, Histogram, RequestTimings, registry
+from .jobs import TASKS, enqueue, enqueue_many, run_due, run_worker
+from .models import (Cart, CartItem, Customer, CustomerDailySales, Job, Order,
+                     OrderItem, Payment, PaymentRequest, Product,
+                     ProductDailySales, StockReservation)
+from .pagination import (EstimatedCountPaginator, KeysetPaginator,
+                         estimated_count)
+from .postgresql.base import ConnectionPool, PoolTimeout, postgresql
+from .payments import claim, process_due, settle, submit_payment
+from .query_budget import (QueryBudgetExceeded, QueryBudgetMiddleware,
+                           get_query_budget, query_budget)
+from .recommendations import build, recommended_for, recommended_for_cart
+from .routers import PIN_COOKIE, use_replicas
+from .search import fts5_query, search_products
+from .services import OutOfStock, place_order
+from .transfer import export_products, import_products, read_rows
 
 
 class ProductModelTest(TestCase):
@@ -32,6 +92,1653 @@ class ProductListViewTest(TestCase):
         self.assertTemplateUsed(response, "shop/product_list.html")
 
 
+class ProductListPaginationTest(TestCase):
+    def setUp(self):
+        for i in range(30):
+            Product.objects.create(
+                name=f"Product {i:02d}",
+                description="Description",
+                price=i + 1,
+                stock=5,
+                available=i % 10 != 0,
+            )
+
+    def test_pages_follow_cursor_without_overlap(self):
+        first = self.client.get(reverse("product_list"))
+        names = [p.name for p in first.context["products"]]
+        self.assertEqual(len(names), views.PRODUCTS_PER_PAGE)
+        self.assertIsNotNone(first.context["next_query"])
+
+        second = self.client.get(
+            reverse("product_list") + "?" + first.context["next_query"]
+        )
+        names += [p.name for p in second.context["products"]]
+        self.assertIsNone(second.context["next_query"])
+        self.assertEqual(names, sorted(set(names)))
+        self.assertEqual(len(names), 27)
+
+    def test_filters_by_availability_and_price(self):
+        response = self.client.get(
+            reverse("product_list"),
+            {"available": "1", "min_price": "5", "max_price": "9", "sort": "price"},
+        )
+        prices = [p.price for p in response.context["products"]]
+        self.assertEqual(prices, [5, 6, 7, 8, 9])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse("product_list"), {"cursor": "!!"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_value_must_match_the_ordering(self):
+        paginator = KeysetPaginator(Product.objects.all(), "price")
+        cursor = paginator.encode_cursor(Product(pk=1, price="abc"))
+        response = self.client.get(
+            reverse("product_list"), {"sort": "price", "cursor": cursor}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        catalog_cache().clear()
+        self.product = Product.objects.create(
+            name="Mug", description="Blue mug", price=8, stock=4
+        )
+
+    def test_product_detail_is_served_from_cache(self):
+        url = reverse("product_detail", args=[self.product.pk])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, "Blue mug")
+
+    def test_conditional_get_returns_304(self):
+        detail_url = reverse("product_detail", args=[self.product.pk])
+        for url in [reverse("product_list"), detail_url]:
+            response = self.client.get(url)
+            self.assertTrue(response.has_header("Last-Modified"))
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(response.status_code, 304)
+
+    def test_product_save_invalidates_cache(self):
+        url = reverse("product_detail", args=[self.product.pk])
+        etag = self.client.get(url)["ETag"]
+        list_etag = self.client.get(reverse("product_list"))["ETag"]
+
+        self.product.description = "Red mug"
+        self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Red mug")
+        response = self.client.get(
+            reverse("product_list"), HTTP_IF_NONE_MATCH=list_etag
+        )
+        self.assertContains(response, "Red mug")
+
+    def test_catalog_change_revalidates_product_page(self):
+        url = reverse("product_detail", args=[self.product.pk])
+        etag = self.client.get(url)["ETag"]
+        Product.objects.create(name="Cup", description="", price=3, stock=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_stock_update_invalidates_cache(self):
+        url = reverse("product_detail", args=[self.product.pk])
+        self.client.get(url)
+        self.product.update_stock(3)
+        self.assertContains(self.client.get(url), "<strong>Stock:</strong> 1")
+
+    def test_logged_in_users_get_no_validators(self):
+        self.client.force_login(User.objects.create_user(username="u", password="p"))
+        response = self.client.get(reverse("product_list"))
+        self.assertFalse(response.has_header("ETag"))
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.kettle = Product.objects.create(
+            name="Electric kettle", description="Boils water fast", price=30, stock=3
+        )
+        self.teapot = Product.objects.create(
+            name="Teapot",
+            description="Ceramic, pairs with an electric kettle",
+            price=25,
+            stock=3,
+        )
+        Product.objects.create(
+            name="Kettlebell", description="Iron", price=40, stock=3, available=False
+        )
+
+    def test_results_are_ranked_by_relevance(self):
+        products, has_next = search_products("electric kettle")
+        self.assertEqual(products, [self.kettle, self.teapot])
+        self.assertFalse(has_next)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.teapot.name = "Porcelain teapot"
+        self.teapot.save()
+        self.assertEqual(search_products("porcelain")[0], [self.teapot])
+        self.kettle.delete()
+        self.assertEqual(search_products("boils")[0], [])
+
+    def test_prefix_match_and_pagination(self):
+        products, has_next = search_products("kett", per_page=1)
+        self.assertEqual(products, [self.kettle])
+        self.assertTrue(has_next)
+        self.assertEqual(search_products("kett", page=2, per_page=1)[0], [self.teapot])
+
+    def test_user_input_is_quoted(self):
+        self.assertEqual(fts5_query('kettle" OR NEAR('), '"kettle" "OR" "NEAR"*')
+        response = self.client.get(reverse("product_search"), {"q": 'NEAR(" *'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_search_view(self):
+        response = self.client.get(reverse("product_search"), {"q": "teapot"})
+        self.assertContains(response, "Teapot")
+        self.assertNotContains(response, "Kettlebell")
+
+    def test_admin_search_is_not_capped(self):
+        Product.objects.bulk_create(
+            Product(name=f"Kettle {i}", description="", price=1, stock=1)
+            for i in range(30)
+        )
+        self.client.force_login(
+            User.objects.create_superuser("root", "root@example.com", "pw")
+        )
+        response = self.client.get(
+            reverse("admin:shop_product_changelist"), {"q": "kettle"}
+        )
+        # 30 nowych, czajnik, dzbanek i niedostępny Kettlebell
+        self.assertEqual(response.context["cl"].result_count, 33)
+
+
+class CatalogApiTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.products = [
+            Product.objects.create(
+                name=f"Product {i:02d}", description="", price=i + 1, stock=5
+            )
+            for i in range(60)
+        ]
+        for _ in range(3):
+            order = Order.objects.create(customer=get_customer(self.user))
+            for product in self.products[:4]:
+                OrderItem.objects.create(order=order, product=product, quantity=2)
+
+    def test_products_are_cursor_paginated(self):
+        response = self.client.get("/api/products/")
+        data = response.json()
+        self.assertEqual(len(data["results"]), 50)
+        self.assertEqual(data["results"][0]["name"], "Product 00")
+        data = self.client.get(data["next"]).json()
+        self.assertEqual(len(data["results"]), 10)
+        self.assertIsNone(data["next"])
+
+    def test_field_selection(self):
+        response = self.client.get("/api/products/", {"fields": "id,price"})
+        self.assertEqual(set(response.json()["results"][0]), {"id", "price"})
+
+    def test_conditional_get(self):
+        response = self.client.get("/api/products/")
+        etag = response["ETag"]
+        response = self.client.get("/api/products/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_orders_use_constant_number_of_queries(self):
+        self.client.force_login(self.user)
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/orders/")
+        orders = response.json()["results"]
+        self.assertEqual(len(orders), 3)
+        self.assertEqual(Decimal(orders[0]["total"]), Decimal("20.00"))
+        self.assertEqual(len(orders[0]["items"]), 4)
+
+    def test_orders_require_login(self):
+        self.assertEqual(self.client.get("/api/orders/").status_code, 403)
+
+    def test_cart(self):
+        self.client.force_login(self.user)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.products[1], quantity=3)
+        data = self.client.get("/api/cart/").json()
+        self.assertEqual(Decimal(data["total"]), Decimal("6.00"))
+        self.assertEqual(data["items"][0]["product_name"], "Product 01")
+
+
+class OrderTotalsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.customer = get_customer(self.user)
+        self.pen = Product.objects.create(
+            name="Pen", description="Pen", price="1.50", stock=100
+        )
+        self.book = Product.objects.create(
+            name="Book", description="Book", price="12.00", stock=100
+        )
+        for _ in range(5):
+            order = Order.objects.create(customer=self.customer)
+            OrderItem.objects.create(order=order, product=self.pen, quantity=2)
+            OrderItem.objects.create(order=order, product=self.book, quantity=1)
+
+    def test_totals_are_cached_on_the_order(self):
+        with self.assertNumQueries(1):
+            totals = [(o.total, o.item_count) for o in Order.objects.all()]
+        self.assertEqual(totals, [(Decimal("15.00"), 3)] * 5)
+        self.assertEqual(Order.objects.create().get_total_price(), 0)
+
+    def test_price_changes_do_not_rewrite_history(self):
+        Product.objects.filter(pk=self.book.pk).update(price="99.00")
+        order = Order.objects.with_items().first()
+        self.assertEqual(order.get_total_price(), Decimal("15.00"))
+        with self.assertNumQueries(0):
+            lines = [(i.product_name, i.unit_price) for i in order.items.all()]
+        self.assertIn(("Book", Decimal("12.00")), lines)
+
+    def test_totals_follow_item_writes(self):
+        order = Order.objects.first()
+        item = order.items.get(product=self.pen)
+        item.quantity = 4
+        item.save()
+        order.refresh_from_db()
+        self.assertEqual((order.total, order.item_count), (Decimal("18.00"), 5))
+        item.delete()
+        order.refresh_from_db()
+        self.assertEqual((order.total, order.item_count), (Decimal("12.00"), 1))
+
+    def test_cart_with_totals(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.book, quantity=3)
+        self.assertEqual(Cart.objects.with_totals().get().total, Decimal("36.00"))
+        self.assertEqual(cart.get_total(), Decimal("36.00"))
+
+    def test_order_list_query_count_is_constant(self):
+        self.client.force_login(self.user)
+        # Użytkownik z profilem klienta w jednym zapytaniu, potem zamówienia
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("order_list"))
+        self.assertContains(response, "$15.00", count=5)
+
+    def test_process_payment_uses_cached_total(self):
+        order = Order.objects.first()
+        payment = Payment.objects.create(order=order, amount=Decimal("15.00"))
+        self.assertTrue(payment.process_payment())
+
+    def test_mark_as_paid_keeps_cached_totals(self):
+        order = Order.objects.first()
+        OrderItem.objects.create(order=order, product=self.book, quantity=1)
+        order.mark_as_paid()
+        order.refresh_from_db()
+        self.assertTrue(order.paid)
+        self.assertEqual(order.total, Decimal("27.00"))
+
+
+class CheckoutServiceTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.cart = Cart.objects.create(user=self.user)
+        self.products = [
+            Product.objects.create(name=f"Item {i}", description="", price=5, stock=3)
+            for i in range(10)
+        ]
+        for product in self.products:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def test_place_order_uses_constant_number_of_queries(self):
+        customer = get_customer(self.user)
+        with self.assertNumQueries(19):
+            order = place_order(self.cart, customer)
+        self.assertEqual(order.items.count(), 10)
+        self.assertEqual(
+            list(Product.objects.values_list("stock", flat=True).distinct()), [1]
+        )
+        self.assertFalse(self.cart.items.exists())
+
+    def test_short_line_rolls_back_whole_order(self):
+        Product.objects.filter(pk=self.products[4].pk).update(stock=1)
+        with self.assertRaises(OutOfStock) as cm:
+            place_order(self.cart, get_customer(self.user))
+        self.assertEqual(cm.exception.products, [self.products[4]])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.cart.items.count(), 10)
+        self.assertEqual(
+            sorted(Product.objects.values_list("stock", flat=True)), [1] + [3] * 9
+        )
+
+    def test_checkout_view_reports_short_stock(self):
+        Product.objects.filter(pk=self.products[0].pk).update(stock=0)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("checkout"))
+        self.assertContains(response, "Not enough stock for Item 0.", status_code=400)
+
+
+class SalesRollupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.cap = Product.objects.create(name="Cap", description="", price=5, stock=9)
+        self.mug = Product.objects.create(name="Mug", description="", price=3, stock=9)
+
+    def buy(self, quantities, pay=False):
+        cart, created = Cart.objects.get_or_create(user=self.user)
+        for product, quantity in quantities.items():
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        order = place_order(cart, get_customer(self.user))
+        if pay:
+            payment = Payment.objects.create(order=order, amount=Decimal("100"))
+            self.assertTrue(payment.process_payment())
+        return order
+
+    def rollups(self):
+        return (
+            list(
+                ProductDailySales.objects.order_by("product_id").values_list(
+                    "product_id", "units", "revenue", "paid_units", "paid_revenue"
+                )
+            ),
+            list(
+                CustomerDailySales.objects.values_list(
+                    "orders", "units", "revenue", "paid_orders", "paid_revenue"
+                )
+            ),
+        )
+
+    def test_orders_and_payments_update_rollups(self):
+        self.buy({self.cap: 2, self.mug: 1}, pay=True)
+        self.buy({self.cap: 1})
+        products, customers = self.rollups()
+        self.assertEqual(
+            products,
+            [
+                (self.cap.pk, 3, Decimal("15.00"), 2, Decimal("10.00")),
+                (self.mug.pk, 1, Decimal("3.00"), 1, Decimal("3.00")),
+            ],
+        )
+        self.assertEqual(customers, [(2, 4, Decimal("18.00"), 1, Decimal("13.00"))])
+
+        incremental = self.rollups()
+        call_command("rebuild_sales", stdout=io.StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_dashboard_reads_rollups_only(self):
+        self.buy({self.cap: 2}, pay=True)
+        staff = User.objects.create_user(username="finance", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse("sales_dashboard"))
+        self.assertContains(response, "Revenue: $10.00")
+        self.assertEqual(response.context["products"][0]["product__name"], "Cap")
+        bad = self.client.get(
+            reverse("sales_dashboard"), {"start": "2020-02-02", "end": "2020-01-01"}
+        )
+        self.assertContains(bad, "Start date cannot be after end date.")
+
+
+class InventoryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.product = Product.objects.create(
+            name="Lamp", description="", price=20, stock=5
+        )
+        self.order = Order.objects.create(customer=get_customer(self.user), paid=False)
+
+    def test_reserve_holds_stock_until_expiry(self):
+        reserve(self.order, {self.product.pk: 3}, ttl=timedelta(minutes=5))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+
+        self.assertEqual(release_expired(), 0)
+        self.assertEqual(release_expired(now=timezone.now() + timedelta(minutes=6)), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.assertEqual(
+            StockReservation.objects.get().status, StockReservation.RELEASED
+        )
+
+    def test_commit_takes_expired_reservation_again(self):
+        reserve(self.order, {self.product.pk: 3}, ttl=timedelta(0))
+        release_expired()
+        commit_reservations(self.order)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+        self.assertEqual(
+            StockReservation.objects.get().status, StockReservation.COMMITTED
+        )
+
+    def test_payment_commits_without_decrementing_again(self):
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2)
+        reserve(self.order, {self.product.pk: 2})
+        payment = Payment.objects.create(order=self.order, amount=Decimal("40.00"))
+        self.assertTrue(payment.process_payment())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertTrue(Order.objects.get(pk=self.order.pk).paid)
+
+    def test_update_stock_is_guarded(self):
+        self.assertFalse(self.product.update_stock(6))
+        self.assertTrue(self.product.update_stock(5))
+        self.assertEqual(self.product.stock, 0)
+
+    def test_product_form_applies_stock_as_delta(self):
+        form = ProductForm(instance=self.product)
+        data = {
+            "name": "Lamp",
+            "description": "Desk lamp",
+            "price": "20.00",
+            "stock": 8,
+            "available": True,
+            form.add_initial_prefix("stock"): 5,
+        }
+        # Two units are sold while the admin is editing the product
+        Product.objects.filter(pk=self.product.pk).update(stock=3)
+        form = ProductForm(data, instance=Product.objects.get(pk=self.product.pk))
+        self.assertTrue(form.is_valid(), form.errors)
+        product = form.save()
+        self.assertEqual(product.stock, 6)
+        self.assertEqual(product.description, "Desk lamp")
+
+
+class ConcurrentReservationTest(TransactionTestCase):
+    def test_no_oversell_under_concurrent_buyers(self):
+        product = Product.objects.create(name="Hot", description="", price=1, stock=50)
+        orders = [
+            Order.objects.create(
+                customer=get_customer(User.objects.create(username=f"u{i}")), paid=False
+            )
+            for i in range(300)
+        ]
+        sold = []
+
+        def buy(order):
+            for attempt in range(200):
+                try:
+                    reserve(order, {product.pk: 1})
+                    sold.append(order.pk)
+                    return
+                except OutOfStock:
+                    return
+                except OperationalError:
+                    # SQLite reports lock contention instead of waiting
+                    time.sleep(random.random() / 100)
+            raise AssertionError("buyer never got the lock")
+
+        _, errors, _ = run_concurrently(buy, orders, workers=16)
+        self.assertEqual(errors, [])
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(len(sold), 50)
+        self.assertEqual(StockReservation.objects.count(), 50)
+
+
+class PaymentQueueTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="buyer", password="pass12345")
+        product = Product.objects.create(name="Lamp", description="", price=20, stock=5)
+        self.order = Order.objects.create(customer=get_customer(user), paid=False)
+        OrderItem.objects.create(order=self.order, product=product, quantity=2)
+        self.url = reverse("process_payment", args=[self.order.pk])
+
+    def pay(self, amount="40.00", key="key-1"):
+        return self.client.post(
+            self.url,
+            {"amount": amount, "idempotency_key": key},
+            HTTP_ACCEPT="application/json",
+        )
+
+    def test_repeated_submits_are_settled_once(self):
+        first = self.pay()
+        second = self.pay()
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(first.json()["status"], PaymentRequest.PENDING)
+        self.assertEqual(PaymentRequest.objects.count(), 1)
+        self.assertFalse(Payment.objects.exists())
+
+        self.assertEqual(process_due(), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertTrue(Order.objects.get(pk=self.order.pk).paid)
+        status = self.client.get(first["Location"], HTTP_ACCEPT="application/json")
+        self.assertEqual(status.json()["status"], PaymentRequest.SUCCEEDED)
+
+    def test_second_key_for_a_paid_order_fails(self):
+        self.pay(key="key-1")
+        self.pay(key="key-2")
+        process_due()
+        self.assertEqual(Payment.objects.count(), 1)
+        failed = PaymentRequest.objects.get(idempotency_key="key-2")
+        self.assertEqual(failed.status, PaymentRequest.FAILED)
+        self.assertEqual(failed.last_error, "This order has already been paid.")
+
+    def test_key_reused_for_another_amount_conflicts(self):
+        self.pay(amount="40.00")
+        self.assertEqual(self.pay(amount="50.00").status_code, 409)
+
+    def test_insufficient_amount_fails_without_payment(self):
+        self.pay(amount="10.00")
+        process_due()
+        payment_request = PaymentRequest.objects.get()
+        self.assertEqual(payment_request.status, PaymentRequest.FAILED)
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(Order.objects.get(pk=self.order.pk).paid)
+
+    def test_database_errors_are_retried_with_backoff(self):
+        submit_payment(self.order, Decimal("40.00"), "key-1")
+        with mock.patch.object(
+            Payment, "process_payment", side_effect=OperationalError("locked")
+        ):
+            process_due()
+        payment_request = PaymentRequest.objects.get()
+        self.assertEqual(payment_request.status, PaymentRequest.PENDING)
+        self.assertEqual(payment_request.attempts, 1)
+        self.assertIn("locked", payment_request.last_error)
+        self.assertGreater(payment_request.available_at, timezone.now())
+        self.assertEqual(process_due(), 0)
+
+        PaymentRequest.objects.update(available_at=timezone.now())
+        process_due()
+        self.assertEqual(PaymentRequest.objects.get().status, PaymentRequest.SUCCEEDED)
+
+    @override_settings(PAYMENT_MAX_ATTEMPTS=1)
+    def test_gives_up_after_max_attempts(self):
+        submit_payment(self.order, Decimal("40.00"), "key-1")
+        with mock.patch.object(
+            Payment, "process_payment", side_effect=OperationalError("locked")
+        ):
+            process_due()
+        self.assertEqual(PaymentRequest.objects.get().status, PaymentRequest.FAILED)
+
+    def test_expired_claims_are_taken_again(self):
+        submit_payment(self.order, Decimal("40.00"), "key-1")
+        (stale,) = claim()
+        self.assertEqual(claim(), [])
+        PaymentRequest.objects.update(available_at=timezone.now())
+        (fresh,) = claim()
+        self.assertEqual(fresh.attempts, 2)
+        # The first worker lost its lease and must not record a result
+        self.assertEqual(settle(stale), PaymentRequest.PROCESSING)
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(settle(fresh), PaymentRequest.SUCCEEDED)
+
+    def test_form_flow_redirects_to_status_page(self):
+        response = self.client.get(self.url)
+        key = response.context["form"].initial["idempotency_key"]
+        response = self.client.post(
+            self.url, {"amount": "40.00", "idempotency_key": key}
+        )
+        self.assertRedirects(response, reverse("payment_status", args=[key]))
+        self.assertContains(self.client.get(response.url), 'http-equiv="refresh"')
+
+    def test_missing_order_is_404(self):
+        url = reverse("process_payment", args=[self.order.pk + 1])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = reverse("payment_status", args=["missing"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(LOW_STOCK_THRESHOLD=2, STOCK_ALERT_EMAILS=["stock@example.com"])
+class BackgroundJobTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="buyer", password="pass12345", email="buyer@example.com"
+        )
+        self.product = Product.objects.create(
+            name="Lamp", description="", price=20, stock=4
+        )
+
+    def checkout(self, quantity=1):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=quantity)
+        return place_order(cart, get_customer(self.user))
+
+    def test_checkout_queues_confirmation_instead_of_sending(self):
+        first, second = self.checkout(), self.checkout()
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(
+            list(Job.objects.order_by("task", "pk").values_list("task", "payload")),
+            [
+                ("low_stock_alert", {"products": [self.product.pk]}),
+                ("order_confirmation", {"order": first.pk}),
+                ("order_confirmation", {"order": second.pk}),
+            ],
+        )
+
+        self.assertEqual(run_due(), 3)
+        self.assertEqual(
+            Job.objects.filter(status=Job.SUCCEEDED).count(), Job.objects.count()
+        )
+        confirmations = [m for m in mail.outbox if m.to == ["buyer@example.com"]]
+        self.assertEqual(len(confirmations), 2)
+        self.assertIn("1 x Lamp", confirmations[0].body)
+        self.assertIn("$20.00", confirmations[0].body)
+
+    def test_low_stock_alerts_once_when_crossing_threshold(self):
+        self.assertTrue(self.product.update_stock(1))
+        self.assertFalse(Job.objects.exists())
+        self.assertTrue(self.product.update_stock(1))
+        self.assertTrue(self.product.update_stock(1))
+        self.assertEqual(Job.objects.count(), 1)
+
+        run_due()
+        (alert,) = mail.outbox
+        self.assertEqual(alert.to, ["stock@example.com"])
+        self.assertIn("Lamp: 1 left", alert.body)
+
+    def test_jobs_are_batched_per_task(self):
+        calls = []
+        with mock.patch.dict(TASKS, {"record": calls.append}):
+            enqueue_many("record", [{"n": n} for n in range(5)])
+            self.assertEqual(run_due(batch_size=3), 3)
+            self.assertEqual(run_due(batch_size=3), 2)
+        self.assertEqual(
+            calls, [[{"n": 0}, {"n": 1}, {"n": 2}], [{"n": 3}, {"n": 4}]]
+        )
+
+    @override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_SECONDS=10)
+    def test_failed_jobs_back_off_then_fail(self):
+        def broken(payloads):
+            raise ConnectionError("provider down")
+
+        with mock.patch.dict(TASKS, {"broken": broken}), self.assertLogs(
+            "shop.jobs", "ERROR"
+        ):
+            enqueue("broken")
+            run_due()
+            job = Job.objects.get()
+            self.assertEqual(job.status, Job.PENDING)
+            self.assertEqual(job.last_error, "ConnectionError: provider down")
+            self.assertGreater(job.available_at, timezone.now() + timedelta(seconds=9))
+            self.assertEqual(run_due(), 0)
+
+            Job.objects.update(available_at=timezone.now())
+            run_due()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_only_unsent_confirmations_are_retried(self):
+        first, second, third = self.checkout(), self.checkout(), self.checkout()
+        Job.objects.exclude(task="order_confirmation").delete()
+        backend = mail.get_connection()
+        calls = []
+
+        def send_messages(messages):
+            calls.append(messages)
+            if len(calls) == 2:
+                raise ConnectionError("provider down")
+            return backend.__class__.send_messages(backend, messages)
+
+        with mock.patch("shop.notifications.get_connection", return_value=backend):
+            with mock.patch.object(backend, "send_messages", send_messages):
+                with self.assertLogs("shop.jobs", "ERROR"):
+                    run_due()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(
+            dict(Job.objects.values_list("payload__order", "status")),
+            {first.pk: Job.SUCCEEDED, second.pk: Job.PENDING, third.pk: Job.SUCCEEDED},
+        )
+        self.assertEqual(
+            Job.objects.get(status=Job.PENDING).last_error,
+            "ConnectionError: provider down",
+        )
+
+        Job.objects.update(available_at=timezone.now())
+        run_due()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[-1].subject, f"Your order #{second.pk}")
+
+    def test_unknown_task_is_rejected(self):
+        with self.assertRaises(KeyError):
+            enqueue("no_such_task")
+
+
+class ConcurrentJobWorkerTest(TransactionTestCase):
+    def test_every_job_runs_once_across_threads(self):
+        seen = []
+        lock = threading.Lock()
+
+        def record(payloads):
+            with lock:
+                seen.extend(payload["n"] for payload in payloads)
+
+        # Wątki mogą trafić na blokadę SQLite; worker ją loguje i próbuje dalej
+        logger = logging.getLogger("shop.jobs")
+        with mock.patch.dict(TASKS, {"record": record}), mock.patch.object(
+            logger, "disabled", True
+        ):
+            enqueue_many("record", [{"n": n} for n in range(200)])
+            run_worker(concurrency=4, batch_size=10, once=True, poll_interval=0.01)
+        self.assertEqual(sorted(seen), list(range(200)))
+        self.assertEqual(Job.objects.filter(status=Job.SUCCEEDED).count(), 200)
+
+
+# Najmniejszy poprawny PNG (1x1)
+PNG_1PX = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAACklEQVQIHWMAAgAABAAB"
+    "DTukuQAAAABJRU5ErkJggg=="
+)
+
+
+class ProductImageTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, SERVE_MEDIA=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.product = Product.objects.create(
+            name="Lamp", description="Desk lamp", price=20, stock=5
+        )
+        self.staff = User.objects.create_user(username="admin", is_staff=True)
+        self.client.force_login(self.staff)
+
+    def edit(self, **files):
+        data = {
+            "name": "Lamp",
+            "description": "Desk lamp",
+            "price": "20.00",
+            "stock": 5,
+            "available": True,
+            **files,
+        }
+        url = reverse("edit_product", args=[self.product.pk])
+        return self.client.post(url, data)
+
+    def rendered(self, sizes=("card", "detail")):
+        return {
+            size: {fmt: (f"{size}.{fmt}".encode(), 40, 30) for fmt in ("webp", "jpeg")}
+            for size in sizes
+        }
+
+    def test_new_upload_queues_rendering_once(self):
+        upload = SimpleUploadedFile("lamp.png", PNG_1PX)
+        self.assertEqual(self.edit(image=upload).status_code, 302)
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.image.name.startswith("products/originals/"))
+        self.assertEqual(
+            list(Job.objects.values_list("task", "payload")),
+            [("product_images", {"product": self.product.pk})],
+        )
+        self.edit()
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_only_images_are_accepted(self):
+        page = b"<html><script>alert(1)</script></html>"
+        for name in ("lamp.html", "lamp.svg"):
+            response = self.edit(image=SimpleUploadedFile(name, page))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("image", response.context["form"].errors)
+        self.product.refresh_from_db()
+        self.assertFalse(self.product.image)
+        self.assertFalse(Job.objects.exists())
+
+        default_storage.save("products/originals/page.html", io.BytesIO(page))
+        response = self.client.get("/media/products/originals/page.html")
+        self.assertEqual(response.status_code, 404)
+
+    @skipUnless(cv2, "needs OpenCV")
+    def test_upload_must_decode(self):
+        response = self.edit(image=SimpleUploadedFile("lamp.png", b"fake image bytes"))
+        self.assertEqual(
+            response.context["form"].errors["image"], ["Not a readable image."]
+        )
+
+    def test_derivatives_are_stored_under_content_hashes(self):
+        first = store("products/originals/lamp.png", self.rendered())
+        again = store("products/originals/lamp.png", self.rendered())
+        self.assertEqual(first, again)
+        digest = hashlib.sha256(b"card.webp").hexdigest()[:20]
+        self.assertEqual(
+            first["sizes"]["card"]["webp"],
+            {
+                "name": f"products/derived/{digest[:2]}/{digest}-card.webp",
+                "width": 40,
+                "height": 30,
+            },
+        )
+        self.assertTrue(default_storage.exists(first["sizes"]["card"]["webp"]["name"]))
+
+    def test_pages_serve_the_size_they_need(self):
+        Product.objects.filter(pk=self.product.pk).update(
+            image="products/originals/lamp.png"
+        )
+        response = self.client.get(reverse("product_detail", args=[self.product.pk]))
+        self.assertContains(response, 'src="/media/products/originals/lamp.png"')
+
+        variants = store("products/originals/lamp.png", self.rendered())
+        Product.objects.filter(pk=self.product.pk).update(image_variants=variants)
+        catalog_cache().clear()
+        detail = self.client.get(reverse("product_detail", args=[self.product.pk]))
+        listing = self.client.get(reverse("product_list"))
+        for response, size in ((detail, "detail"), (listing, "card")):
+            webp = variants["sizes"][size]["webp"]["name"]
+            jpeg = variants["sizes"][size]["jpeg"]["name"]
+            self.assertContains(response, f'srcset="/media/{webp}"')
+            self.assertContains(response, f'src="/media/{jpeg}"')
+            self.assertContains(response, 'width="40" height="30"')
+
+    def test_derivatives_are_cached_forever(self):
+        name = store("x.png", self.rendered())["sizes"]["card"]["jpeg"]["name"]
+        response = self.client.get(f"/media/{name}")
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+        self.assertEqual(self.client.get("/media/../settings.py").status_code, 404)
+        with override_settings(SERVE_MEDIA=False):
+            self.assertEqual(self.client.get(f"/media/{name}").status_code, 404)
+
+    @skipIf(cv2, "OpenCV is installed")
+    def test_rendering_is_skipped_without_opencv(self):
+        self.edit(image=SimpleUploadedFile("lamp.png", PNG_1PX))
+        with self.assertLogs("shop.images", "WARNING"):
+            run_due()
+        self.assertEqual(Job.objects.get().status, Job.SUCCEEDED)
+
+    @skipUnless(cv2, "needs OpenCV")
+    def test_render_resizes_and_encodes(self):
+        import numpy as np
+
+        image = np.zeros((1000, 2000, 4), np.uint8)
+        image[:, :, 3] = 255
+        ok, png = cv2.imencode(".png", image)
+        rendered = render(png.tobytes())
+        self.assertEqual(rendered["thumb"]["jpeg"][1:], (160, 80))
+        self.assertEqual(rendered["card"]["webp"][1:], (480, 240))
+        self.assertEqual(rendered["detail"]["jpeg"][1:], (1200, 600))
+        self.assertTrue(rendered["detail"]["webp"][0].startswith(b"RIFF"))
+
+        self.edit(image=SimpleUploadedFile("lamp.png", png.tobytes()))
+        run_due()
+        self.product.refresh_from_db()
+        self.assertEqual(
+            self.product.image_variants["source"], self.product.image.name
+        )
+        self.assertEqual(list(render_catalog()), [])
+
+
+class RecommendationTest(TestCase):
+    def setUp(self):
+        catalog_cache().clear()
+        self.a, self.b, self.c, self.d, self.e = self.products = [
+            Product.objects.create(name=name, description="", price=5, stock=50)
+            for name in ("Tent", "Stove", "Lamp", "Mat", "Map")
+        ]
+        self.user = User.objects.create_user(username="camper")
+        for basket in ("abc", "ab", "abd", "cd", "e"):
+            order = Order.objects.create(customer=get_customer(self.user))
+            OrderItem.objects.bulk_create(
+                OrderItem(
+                    order=order, product=getattr(self, name), unit_price=5, line_total=5
+                )
+                for name in basket
+            )
+
+    def neighbours(self, product):
+        return list(
+            product.recommendations.order_by("rank").values_list(
+                "recommended__name", flat=True
+            )
+        )
+
+    def test_build_keeps_top_k_by_score(self):
+        result = build(k=2)
+        self.assertEqual((result.orders, result.products), (5, 5))
+        # Stove razem z Tent w 3 z 3 zamówień; remis Lamp/Mat po kolejności
+        self.assertEqual(self.neighbours(self.a), ["Stove", "Lamp"])
+        self.assertEqual(self.neighbours(self.c), ["Mat", "Tent"])
+        self.assertEqual(self.neighbours(self.e), [])
+        top = self.a.recommendations.get(rank=0)
+        self.assertEqual((top.orders, top.score), (3, 1.0))
+
+    def test_rebuild_replaces_rows_and_skips_large_orders(self):
+        build(k=2)
+        result = build(max_lines=2)
+        self.assertEqual(result.rows, 4)
+        self.assertEqual(self.neighbours(self.a), ["Stove"])
+        self.assertEqual(self.neighbours(self.c), ["Mat"])
+
+    def test_empty_history(self):
+        OrderItem.objects.all().delete()
+        self.assertEqual(build().rows, 0)
+        self.assertEqual(recommended_for(self.a.pk), [])
+
+    def test_serving_is_one_cached_lookup(self):
+        build(k=2)
+        with self.assertNumQueries(1):
+            self.assertEqual(recommended_for(self.a.pk), [self.b, self.c])
+        with self.assertNumQueries(0):
+            recommended_for(self.a.pk)
+        self.b.available = False
+        self.b.save()
+        self.assertEqual(recommended_for(self.a.pk), [self.c])
+
+    def test_cart_recommendations_exclude_cart_products(self):
+        build(k=2)
+        with self.assertNumQueries(1):
+            recommended = recommended_for_cart([self.a.pk, self.c.pk])
+        self.assertEqual(recommended, [self.b, self.d])
+        self.assertEqual(recommended_for_cart([]), [])
+
+    def test_pages_show_recommendations(self):
+        build(k=2)
+        response = self.client.get(reverse("product_detail", args=[self.a.pk]))
+        self.assertContains(response, "Customers also bought")
+        self.assertEqual(list(response.context["recommended"]), [self.b, self.c])
+        etag = response["ETag"]
+        call_command("build_recommendations", top_k=1, stdout=io.StringIO())
+        response = self.client.get(
+            reverse("product_detail", args=[self.a.pk]), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["recommended"]), [self.b])
+
+        add_item(self.user, self.d.pk)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("cart_detail"))
+        self.assertEqual(list(response.context["recommended"]), [self.c])
+
+
+class OrderExportTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="buyer", password="pass12345")
+        self.customer = get_customer(user)
+        self.product = Product.objects.create(
+            sku="CAP", name="Cap", description="", price="2.50", stock=10
+        )
+        self.old = self.order(timezone.now() - timedelta(days=40), quantity=1)
+        self.new = self.order(timezone.now(), quantity=3)
+        Payment.objects.create(order=self.new, amount="7.50")
+
+    def order(self, created_at, quantity):
+        order = Order.objects.create(customer=self.customer)
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity)
+        return order
+
+    def test_rows_are_filtered_by_date(self):
+        today = timezone.localdate()
+        rows = list(order_rows(start=today - timedelta(days=1), end=today))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][0], self.new.pk)
+        self.assertEqual(
+            rows[0][6:11], ("CAP", "Cap", 3, Decimal("2.50"), Decimal("7.50"))
+        )
+        self.assertEqual(rows[0][11], Decimal("7.50"))
+        self.assertEqual(len(list(order_rows())), 2)
+
+    def test_staff_only_streaming_endpoint(self):
+        url = reverse("export_orders")
+        self.client.force_login(self.customer.user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        staff = User.objects.create_user(username="finance", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(url, {"start": "2000-01-01"})
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:3], ["order_id", "created_at", "paid"])
+        self.assertEqual(len(lines), 3)
+        bad = self.client.get(url, {"start": "2020-02-02", "end": "2020-01-01"})
+        self.assertEqual(bad.status_code, 400)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command("export_orders", "-", stdout=out, stderr=io.StringIO())
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+
+
+class ProductTransferTest(TestCase):
+    def import_text(self, text, fmt="csv", batch_size=1000):
+        return import_products(read_rows(io.StringIO(text), fmt), batch_size)
+
+    def test_import_creates_and_updates_by_sku(self):
+        result = self.import_text(
+            "sku,name,description,price,stock,available\n"
+            "A-1,Cap,Red cap,9.99,5,1\n"
+            "A-2,Mug,White mug,4.50,0,no\n"
+            "A-3,,Nameless,1.00,1,1\n"
+            "A-4,Pen,Blue pen,cheap,1,1\n",
+            batch_size=2,
+        )
+        self.assertEqual((result.created, result.updated), (2, 0))
+        self.assertEqual([line for line, message in result.errors], [4, 5])
+        self.assertFalse(Product.objects.get(sku="A-2").available)
+
+        result = self.import_text(
+            '{"sku": "A-1", "price": "7.00", "stock": 1, "restock": 50}\n'
+            '{"sku": "B-1", "price": "1.00", "stock": 1}\n',
+            fmt="jsonl",
+        )
+        self.assertEqual((result.created, result.updated, len(result.errors)), (0, 1, 1))
+        cap = Product.objects.get(sku="A-1")
+        # Dostawa dochodzi do bieżącego stanu; stock ustawia tylko nowe produkty
+        self.assertEqual((cap.name, cap.price, cap.stock), ("Cap", Decimal("7.00"), 55))
+
+        self.import_text(
+            "sku,name,description,price,stock,restock\nC-1,Hat,Blue,3,2,4\n"
+        )
+        self.assertEqual(Product.objects.get(sku="C-1").stock, 6)
+        result = self.import_text("sku,restock\nA-1,-1\n")
+        self.assertEqual([line for line, message in result.errors], [2])
+
+    def test_import_without_stock_column(self):
+        Product.objects.create(
+            sku="A-1", name="Cap", description="Red", price="9.99", stock=5
+        )
+        result = self.import_text("sku,price\nA-1,8.00\n")
+        self.assertEqual((result.updated, result.errors), (1, []))
+        cap = Product.objects.get()
+        self.assertEqual((cap.price, cap.stock), (Decimal("8.00"), 5))
+
+    def test_restock_keeps_concurrent_sales(self):
+        cap = Product.objects.create(
+            sku="A-1", name="Cap", description="Red", price="9.99", stock=5
+        )
+        rows = read_rows(io.StringIO("sku,restock\nA-1,10\n"), "csv")
+
+        def sell_first():
+            # Sprzedaż między odczytem pliku a zapisem partii
+            for row in rows:
+                cap.update_stock(2)
+                yield row
+
+        result = import_products(sell_first())
+        self.assertEqual(result.updated, 1)
+        self.assertEqual(Product.objects.get().stock, 13)
+
+    def test_export_round_trip(self):
+        Product.objects.create(
+            sku="A-1", name="Cap", description="Red", price="9.99", stock=5
+        )
+        for fmt in ("csv", "jsonl"):
+            out = io.StringIO()
+            self.assertEqual(export_products(out, fmt), 1)
+            Product.objects.update(name="Old")
+            result = self.import_text(out.getvalue(), fmt)
+            self.assertEqual(result.updated, 1, result.errors)
+            cap = Product.objects.get()
+            self.assertEqual((cap.name, cap.stock), ("Cap", 5))
+
+    def test_commands(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "products.csv"
+        path.write_text("sku,name,description,price,stock\nA-1,Cap,Red,2.00,3\n")
+        out = io.StringIO()
+        call_command("import_products", str(path), stdout=out)
+        self.assertIn("1 created", out.getvalue())
+        call_command("export_products", str(path), stdout=io.StringIO())
+        self.assertIn("A-1,Cap,Red,2.00,3,True", path.read_text())
+
+
+class CartUpsertTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.products = [
+            Product.objects.create(name=name, description="", price=2, stock=10)
+            for name in ("Cap", "Mug", "Pen")
+        ]
+
+    def quantities(self):
+        return dict(
+            CartItem.objects.filter(cart__user=self.user).values_list(
+                "product_id", "quantity"
+            )
+        )
+
+    def test_add_items_increments_in_one_statement(self):
+        cap, mug, pen = self.products
+        self.assertEqual(add_items(self.user, {cap.pk: 1, mug.pk: 2}), 2)
+        with self.assertNumQueries(1):
+            add_items(self.user, {cap.pk: 3, pen.pk: 1, 10**6: 1})
+        self.assertEqual(self.quantities(), {cap.pk: 4, mug.pk: 2, pen.pk: 1})
+        with self.assertRaises(Product.DoesNotExist):
+            add_item(self.user, 10**6)
+
+    def test_one_line_per_product(self):
+        add_item(self.user, self.products[0].pk)
+        cart = Cart.objects.get(user=self.user)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartItem.objects.create(cart=cart, product=self.products[0])
+
+    def test_add_to_cart_view(self):
+        self.client.force_login(self.user)
+        url = reverse("add_to_cart", args=[self.products[0].pk])
+        self.assertRedirects(self.client.get(url), reverse("cart_detail"))
+        self.client.get(url)
+        self.assertEqual(self.quantities(), {self.products[0].pk: 2})
+        missing = self.client.get(reverse("add_to_cart", args=[10**6]))
+        self.assertEqual(missing.status_code, 404)
+
+    def test_anonymous_cart_lives_in_session(self):
+        cap, mug, pen = self.products
+        add_item(self.user, cap.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("add_to_cart", args=[cap.pk]))
+            self.client.get(reverse("add_to_cart", args=[mug.pk]))
+        # Domyślne sesje (cache) nie piszą do django_session
+        self.assertFalse(any("django_session" in q["sql"] for q in queries))
+        # Produkt już w cache katalogu: dodanie nie dotyka bazy
+        with self.assertNumQueries(0):
+            self.client.get(reverse("add_to_cart", args=[cap.pk]))
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 1)
+
+        response = self.client.get(reverse("cart_detail"))
+        self.assertEqual(
+            [(item.product, item.quantity) for item in response.context["items"]],
+            [(cap, 2), (mug, 1)],
+        )
+        self.assertEqual(response.context["total"], Decimal("6.00"))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(
+                reverse("user_login"), {"username": "buyer", "password": "pass12345"}
+            )
+        self.assertLessEqual(len(queries), get_query_budget(views.user_login))
+        upserts = [q for q in queries if "ON CONFLICT (cart_id" in q["sql"]]
+        self.assertEqual(len(upserts), 1)
+        self.assertEqual(self.quantities(), {cap.pk: 3, mug.pk: 1})
+        self.assertNotIn(SESSION_KEY, self.client.session)
+
+    def test_session_cart_is_capped(self):
+        session = {}
+        with mock.patch("shop.cart.MAX_SESSION_LINES", 2):
+            add_to_session(session, self.products[0].pk)
+            add_to_session(session, self.products[1].pk)
+            add_to_session(session, self.products[0].pk)
+            with self.assertRaises(CartFull):
+                add_to_session(session, self.products[2].pk)
+        with self.assertRaises(Product.DoesNotExist):
+            add_to_session(session, 10**6)
+        self.assertEqual(
+            session_items(session), {self.products[0].pk: 2, self.products[1].pk: 1}
+        )
+
+    def test_add_many_endpoint(self):
+        self.client.force_login(self.user)
+        items = {str(product.pk): 2 for product in self.products}
+        response = self.client.post(
+            reverse("cart_add_many"), {"items": items}, content_type="application/json"
+        )
+        self.assertEqual(response.json(), {"lines": 3, "quantity": 6, "total": "12.00"})
+        bad = self.client.post(
+            reverse("cart_add_many"), {"items": [1]}, content_type="application/json"
+        )
+        self.assertEqual(bad.status_code, 400)
+
+
+class AsyncCartViewTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.product = Product.objects.create(
+            name="Sock", description="", price="2.50", stock=10
+        )
+        self.client.force_login(self.user)
+
+    def test_add_change_and_remove(self):
+        url = reverse("cart_add", args=[self.product.pk])
+        self.assertEqual(
+            self.client.post(url).json(),
+            {"lines": 1, "quantity": 1, "total": "2.50"},
+        )
+        self.assertEqual(self.client.post(url, {"quantity": 2}).json()["quantity"], 3)
+
+        response = self.client.post(
+            reverse("cart_set_quantity", args=[self.product.pk]),
+            '{"quantity": 5}',
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["total"], "12.50")
+
+        response = self.client.post(reverse("cart_remove", args=[self.product.pk]))
+        self.assertEqual(response.json(), {"lines": 0, "quantity": 0, "total": "0.00"})
+
+    def test_summary_and_errors(self):
+        self.assertEqual(self.client.get(reverse("cart_summary")).json()["lines"], 0)
+        missing = self.client.post(reverse("cart_add", args=[self.product.pk + 1]))
+        self.assertEqual(missing.status_code, 404)
+        bad = self.client.post(
+            reverse("cart_add", args=[self.product.pk]), {"quantity": "x"}
+        )
+        self.assertEqual(bad.status_code, 400)
+        wrong_method = self.client.get(reverse("cart_remove", args=[1]))
+        self.assertEqual(wrong_method.status_code, 405)
+
+    async def test_runs_under_async_client(self):
+        response = await self.async_client.get(reverse("cart_summary"))
+        self.assertEqual(response.status_code, 401)
+
+    def test_middleware_stays_async_under_asgi(self):
+        chain = []
+        node = ASGIHandler()._middleware_chain
+        while hasattr(getattr(node, "__wrapped__", node), "get_response"):
+            node = getattr(node, "__wrapped__", node)
+            chain.append(node)
+            node = node.get_response
+        # Żadne middleware nie przerzuca żądania do wątku, więc widzimy całe
+        self.assertEqual(len(chain), len(settings.MIDDLEWARE))
+        for middleware in chain:
+            self.assertTrue(asyncio.iscoroutinefunction(middleware), middleware)
+
+
+@override_settings(PERF_METRICS_SAMPLE_RATE=1.0)
+class PerformanceMetricsTest(TestCase):
+    def setUp(self):
+        registry.reset()
+        Product.objects.create(name="Cap", description="", price=5, stock=1)
+
+    def test_server_timing_and_per_view_stats(self):
+        response = self.client.get(reverse("product_list"))
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'^total;dur=[\d.]+, sql;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn("tpl;dur=", timing)
+
+        stats = registry.snapshot()["product_list"]
+        self.assertEqual(stats["requests"], 1)
+        self.assertGreater(stats["sql_queries_avg"], 0)
+        self.assertGreater(stats["template_ms_avg"], 0)
+        self.assertTrue(stats["slowest_query"]["sql"])
+        self.assertEqual(sum(stats["latency_ms"]["histogram"].values()), 1)
+
+    @override_settings(PERF_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_recorded(self):
+        response = self.client.get(reverse("product_list"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(registry.snapshot(), {})
+
+    def test_metrics_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 302)
+        staff = User.objects.create_user(username="ops", is_staff=True)
+        self.client.force_login(staff)
+        self.client.get(reverse("product_list"))
+        views = self.client.get(reverse("metrics")).json()["views"]
+        self.assertEqual(views["product_list"]["requests"], 1)
+        self.client.post(reverse("metrics"), {"reset": "1"})
+        self.assertEqual(list(registry.snapshot()), ["metrics"])
+
+    def test_histogram_percentiles(self):
+        histogram = Histogram(bounds=(10, 100))
+        for value in (1, 2, 3, 50, 500):
+            histogram.add(value)
+        self.assertEqual(histogram.as_dict(), {"le_10": 3, "le_100": 1, "inf": 1})
+        self.assertEqual(histogram.percentile(50), 10)
+        self.assertEqual(histogram.percentile(80), 100)
+        self.assertIsNone(histogram.percentile(99))
+
+    def test_slow_requests_keep_the_endpoint_valid_json(self):
+        registry.record("product_list", BUCKETS_MS[-1] * 2, RequestTimings())
+        self.client.force_login(User.objects.create_user(username="ops", is_staff=True))
+        response = self.client.get(reverse("metrics"))
+
+        def reject(constant):
+            raise ValueError(constant)
+
+        # Ścisły parser: Infinity czy NaN to nie JSON
+        data = json.loads(response.content, parse_constant=reject)
+        latency = data["views"]["product_list"]["latency_ms"]
+        self.assertIsNone(latency["p99"])
+        self.assertEqual(latency["histogram"]["inf"], 1)
+
+
+class BenchmarkHelpersTest(TestCase):
+    def test_seed_shop_is_reproducible(self):
+        product_ids, users = seed_shop(products=20, users=3, orders_per_user=2, seed=7)
+        self.assertEqual(len(product_ids), 20)
+        self.assertEqual(Order.objects.filter(customer__user__in=users).count(), 6)
+        self.assertEqual(OrderItem.objects.count(), 18)
+        self.assertTrue(ProductDailySales.objects.exists())
+        prices = list(Product.objects.order_by("pk").values_list("price", flat=True))
+        Product.objects.all().delete()
+        seed_shop(products=20, users=0, seed=7)
+        self.assertEqual(
+            list(Product.objects.order_by("pk").values_list("price", flat=True)), prices
+        )
+
+    def test_compare_results_flags_regressions(self):
+        baseline = {"checkout": {"throughput": 100, "p95_ms": 10, "queries_avg": 12}}
+        results = {"checkout": {"throughput": 95, "p95_ms": 20, "queries_avg": 15}}
+        flagged = {
+            metric: regressed
+            for name, metric, old, new, regressed in compare_results(baseline, results)
+        }
+        self.assertEqual(
+            flagged, {"throughput": False, "p95_ms": True, "queries_avg": True}
+        )
+
+
+class AdminChangelistTest(TestCase):
+    MAX_QUERIES = 7
+    MODELS = [
+        model._meta.model_name
+        for model in admin.site._registry
+        if model._meta.app_label == "shop"
+    ]
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser("root", "root@example.com", "pw")
+        self.client.force_login(self.admin)
+
+    def seed(self, count):
+        for _ in range(count):
+            n = Order.objects.count()
+            user = User.objects.create_user(username=f"buyer{n}")
+            product = Product.objects.create(
+                name=f"Item {n}", description="", price=3, stock=9
+            )
+            add_item(user, product.pk)
+            order = Order.objects.create(customer=get_customer(user))
+            OrderItem.objects.create(
+                order=order, product=product, unit_price=3, line_total=3
+            )
+            Payment.objects.create(order=order, amount=3)
+            PaymentRequest.objects.create(
+                order=order, amount=3, idempotency_key=f"key-{order.pk}"
+            )
+            StockReservation.objects.create(
+                order=order, product=product, quantity=1, expires_at=timezone.now()
+            )
+            enqueue("order_confirmation", {"order": order.pk})
+
+    def changelist_queries(self, model, query=""):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/admin/shop/{model}/{query}")
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_is_capped_and_flat(self):
+        self.seed(2)
+        before = {model: self.changelist_queries(model) for model in self.MODELS}
+        self.seed(8)
+        for model in self.MODELS:
+            with self.subTest(model=model):
+                queries = self.changelist_queries(model)
+                self.assertLessEqual(queries, self.MAX_QUERIES)
+                self.assertEqual(queries, before[model])
+
+    def test_number_searches_by_id(self):
+        self.seed(3)
+        order = Order.objects.order_by("pk").first()
+        response = self.client.get("/admin/shop/orderitem/", {"q": str(order.pk)})
+        self.assertEqual(
+            [item.order_id for item in response.context["cl"].result_list], [order.pk]
+        )
+        response = self.client.get("/admin/shop/orderitem/", {"q": "mug"})
+        self.assertEqual(len(response.context["cl"].result_list), 0)
+        response = self.client.get("/admin/shop/order/", {"q": "BUYER0@EXAMPLE.COM"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_estimated_count_paginator(self):
+        self.seed(3)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.seed(2)
+        paginator = EstimatedCountPaginator(Order.objects.order_by("pk"), 2)
+        paginator.exact_below = 1
+        # Statystyki sprzed ostatnich zamówień
+        self.assertEqual(paginator.count, 3)
+        paid = Order.objects.filter(paid=True).order_by("pk")
+        self.assertIsNone(estimated_count(paid))
+        filtered = EstimatedCountPaginator(paid, 2)
+        filtered.exact_below = 1
+        self.assertEqual(filtered.count, 5)
+        # Mała tabela: liczymy dokładnie
+        paginator = EstimatedCountPaginator(Order.objects.order_by("pk"), 2)
+        self.assertEqual(paginator.count, 5)
+
+
+class DatabaseConfigTest(SimpleTestCase):
+    def test_sqlite_url(self):
+        config = database_config("sqlite:////tmp/shop.sqlite3", conn_max_age=60)
+        self.assertEqual(config["ENGINE"], "django.db.backends.sqlite3")
+        self.assertEqual(config["NAME"], "/tmp/shop.sqlite3")
+        self.assertEqual(config["CONN_MAX_AGE"], 60)
+
+    def test_postgres_url(self):
+        config = database_config(
+            "postgres://shop:secret@db:5432/shop?sslmode=require",
+            statement_timeout_ms=5000,
+        )
+        self.assertEqual(config["ENGINE"], "shop.postgresql")
+        self.assertEqual(config["CONN_MAX_AGE"], 600)
+        self.assertTrue(config["CONN_HEALTH_CHECKS"])
+        self.assertEqual(
+            config["OPTIONS"],
+            {"sslmode": "require", "options": "-c statement_timeout=5000"},
+        )
+        self.assertNotIn("POOL", config)
+
+        pooled = database_config("postgres://db/shop", pool_size=4, pool_timeout=2)
+        self.assertEqual(pooled["CONN_MAX_AGE"], 0)
+        self.assertEqual(pooled["POOL"], {"MAX_SIZE": 4, "TIMEOUT": 2})
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.usable = True
+        self.info = mock.Mock(transaction_status=TRANSACTION_STATUS_IDLE)
+
+    def cursor(self):
+        if not self.usable:
+            raise postgresql.Database.OperationalError("server closed the connection")
+        return mock.MagicMock()
+
+    def rollback(self):
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@mock.patch.object(postgresql.Database, "connect", side_effect=FakeConnection)
+class ConnectionPoolTest(SimpleTestCase):
+    def test_connections_are_reused(self, connect):
+        pool = ConnectionPool({}, max_size=2)
+        first = pool.get()
+        pool.put(first)
+        self.assertIs(pool.get(), first)
+        second = pool.get()
+        self.assertIsNot(second, first)
+        self.assertEqual(pool.opened, 2)
+
+    def test_exhausted_pool_times_out(self, connect):
+        pool = ConnectionPool({}, max_size=1, timeout=0.01)
+        connection = pool.get()
+        with self.assertRaises(PoolTimeout):
+            pool.get()
+        pool.put(connection)
+        self.assertIs(pool.get(), connection)
+
+    def test_broken_connections_are_dropped(self, connect):
+        pool = ConnectionPool({}, max_size=2)
+        connection = pool.get()
+        connection.info.transaction_status = TRANSACTION_STATUS_INERROR
+        pool.put(connection)
+        # Nieudana transakcja jest wycofywana, a połączenie wraca do puli
+        self.assertIs(pool.get(), connection)
+        pool.put(connection, discard=True)
+        self.assertTrue(connection.closed)
+
+        connection = pool.get()
+        pool.put(connection)
+        connection.usable = False
+        fresh = pool.get(check=True)
+        self.assertIsNot(fresh, connection)
+        self.assertTrue(connection.closed)
+
+
+@override_settings(REPLICA_DATABASES=["replica"])
+class ReplicaRoutingTest(TransactionTestCase):
+    """A copy of the primary in a second SQLite file acts as a lagging replica."""
+
+    def setUp(self):
+        catalog_cache().clear()
+        self.product = Product.objects.create(
+            name="Kettle", description="", price=30, stock=5
+        )
+        self.user = User.objects.create_user(username="buyer")
+        add_item(self.user, self.product.pk)
+        self.client.force_login(self.user)
+        self.copy_to_replica()
+
+    def copy_to_replica(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary = connections["default"]
+        primary.ensure_connection()
+        replica = sqlite3.connect(f"{directory}/replica.sqlite3")
+        primary.connection.backup(replica)
+        replica.close()
+        connections.settings["replica"] = {
+            **primary.settings_dict,
+            "NAME": f"{directory}/replica.sqlite3",
+        }
+        self.addCleanup(connections.settings.pop, "replica")
+        self.addCleanup(self.drop_replica_connection)
+
+    def drop_replica_connection(self):
+        connections["replica"].close()
+        del connections["replica"]
+
+    def test_routing(self):
+        self.assertEqual(Product.objects.all().db, "default")
+        with use_replicas():
+            self.assertEqual(Product.objects.all().db, "replica")
+            with transaction.atomic():
+                self.assertEqual(Product.objects.all().db, "default")
+            self.assertEqual(Product.objects.select_for_update().db, "default")
+            # Samo wybranie bazy do zapisu niczego nie przełącza, zapis już tak
+            self.assertEqual(Product.objects.all().db, "replica")
+            Product.objects.filter(pk=self.product.pk).update(stock=3)
+            self.assertEqual(Product.objects.all().db, "default")
+        self.assertFalse(router.allow_migrate("replica", "shop"))
+
+    def test_get_reads_from_replica(self):
+        Product.objects.create(name="Kettle 2", description="", price=9, stock=5)
+        response = self.client.get(reverse("product_search"), {"q": "Kettle"})
+        self.assertContains(response, "Kettle")
+        self.assertNotContains(response, "Kettle 2")
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_catalog_cache_is_refilled_from_primary(self):
+        url = reverse("product_detail", args=[self.product.pk])
+        self.client.get(url)
+        self.product.name = "Kettle 2"
+        self.product.save()
+        # Replika jeszcze nie ma zmiany; cache nie może jej utrwalić
+        self.assertContains(self.client.get(url), "Kettle 2")
+        self.assertEqual(get_product(self.product.pk).name, "Kettle 2")
+
+    def test_reading_an_existing_cart_does_not_pin(self):
+        # get_or_create wybiera bazę do zapisu, ale niczego nie zapisuje
+        for url in (reverse("cart_detail"), reverse("checkout")):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_client_reads_primary_after_writing(self):
+        response = self.client.post(reverse("checkout"))
+        self.assertIn(PIN_COOKIE, response.cookies)
+        order = Order.objects.get(customer=get_customer(self.user))
+        self.assertRedirects(response, reverse("order_detail", args=[order.pk]))
+        self.assertEqual(self.client.get(response.url).status_code, 200)
+        # Bez ciasteczka czytalibyśmy z repliki, która nie zna zamówienia
+        del self.client.cookies[PIN_COOKIE]
+        self.assertEqual(self.client.get(response.url).status_code, 404)
+
+
+class CustomerProfileTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="buyer", password="pass12345", email="buyer@example.com"
+        )
+
+    def test_profile_is_created_on_first_use(self):
+        self.assertFalse(Customer.objects.exists())
+        customer = get_customer(self.user)
+        self.assertEqual(customer.email, "buyer@example.com")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_customer(self.user), customer)
+        # Zapis użytkownika nie dotyka już profilu
+        with self.assertNumQueries(1):
+            self.user.save()
+
+    def test_login_skips_profile(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("user_login"), {"username": "buyer", "password": "pass12345"}
+            )
+        # SELECT użytkownika i UPDATE last_login
+        self.assertEqual(len(queries), 2)
+        self.assertFalse(any("shop_customer" in q["sql"] for q in queries))
+        self.assertRedirects(response, reverse("product_list"))
+
+    def test_checkout_creates_missing_profile(self):
+        product = Product.objects.create(name="Cap", description="", price=2, stock=5)
+        add_item(self.user, product.pk)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("checkout"))
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse("order_detail", args=[order.pk]))
+        self.assertEqual(order.customer.user, self.user)
+
+
+class QueryBudgetTest(TestCase):
+    def test_every_shop_view_declares_a_budget(self):
+        for pattern in urls.urlpatterns:
+            if isinstance(pattern, URLPattern):
+                self.assertIsNotNone(get_query_budget(pattern.callback), pattern.name)
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_middleware_fails_views_over_budget(self):
+        @query_budget(1)
+        def view(request):
+            list(Product.objects.all())
+            list(Product.objects.all())
+            return HttpResponse()
+
+        request = RequestFactory().get("/")
+        request.resolver_match = resolve("/")
+        request.resolver_match.func = view
+        middleware = QueryBudgetMiddleware(lambda request: view(request))
+        with self.assertRaises(QueryBudgetExceeded):
+            middleware(request)
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    async def test_middleware_counts_queries_of_async_views(self):
+        def two_queries():
+            list(Product.objects.all())
+            list(Product.objects.all())
+
+        @query_budget(1)
+        async def view(request):
+            await sync_to_async(two_queries)()
+            return HttpResponse()
+
+        request = RequestFactory().get("/")
+        request.resolver_match = resolve("/")
+        request.resolver_match.func = view
+        middleware = QueryBudgetMiddleware(view)
+        with self.assertRaises(QueryBudgetExceeded):
+            await middleware(request)
+
+    def test_detail_pages_stay_within_budget_for_large_carts_and_orders(self):
+        user = User.objects.create_user(username="buyer", password="pass12345")
+        cart = Cart.objects.create(user=user)
+        order = Order.objects.create(customer=get_customer(user))
+        for i in range(25):
+            product = Product.objects.create(
+                name=f"P{i}", description="", price=1, stock=10
+            )
+            CartItem.objects.create(cart=cart, product=product)
+            OrderItem.objects.create(order=order, product=product)
+        self.client.force_login(user)
+        # The middleware raises if any of these goes over its budget
+        for url in [
+            reverse("cart_detail"),
+            reverse("checkout"),
+            reverse("order_list"),
+            reverse("order_detail", args=[order.pk]),
+        ]:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
 class AddProductViewTest(TestCase):
     def test_add_product_view_status_code(self):
         response = self.client.get(reverse("add_product"))
@@ -0,0 +1,228 @@
+"""
+Streaming product import and export.
+
+Rows are CSV (with a header) or JSON Lines, keyed by ``Product.sku``.
+Files are read and written one row at a time, and imports are applied in
+batches with ``bulk_create`` and batched ``UPDATE`` statements, so memory stays flat however
+large the file is. Every imported row is validated by ``ProductForm``.
+
+``stock`` is the absolute stock the export writes; an import uses it only
+as the starting stock of new products, so re-importing an export leaves
+existing stock alone. Deliveries go in the optional ``restock`` column:
+those units are added to the current stock through
+``shop.inventory.restock``, so sales and reservations made while the
+import runs are kept.
+"""
+import csv
+import json
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.db import connections, router, transaction
+from django import forms
+from django.forms import modelform_factory
+from django.utils import timezone
+
+from .cache import invalidate_products
+from .forms import ProductForm
+from .inventory import restock
+from .models import Product
+
+FIELDS = ["sku", "name", "description", "price", "stock", "available"]
+IMPORT_FIELDS = [*FIELDS, "restock"]
+FORMATS = ["csv", "jsonl"]
+FALSE_VALUES = {"", "0", "false", "no", "n", "off"}
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    errors: list = field(default_factory=list)
+
+    @property
+    def rows(self):
+        return self.created + self.updated + len(self.errors)
+
+
+def guess_format(path, default="csv"):
+    for fmt in FORMATS:
+        if str(path).endswith(f".{fmt}"):
+            return fmt
+    if str(path).endswith(".json"):
+        return "jsonl"
+    return default
+
+
+def read_rows(fh, fmt):
+    """Yield ``(line, row)`` pairs; ``line`` is the 1-based line in the file."""
+    if fmt == "csv":
+        reader = csv.DictReader(fh)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "jsonl":
+        for line, text in enumerate(fh, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as e:
+                raise ImportFormatError(f"Line {line}: {e}")
+            if not isinstance(row, dict):
+                raise ImportFormatError(f"Line {line}: expected an object.")
+            yield line, row
+    else:
+        raise ImportFormatError(f"Unknown format {fmt!r}.")
+
+
+def export_products(fh, fmt, queryset=None, chunk_size=2000):
+    """Write products to ``fh`` one at a time and return how many."""
+    if queryset is None:
+        queryset = Product.objects.all()
+    rows = queryset.order_by("pk").values_list(*FIELDS).iterator(chunk_size)
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(fh)
+        writer.writerow(FIELDS)
+        for count, row in enumerate(rows, start=1):
+            writer.writerow(row)
+    elif fmt == "jsonl":
+        for count, row in enumerate(rows, start=1):
+            fh.write(json.dumps(dict(zip(FIELDS, row)), default=str) + "\n")
+    else:
+        raise ImportFormatError(f"Unknown format {fmt!r}.")
+    return count
+
+
+class ProductImportForm(ProductForm):
+    restock = forms.IntegerField(min_value=0, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["sku"].required = True
+
+    def validate_unique(self):
+        # Wiersze z istniejącym SKU aktualizują produkt zamiast być błędem
+        pass
+
+
+def _form_data(row, columns):
+    data = {}
+    for name in columns:
+        value = row.get(name)
+        if name == "available" and isinstance(value, str):
+            value = value.strip().lower() not in FALSE_VALUES
+        data[name] = "" if value is None else value
+    return data
+
+
+def _describe(errors):
+    return "; ".join(
+        f"{name}: {' '.join(messages)}" for name, messages in errors.items()
+    )
+
+
+def _update_rows(products, fields):
+    # bulk_update() buduje CASE WHEN dla każdego wiersza i przy dużych
+    # partiach to ono dominuje czas importu; executemany jest kilka razy szybsze
+    connection = connections[router.db_for_write(Product)]
+    qn = connection.ops.quote_name
+    model_fields = [Product._meta.get_field(name) for name in fields]
+    sql = "UPDATE {} SET {} WHERE {} = %s".format(
+        qn(Product._meta.db_table),
+        ", ".join(f"{qn(f.column)} = %s" for f in model_fields),
+        qn(Product._meta.pk.column),
+    )
+    params = [
+        [
+            f.get_db_prep_save(getattr(product, f.attname), connection)
+            for f in model_fields
+        ]
+        + [product.pk]
+        for product in products
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def _apply_batch(batch, columns, result):
+    form_class = modelform_factory(Product, form=ProductImportForm, fields=columns)
+    products = {}
+    for line, row in batch:
+        form = form_class(_form_data(row, columns))
+        if form.is_valid():
+            # Later rows for the same SKU win, like they would one by one
+            products[form.cleaned_data["sku"]] = (line, form.cleaned_data)
+        else:
+            result.errors.append((line, _describe(form.errors)))
+    if not products:
+        return
+
+    update_fields = [
+        name for name in columns if name not in ("sku", "stock", "restock")
+    ]
+    missing = [
+        name
+        for name, form_field in ProductImportForm.base_fields.items()
+        if form_field.required and name not in columns
+    ]
+    now = timezone.now()
+    with transaction.atomic():
+        existing = dict(
+            Product.objects.filter(sku__in=products).values_list("sku", "pk")
+        )
+        to_update, to_create, deliveries = [], [], {}
+        for sku, (line, data) in products.items():
+            restocked = data.pop("restock", None) or 0
+            if sku in existing:
+                data.pop("stock", None)
+                to_update.append(Product(pk=existing[sku], updated_at=now, **data))
+                if restocked:
+                    deliveries[existing[sku]] = restocked
+            elif missing:
+                result.errors.append(
+                    (
+                        line,
+                        f"Unknown SKU {sku}; new products need {', '.join(missing)}.",
+                    )
+                )
+            else:
+                product = Product(**data)
+                product.stock += restocked
+                to_create.append(product)
+        if to_update and update_fields:
+            _update_rows(to_update, [*update_fields, "updated_at"])
+        restock(deliveries)
+        Product.objects.bulk_create(to_create)
+        # bulk_* omija sygnały, więc cache czyścimy sami
+        invalidate_products(existing.values())
+    result.updated += len(to_update)
+    result.created += len(to_create)
+
+
+def import_products(rows, batch_size=1000):
+    """
+    Create or update products from ``(line, row)`` pairs, matching on SKU.
+
+    Only the columns in the first row are written, so a feed of just
+    ``sku,price,restock`` reprices and restocks without touching names.
+    ``stock`` only sets the stock of new products; ``restock`` is added to
+    what existing ones have. New products still need every field
+    ``ProductForm`` requires.
+    """
+    result = ImportResult()
+    rows = iter(rows)
+    columns = None
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return result
+        if columns is None:
+            columns = [name for name in IMPORT_FIELDS if name in batch[0][1]]
+            if "sku" not in columns:
+                raise ImportFormatError("The sku column is required.")
+        _apply_batch(batch, columns, result)
@@ -1,6 +1,11 @@
-from django.urls import path
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
 
-from . import views
+from . import api, async_views, views
+
+router = DefaultRouter()
+router.register("products", api.ProductViewSet, basename="api-product")
+router.register("orders", api.OrderViewSet, basename="api-order")
 
 urlpatterns = [
     path("register/", views.user_register, name="user_register"),
@@ -8,10 +13,28 @@ urlpatterns = [
     path("logout/", views.user_logout, name="user_logout"),
     path("cart/", views.cart_detail, name="cart_detail"),
     path("cart/add/<int:product_id>/", views.add_to_cart, name="add_to_cart"),
+    path("cart/summary/", async_views.cart_summary, name="cart_summary"),
+    path("cart/items/add/", async_views.cart_add_many, name="cart_add_many"),
+    path("cart/items/<int:product_id>/add/", async_views.cart_add, name="cart_add"),
+    path(
+        "cart/items/<int:product_id>/quantity/",
+        async_views.cart_set_quantity,
+        name="cart_set_quantity",
+    ),
+    path(
+        "cart/items/<int:product_id>/remove/",
+        async_views.cart_remove,
+        name="cart_remove",
+    ),
     path("", views.product_list, name="product_list"),
     path("product/<int:pk>/", views.product_detail, name="product_detail"),
+    path("search/", views.product_search, name="product_search"),
+    path("media/<path:path>", views.media_file, name="media_file"),
     path("orders/", views.order_list, name="order_list"),
     path("order/<int:pk>/", views.order_detail, name="order_detail"),
+    path("orders/export/", views.export_orders, name="export_orders"),
+    path("reports/sales/", views.sales_dashboard, name="sales_dashboard"),
+    path("metrics/", views.metrics, name="metrics"),
     path("add_product/", views.add_product, name="add_product"),
     path("edit_product/<int:pk>/", views.edit_product, name="edit_product"),
     path("delete_product/<int:pk>/", views.delete_product, name="delete_product"),
@@ -21,5 +44,8 @@ urlpatterns = [
         views.process_payment,
         name="process_payment",
     ),
+    path("payments/<str:key>/", views.payment_status, name="payment_status"),
     path("checkout/", views.checkout, name="checkout"),
+    path("api/cart/", api.CartView.as_view(), name="api-cart"),
+    path("api/", include(router.urls)),
 ]
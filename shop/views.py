@@ -1,20 +1,56 @@
+from datetime import timedelta
+from decimal import Decimal
+from uuid import uuid4
+
 from django.contrib import messages
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
 from django.db import transaction
-from django.http import HttpResponse
+from django.http import (FileResponse, Http404, HttpResponse, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
-
-from .forms import OrderForm, ProductForm
-from .models import (Cart, CartItem, Customer, Order, OrderItem, Payment,
-                     Product)
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+
+from .analytics import sales_report
+from .auth import get_customer
+from .cache import (add_validators, catalog_timeout, catalog_version,
+                    conditional_response, get_list_page, get_product,
+                    is_cacheable, make_etag)
+from .cart import (CartFull, add_item, add_to_session, merge_session_cart,
+                   session_cart_items)
+from .exports import iter_csv, order_rows
+from .forms import (DateRangeForm, OrderForm, PaymentRequestForm,
+                    ProductFilterForm, ProductForm)
+from .images import DERIVED_DIR
+from .metrics import registry, sample_rate
+from .models import (IMAGE_EXTENSIONS, Cart, Customer, Order, OrderItem,
+                     PaymentRequest, Product)
+from .pagination import InvalidCursor, KeysetPaginator
+from .payments import IdempotencyConflict, submit_payment
+from .query_budget import query_budget
+from .recommendations import recommended_for, recommended_for_cart
+from .recommendations import version as recommendations_version
+from .search import search_products
+from .services import CheckoutError, place_order
+
+PRODUCTS_PER_PAGE = 24
+SEARCH_RESULTS_PER_PAGE = 20
+SALES_REPORT_DAYS = 30
+PAYMENT_POLL_SECONDS = 2
+MEDIA_MAX_AGE = 365 * 24 * 60 * 60
 
 
 def is_admin(user):
     return user.is_staff
 
 
+@query_budget(4)
 def user_register(request):
     if request.method == "POST":
         form = UserCreationForm(request.POST)
@@ -30,21 +66,20 @@ def user_register(request):
     return render(request, "shop/register.html", {"form": form})
 
 
+@query_budget(10)
 def user_login(request):
     if request.method == "POST":
         form = AuthenticationForm(request, data=request.POST)
         if form.is_valid():
-            username = form.cleaned_data["username"]
-            password = form.cleaned_data["password"]
-            user = authenticate(username=username, password=password)
-            if user is not None:
-                login(request, user)
-                messages.success(request, "Logged in successfully!")
-                return redirect(
-                    "product_list"
-                )  
-            else:
-                messages.error(request, "Invalid username or password")
+            # Formularz już uwierzytelnił użytkownika, bez drugiego authenticate()
+            user = form.get_user()
+            login(request, user)
+            # Koszyk gościa przechodzi do bazy jednym upsertem
+            merge_session_cart(request.session, user)
+            messages.success(request, "Logged in successfully!")
+            return redirect(
+                "product_list"
+            )  
         else:
             messages.error(request, "Invalid username or password")
     else:
@@ -53,45 +88,182 @@ def user_login(request):
     return render(request, "shop/login.html", {"form": form})
 
 
+@query_budget(5)
 def user_logout(request):
     logout(request)
     messages.success(request, "Logged out successfully!")
     return redirect("product_list")
 
 
-@login_required(login_url='/login/')
+# Pierwsze dodanie tworzy koszyk (get_or_create) i powtarza upsert
+@query_budget(7)
 def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id)  
-    cart, created = Cart.objects.get_or_create(user=request.user)  
-    
-    cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product) 
-    
-    if not created:
-        cart_item.quantity += 1  
-        cart_item.save()  
-
-    return redirect("cart_detail")  
-
-@login_required(login_url='/login/')
+    try:
+        if request.user.is_authenticated:
+            add_item(request.user, product_id)
+        else:
+            # Gość: koszyk w sesji, bez zapisu do bazy
+            add_to_session(request.session, product_id)
+    except Product.DoesNotExist:
+        raise Http404("No Product matches the given query.")
+    except CartFull as e:
+        messages.error(request, str(e))
+    return redirect("cart_detail")
+
+@query_budget(7)
 def cart_detail(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    return render(request, "shop/cart_detail.html", {"cart": cart})
-
-
+    if request.user.is_authenticated:
+        cart, created = (
+            Cart.objects.with_totals().with_items().get_or_create(user=request.user)
+        )
+        items = cart.items.all()
+        total = Decimal("0.00") if created else cart.total
+    else:
+        items = session_cart_items(request.session)
+        total = sum(
+            (item.quantity * item.product.price for item in items), Decimal("0.00")
+        )
+    recommended = recommended_for_cart(item.product_id for item in items)
+    return render(
+        request,
+        "shop/cart_detail.html",
+        {"items": items, "total": total, "recommended": recommended},
+    )
+
+
+def catalog_context():
+    return {
+        "cache_alias": getattr(settings, "CATALOG_CACHE", "default"),
+        "cache_timeout": catalog_timeout(),
+    }
+
+
+@query_budget(3)
 def product_list(request):
-    product = Product.objects.all()
-    return render(request, "shop/product_list.html", {"products": product})
-
-
+    cacheable = is_cacheable(request)
+    version = catalog_version()
+    etag = make_etag("list", version, request.GET.urlencode())
+    if cacheable:
+        response = conditional_response(request, etag, version / 1000)
+        if response is not None:
+            return response
+
+    form = ProductFilterForm(request.GET)
+    products = form.filter_queryset(Product.objects.all())
+    paginator = KeysetPaginator(products, form.sort_field(), PRODUCTS_PER_PAGE)
+    try:
+        page = get_list_page(paginator, request.GET.get("cursor"), version, request.GET)
+    except InvalidCursor:
+        return HttpResponse("Invalid page cursor.", status=400)
+
+    next_query = None
+    if page.has_next:
+        query = request.GET.copy()
+        query["cursor"] = page.next_cursor
+        next_query = query.urlencode()
+
+    response = render(
+        request,
+        "shop/product_list.html",
+        {
+            "products": page,
+            "filter_form": form,
+            "next_query": next_query,
+            **catalog_context(),
+        },
+    )
+    if cacheable:
+        add_validators(response, etag, version / 1000)
+    return response
+
+
+@query_budget(4)
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk)
-    return render(request, "shop/product_detail.html", {"products": product})
-
-
+    try:
+        product = get_product(pk)
+    except Product.DoesNotExist:
+        raise Http404("No Product matches the given query.")
+
+    cacheable = is_cacheable(request)
+    # Strona zmienia się też po przeliczeniu rekomendacji i po każdej zmianie
+    # katalogu (wspólny kontekst strony)
+    version = catalog_version()
+    last_modified = max(
+        product.updated_at.timestamp(),
+        recommendations_version() / 1000,
+        version / 1000,
+    )
+    etag = make_etag("product", product.pk, version, last_modified)
+    if cacheable:
+        response = conditional_response(request, etag, last_modified)
+        if response is not None:
+            return response
+
+    response = render(
+        request,
+        "shop/product_detail.html",
+        {
+            "products": product,
+            "recommended": recommended_for(product.pk),
+            **catalog_context(),
+        },
+    )
+    if cacheable:
+        add_validators(response, etag, last_modified)
+    return response
+
+
+@query_budget(0)
+def media_file(request, path):
+    # W produkcji pliki serwuje serwer WWW, z tymi samymi nagłówkami
+    if not getattr(settings, "SERVE_MEDIA", settings.DEBUG):
+        raise Http404()
+    # Tylko obrazki, nawet gdyby inny plik trafił do MEDIA_ROOT
+    if path.rsplit(".", 1)[-1].lower() not in IMAGE_EXTENSIONS:
+        raise Http404()
+    try:
+        fh = default_storage.open(path)
+    except (OSError, SuspiciousFileOperation):
+        raise Http404()
+    response = FileResponse(fh)
+    if path.startswith(f"{DERIVED_DIR}/"):
+        # Nazwa pochodzi z hasha treści, więc plik nigdy się nie zmieni
+        patch_cache_control(
+            response, public=True, max_age=MEDIA_MAX_AGE, immutable=True
+        )
+    return response
+
+
+@query_budget(4)
+def product_search(request):
+    query = request.GET.get("q", "").strip()
+    try:
+        page = max(1, int(request.GET.get("page", 1)))
+    except ValueError:
+        page = 1
+
+    products, has_next = [], False
+    if query:
+        products, has_next = search_products(query, page, SEARCH_RESULTS_PER_PAGE)
+
+    return render(
+        request,
+        "shop/search.html",
+        {
+            "query": query,
+            "products": products,
+            "page": page,
+            "previous_page": page - 1 if page > 1 else None,
+            "next_page": page + 1 if has_next else None,
+        },
+    )
+
+
+@query_budget(6)
 @user_passes_test(is_admin)
 def add_product(request):
     if request.method == "POST":
-        form = ProductForm(request.POST)
+        form = ProductForm(request.POST, request.FILES)
         if form.is_valid():
             form.save()
             return redirect("product_list")
@@ -100,11 +272,12 @@ def add_product(request):
     return render(request, "shop/add_product.html", {"form": form})
 
 
+@query_budget(7)
 @user_passes_test(is_admin)
 def edit_product(request, pk):
     product = get_object_or_404(Product, pk=pk)
     if request.method == "POST":
-        form = ProductForm(request.POST, instance=product)
+        form = ProductForm(request.POST, request.FILES, instance=product)
         if form.is_valid():
             form.save()
             return redirect("product_list")
@@ -113,6 +286,7 @@ def edit_product(request, pk):
     return render(request, "shop/edit_product.html", {"form": form, "product": product})
 
 
+@query_budget(8)
 @user_passes_test(is_admin)
 def delete_product(request, pk):
     product = get_object_or_404(Product, pk=pk)
@@ -121,17 +295,24 @@ def delete_product(request, pk):
         return redirect("product_list")
     return render(request, "shop/delete_product.html", {"product": product})
 
+@query_budget(4)
 @login_required(login_url='/login/')
 def order_list(request):
-    orders = Order.objects.filter(customer=request.user.customer)
+    orders = Order.objects.filter(customer__user=request.user).select_related(
+        "customer__user"
+    )
     return render(request, "shop/order_list.html", {"orders": orders})
 
 
+@query_budget(4)
 def order_detail(request, pk):
-    orders = get_object_or_404(Order, pk=pk)
+    orders = get_object_or_404(
+        Order.objects.with_items().select_related("customer"), pk=pk
+    )
     return render(request, "shop/order_detail.html", {"orders": orders})
 
 
+@query_budget(29)
 @login_required
 def create_order(request):
     # Sprawdzamy, czy użytkownik ma koszyk
@@ -141,7 +322,7 @@ def create_order(request):
         # Tworzymy formularz na podstawie przesłanych danych
         form = OrderForm(request.POST)
         if form.is_valid():
-            customer = request.user.customer  # Zakładamy, że użytkownik ma przypisanego klienta
+            customer = get_customer(request.user)
             try:
                 # Tworzymy zamówienie i pozycje zamówienia
                 order = form.save_order(cart, customer)
@@ -160,46 +341,136 @@ def create_order(request):
     return render(request, "shop/create_order.html", {"form": form, "cart": cart})
 
 
+@query_budget(3)
+@user_passes_test(is_admin)
+def export_orders(request):
+    form = DateRangeForm(request.GET)
+    if not form.is_valid():
+        return HttpResponse(form.errors.as_text(), status=400)
+    start, end = form.cleaned_data["start"], form.cleaned_data["end"]
+    # Wiersze są pobierane z bazy dopiero podczas wysyłania odpowiedzi
+    response = StreamingHttpResponse(
+        iter_csv(order_rows(start, end)), content_type="text/csv"
+    )
+    filename = f"orders_{start or 'all'}_{end or 'all'}.csv"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@query_budget(5)
+@user_passes_test(is_admin)
+def sales_dashboard(request):
+    form = DateRangeForm(request.GET)
+    end = timezone.localdate()
+    start = end - timedelta(days=SALES_REPORT_DAYS - 1)
+    if form.is_valid():
+        start = form.cleaned_data["start"] or start
+        end = form.cleaned_data["end"] or end
+    # Tylko tabele zbiorcze, niezależnie od rozmiaru historii zamówień
+    report = sales_report(start, end)
+    return render(
+        request,
+        "shop/sales_dashboard.html",
+        {"form": form, "start": start, "end": end, **report},
+    )
+
+
+@query_budget(2)
+@user_passes_test(is_admin)
+def metrics(request):
+    if request.method == "POST" and "reset" in request.POST:
+        registry.reset()
+    return JsonResponse(
+        {"sample_rate": sample_rate(), "views": registry.snapshot()},
+        json_dumps_params={"indent": 2},
+    )
+
+
+def wants_json(request):
+    return "application/json" in request.headers.get("Accept", "")
+
+
+def payment_request_json(payment_request, status=200):
+    response = JsonResponse(
+        {
+            "idempotency_key": payment_request.idempotency_key,
+            "order": payment_request.order_id,
+            "amount": str(payment_request.amount),
+            "status": payment_request.status,
+            "attempts": payment_request.attempts,
+            "error": payment_request.last_error,
+        },
+        status=status,
+    )
+    response["Location"] = reverse(
+        "payment_status", args=[payment_request.idempotency_key]
+    )
+    return response
+
+
+@query_budget(6)
 def process_payment(request, order_id):
-    order = Order.objects.get(id=order_id)
+    order = get_object_or_404(Order, id=order_id)
     if request.method == "POST":
-        amount = float(request.POST.get("amount"))
-        payment = Payment.objects.create(order=order, amount=amount)
-        if payment.process_payment():
-            return redirect("order_detail", order_id=order.id)
-        else:
-            return HttpResponse("Insufficient amount to pay.", status=400)
-    return render(request, "shop/process_payment.html", {"order": order})
-
-
+        data = request.POST.copy()
+        if "Idempotency-Key" in request.headers:
+            data["idempotency_key"] = request.headers["Idempotency-Key"]
+        form = PaymentRequestForm(data)
+        if not form.is_valid():
+            if wants_json(request):
+                return JsonResponse({"errors": form.errors}, status=400)
+            return render(
+                request,
+                "shop/process_payment.html",
+                {"order": order, "form": form},
+                status=400,
+            )
+        try:
+            payment_request, created = submit_payment(
+                order, form.cleaned_data["amount"], form.cleaned_data["idempotency_key"]
+            )
+        except IdempotencyConflict as e:
+            return HttpResponse(str(e), status=409)
+        # Płatność rozlicza worker (manage.py process_payments)
+        if wants_json(request):
+            return payment_request_json(payment_request, status=202)
+        return redirect("payment_status", key=payment_request.idempotency_key)
+    form = PaymentRequestForm(initial={"idempotency_key": uuid4().hex})
+    return render(request, "shop/process_payment.html", {"order": order, "form": form})
+
+
+@query_budget(3)
+def payment_status(request, key):
+    payment_request = get_object_or_404(PaymentRequest, idempotency_key=key)
+    if wants_json(request):
+        return payment_request_json(payment_request)
+    return render(
+        request,
+        "shop/payment_status.html",
+        {
+            "payment_request": payment_request,
+            "poll_seconds": PAYMENT_POLL_SECONDS,
+        },
+    )
+
+
+# Zwykle ok. 20 zapytań, w tym 2 na kolejkę (próg stanu i zadanie e-maila);
+# pierwsze zamówienie tworzy jeszcze profil klienta (do 4 w teście)
+@query_budget(25)
 @login_required
 def checkout(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
+    # Pozycje koszyka są potrzebne tylko do wyświetlenia podsumowania
+    carts = Cart.objects if request.method == "POST" else Cart.objects.with_items()
+    cart, created = carts.get_or_create(user=request.user)
 
     if request.method == "POST":
-        if not hasattr(request.user, 'customer'):
-            return HttpResponse("You must be assigned a customer profile.", status=400)
-        
-        customer = request.user.customer
-
-        # Tworzenie zamówienia
-        order = Order.objects.create(customer=customer)
-
-        # Tworzenie pozycji zamówienia i zmniejszenie stanu magazynowego
-        for item in cart.items.all():
-            # Tworzymy OrderItem dla każdego produktu w koszyku
-            OrderItem.objects.create(
-                order=order, 
-                product=item.product, 
-                quantity=item.quantity
-            )
-
-            # Aktualizacja stanu magazynowego produktu
-            if not item.product.update_stock(item.quantity):
-                return HttpResponse(f"Not enough stock for {item.product.name}.", status=400)
+        customer = get_customer(request.user)
 
-        # Usuwanie pozycji z koszyka po utworzeniu zamówienia
-        cart.items.all().delete()
+        # Zamówienie, pozycje i stany magazynowe w jednej transakcji
+        try:
+            order = place_order(cart, customer)
+        except CheckoutError as e:
+            return HttpResponse(str(e), status=400)
 
         return redirect('order_detail', pk=order.id)
 